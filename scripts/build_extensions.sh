@@ -0,0 +1,27 @@
+#!/bin/bash
+# Ahead-of-time compile the parameter analyzer for Raspberry Pi / edge nodes
+#
+# Requires: pip install cython, plus a C toolchain
+#   (sudo apt install build-essential python3-dev)
+# Python imports the compiled .so in preference to parameter_analyzer.py, so
+# no code changes are needed. Delete the .so to go back to pure Python.
+
+set -e
+
+SRC_DIR="$(cd "$(dirname "$0")/../src" && pwd)"
+cd "$SRC_DIR/hydroponics/analysis"
+
+if ! command -v cythonize > /dev/null; then
+    echo "❌ cythonize not found - run: pip install cython"
+    exit 1
+fi
+
+echo "🔧 Compiling parameter_analyzer with Cython..."
+cythonize -i -3 parameter_analyzer.py
+
+# Keep only the extension module. cythonize builds from the package root,
+# so its build tree lands in src/build, not here
+rm -f parameter_analyzer.c
+rm -rf "$SRC_DIR/build"
+
+echo "✓ Built $(ls parameter_analyzer.*.so)"
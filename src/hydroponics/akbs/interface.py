@@ -3,8 +3,18 @@ AKBS Interface for Sensor System
 Connects live sensor data to aquaponics knowledge base
 """
 
+import os
 import sys
+import time
+import hashlib
+import sqlite3
+import threading
+from functools import lru_cache
+from collections import OrderedDict
 from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
 
 # Add AKBS to Python path
 akbs_path = Path.home() / "aquaponics-knowledge-base-system"
@@ -18,27 +28,366 @@ except ImportError:
     AKBS_AVAILABLE = False
     print("⚠️  AKBS not available - install chromadb")
 
+try:
+    from hydroponics.analysis.trend_analyzer import TrendAnalyzer
+    from hydroponics.analysis.parameter_analyzer import ParameterAnalyzer
+    from hydroponics.database.manager import DatabaseManager
+except ImportError:
+    # Standalone AKBS use without the full control system
+    TrendAnalyzer = None
+    ParameterAnalyzer = None
+    DatabaseManager = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    # Fall back to Chroma's built-in embedding of query_texts
+    SentenceTransformer = None
+
+# Chroma clients shared by all AKBSInterface instances, keyed by db path
+_CLIENTS = {}
+
+
+def _get_client(db_path: Path):
+    """Get or create the persistent Chroma client for a database path"""
+    key = str(db_path)
+    if key not in _CLIENTS:
+        _CLIENTS[key] = chromadb.PersistentClient(
+            path=key,
+            settings=Settings(anonymized_telemetry=False, is_persistent=True)
+        )
+    return _CLIENTS[key]
+
+
+# Same model Chroma uses by default, so vectors match the stored collection
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Knowledge base collection and its HNSW index settings. The KB is
+# thousands of chunks, so a small search_ef keeps queries fast with
+# negligible recall loss. Override via environment for tuning.
+COLLECTION_NAME = "aquaponics_knowledge"
+HNSW_SETTINGS = {
+    "hnsw:space": os.getenv("AKBS_HNSW_SPACE", "cosine"),
+    "hnsw:M": int(os.getenv("AKBS_HNSW_M", "16")),
+    "hnsw:construction_ef": int(os.getenv("AKBS_HNSW_CONSTRUCTION_EF", "100")),
+    "hnsw:search_ef": int(os.getenv("AKBS_HNSW_SEARCH_EF", "32")),
+}
+MIGRATION_BATCH_SIZE = 5000
+
+
+def needs_hnsw_migration(collection) -> bool:
+    """Check whether a collection was built with different HNSW settings"""
+    metadata = collection.metadata or {}
+    return any(metadata.get(key) != value for key, value in HNSW_SETTINGS.items())
+
+
+def migrate_collection_hnsw(client, name: str = COLLECTION_NAME):
+    """
+    Rebuild a collection with HNSW_SETTINGS, keeping stored embeddings
+    
+    Copies everything into a temporary collection first, so the original
+    is only deleted once the copy is complete. Returns the new collection.
+    """
+    old = client.get_collection(name=name)
+    data = old.get(include=["embeddings", "documents", "metadatas"])
+    
+    metadata = {
+        key: value for key, value in (old.metadata or {}).items()
+        if not key.startswith("hnsw:")
+    }
+    metadata.update(HNSW_SETTINGS)
+    
+    temp_name = f"{name}_migrating"
+    try:
+        client.delete_collection(name=temp_name)  # Leftover from a failed run
+    except Exception:
+        pass
+    new = client.create_collection(name=temp_name, metadata=metadata)
+    
+    ids = data['ids']
+    for start in range(0, len(ids), MIGRATION_BATCH_SIZE):
+        end = start + MIGRATION_BATCH_SIZE
+        new.add(
+            ids=ids[start:end],
+            embeddings=data['embeddings'][start:end],
+            documents=data['documents'][start:end],
+            metadatas=data['metadatas'][start:end]
+        )
+    
+    client.delete_collection(name=name)
+    new.modify(name=name)
+    print(f"✓ AKBS collection rebuilt with {HNSW_SETTINGS}: {len(ids)} chunks")
+    return new
+
+
+# Prompt precision per parameter. Readings are rounded to these steps
+# before building prompts, so sensor noise doesn't defeat the query cache.
+_ROUND = {
+    'ph': 0.1,
+    'temperature': 0.5,
+    'do': 0.5,
+    'water_level': 1.0
+}
+
+
+def _quantize(parameter: str, value):
+    """Round a reading to its parameter's prompt precision"""
+    step = _ROUND.get(parameter)
+    if step is None or value is None:
+        return value
+    return round(round(value / step) * step, 2)
+
+
+# On-disk embedding cache shared by every process on this machine
+EMBEDDING_CACHE_PATH = Path.home() / ".aquaponics" / "embed_cache.db"
+
+# Longest document excerpt returned per result
+MAX_CONTENT_CHARS = 500
+
+
+def _truncate(doc: str) -> str:
+    """Trim document to MAX_CONTENT_CHARS, marking cut text with '...'"""
+    if len(doc) <= MAX_CONTENT_CHARS:
+        return doc
+    return doc[:MAX_CONTENT_CHARS] + '...'
+
+
+class QueryCache:
+    """Thread-safe LRU cache with TTL for knowledge base query results"""
+    
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(question: str, n_results: int) -> str:
+        """Build cache key from query parameters"""
+        return hashlib.sha256(f"{question}|{n_results}".encode()).hexdigest()
+    
+    def get(self, key: str) -> Optional[dict]:
+        """Return cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key: str, value: dict):
+        """Store value, evicting least recently used entries if full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> dict:
+        """Cache statistics for monitoring"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+
+class EmbeddingStore:
+    """
+    Persistent SQLite cache of query embeddings
+    Survives restarts so prompts are not re-embedded after every reload.
+    Keys include the model name, so changing models never returns stale vectors.
+    """
+    
+    def __init__(self, path: Path = EMBEDDING_CACHE_PATH, max_age_days: int = 30):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS emb (
+                hash BLOB PRIMARY KEY,
+                vec BLOB,
+                ts INTEGER
+            )
+        """)
+        self.conn.commit()
+        self.prune(max_age_days)
+    
+    @staticmethod
+    def _hash(text: str) -> bytes:
+        """Cache key for text under the current embedding model"""
+        return hashlib.sha256(f"{EMBEDDING_MODEL}|{text}".encode()).digest()
+    
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Return stored embedding for text, or None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT vec FROM emb WHERE hash = ?", (self._hash(text),)
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+    
+    def put(self, text: str, vector) -> None:
+        """Store embedding for text"""
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO emb (hash, vec, ts) VALUES (?, ?, ?)",
+                (self._hash(text), blob, int(time.time()))
+            )
+            self.conn.commit()
+    
+    def prune(self, max_age_days: int) -> None:
+        """Delete embeddings older than max_age_days"""
+        cutoff = int(time.time()) - max_age_days * 86400
+        with self._lock:
+            self.conn.execute("DELETE FROM emb WHERE ts < ?", (cutoff,))
+            self.conn.commit()
+
 
 class AKBSInterface:
     """Interface to query AKBS knowledge base with sensor context"""
     
+    # Question templates for get_parameter_info
+    _PARAM_QUERY_FMT = {
+        'ph': "pH is {v}, is this optimal? What should I do?",
+        'temperature': "Water temperature is {v}°C, is this optimal?",
+        'do': "Dissolved oxygen is {v} mg/L, is this acceptable?",
+        'water_level': "Water level is {v} cm, recommendations?"
+    }
+    
+    # Context lines for query_with_sensor_context, in prompt order
+    _CONTEXT_LINES = (
+        ('ph', "- pH: {:.2f}"),
+        ('temperature', "- Temperature: {:.1f}°C"),
+        ('do', "- Dissolved Oxygen: {:.1f} mg/L"),
+        ('water_level', "- Water Level: {:.1f} cm")
+    )
+    
     def __init__(self):
         self.available = AKBS_AVAILABLE
         self.collection = None
+        self._cache = QueryCache(max_size=512, ttl_seconds=300)
+        self._embedder = None
+        self._embed_store = None
+        self._embed_cached = lru_cache(maxsize=1024)(self._encode)
+        
+        # Analyzers are created on first use and reused across calls
+        self._db = None
+        self._trend = None
+        self._param = None
         
         if AKBS_AVAILABLE:
             try:
                 db_path = akbs_path / "data" / "knowledge_db"
-                self.client = chromadb.PersistentClient(
-                    path=str(db_path),
-                    settings=Settings(anonymized_telemetry=False)
-                )
-                self.collection = self.client.get_collection(name="aquaponics_knowledge")
+                self.client = _get_client(db_path)
+                self.collection = self.client.get_collection(name=COLLECTION_NAME)
+                if needs_hnsw_migration(self.collection):
+                    if os.getenv("AKBS_HNSW_MIGRATE") == "1":
+                        self.collection = migrate_collection_hnsw(self.client)
+                    else:
+                        print("ℹ️  AKBS collection uses default HNSW settings; "
+                              "set AKBS_HNSW_MIGRATE=1 to rebuild for faster queries")
                 chunk_count = self.collection.count()
                 print(f"✓ AKBS connected: {chunk_count} chunks available")
             except Exception as e:
                 print(f"⚠️  AKBS connection failed: {e}")
                 self.available = False
+        
+        if self.available and SentenceTransformer is not None:
+            try:
+                self._embedder = SentenceTransformer(EMBEDDING_MODEL)
+            except Exception as e:
+                print(f"⚠️  Embedding model unavailable, using Chroma default: {e}")
+                self._embedder = None
+        
+        if self._embedder is not None:
+            try:
+                self._embed_store = EmbeddingStore()
+            except Exception as e:
+                print(f"⚠️  Embedding cache unavailable: {e}")
+    
+    def _init_analyzers(self):
+        """Create database and analyzer objects once"""
+        if self._param is not None:
+            return
+        
+        self._db = DatabaseManager()
+        self._trend = TrendAnalyzer(self._db)
+        self._param = ParameterAnalyzer()
+    
+    def _encode(self, text: str) -> tuple:
+        """Embed a single text, checking the on-disk cache before the model"""
+        if self._embed_store is not None:
+            stored = self._embed_store.get(text)
+            if stored is not None:
+                return tuple(stored.tolist())
+        
+        vector = self._embedder.encode(text)
+        if self._embed_store is not None:
+            self._embed_store.put(text, vector)
+        return tuple(np.asarray(vector).tolist())
+    
+    def _embed(self, text: str) -> list:
+        """Embed text once; repeated prompts reuse the cached vector"""
+        return list(self._embed_cached(text))
+    
+    def _collection_query(self, questions: List[str], n_results: int) -> dict:
+        """Run one collection search for all questions, reusing cached embeddings"""
+        if self._embedder is not None:
+            return self.collection.query(
+                query_embeddings=[self._embed(q) for q in questions],
+                n_results=n_results
+            )
+        return self.collection.query(
+            query_texts=questions,
+            n_results=n_results
+        )
+    
+    def _format_results(self, results: dict, index: int) -> list:
+        """Format the results for one question of a collection query"""
+        docs = results['documents'][index] if results['documents'] else None
+        if not docs:
+            return []
+        
+        return [
+            {
+                'content': _truncate(doc),
+                'source': meta.get('source', 'Unknown'),
+                'relevance': round(1 - dist, 3)  # Convert distance to relevance
+            }
+            for doc, meta, dist in zip(
+                docs,
+                results['metadatas'][index],
+                results['distances'][index]
+            )
+        ]
     
     def query(self, question: str, n_results: int = 3) -> dict:
         """
@@ -56,45 +405,63 @@ class AKBSInterface:
             ]
         }
         """
+        return self.query_batch([question], n_results=n_results)[0]
+    
+    def query_batch(self, questions: List[str], n_results: int = 3) -> List[dict]:
+        """
+        Query knowledge base with several questions in one search
+        
+        Cached questions are answered directly; the rest are sent to
+        ChromaDB as a single batch. Returns one result dict per question,
+        in the same format as query().
+        """
         if not self.available or not self.collection:
-            return {
-                'available': False,
-                'results': [],
-                'error': 'AKBS not available'
-            }
+            return [
+                {
+                    'available': False,
+                    'results': [],
+                    'error': 'AKBS not available'
+                }
+                for _ in questions
+            ]
+        
+        responses = [None] * len(questions)
+        pending = []
+        for i, question in enumerate(questions):
+            cached = self._cache.get(QueryCache.make_key(question, n_results))
+            if cached is not None:
+                responses[i] = cached
+            else:
+                pending.append(i)
+        
+        if not pending:
+            return responses
         
         try:
-            results = self.collection.query(
-                query_texts=[question],
-                n_results=n_results
-            )
-            
-            # Format results
-            formatted_results = []
-            if results['documents'][0]:
-                for doc, meta, dist in zip(
-                    results['documents'][0],
-                    results['metadatas'][0],
-                    results['distances'][0]
-                ):
-                    formatted_results.append({
-                        'content': doc[:500] + '...' if len(doc) > 500 else doc,
-                        'source': meta.get('source', 'Unknown'),
-                        'relevance': round(1 - dist, 3)  # Convert distance to relevance
-                    })
+            results = self._collection_query([questions[i] for i in pending], n_results)
             
-            return {
-                'available': True,
-                'results': formatted_results,
-                'query': question
-            }
+            for batch_index, i in enumerate(pending):
+                response = {
+                    'available': True,
+                    'results': self._format_results(results, batch_index),
+                    'query': questions[i]
+                }
+                self._cache.put(QueryCache.make_key(questions[i], n_results), response)
+                responses[i] = response
             
         except Exception as e:
-            return {
-                'available': False,
-                'results': [],
-                'error': str(e)
-            }
+            for i in pending:
+                responses[i] = {
+                    'available': False,
+                    'results': [],
+                    'error': str(e)
+                }
+        
+        return responses
+    
+    def get_cache_stats(self) -> dict:
+        """Get query cache statistics"""
+        return self._cache.stats()
     
     def query_with_sensor_context(self, sensor_data: dict, question: str = None) -> dict:
         """
@@ -104,19 +471,16 @@ class AKBSInterface:
             sensor_data: dict with pH, temp, DO, level
             question: optional specific question
         """
-        # Build context from sensor data
-        context_parts = ["Current system readings:"]
-        
-        if 'ph' in sensor_data:
-            context_parts.append(f"- pH: {sensor_data['ph']:.2f}")
-        if 'temperature' in sensor_data:
-            context_parts.append(f"- Temperature: {sensor_data['temperature']:.1f}°C")
-        if 'do' in sensor_data:
-            context_parts.append(f"- Dissolved Oxygen: {sensor_data['do']:.1f} mg/L")
-        if 'water_level' in sensor_data:
-            context_parts.append(f"- Water Level: {sensor_data['water_level']:.1f} cm")
+        sensor_data = {
+            key: _quantize(key, value) for key, value in sensor_data.items()
+        }
         
-        context = "\n".join(context_parts)
+        # Build context from sensor data
+        context = "\n".join([
+            "Current system readings:",
+            *(line.format(sensor_data[key])
+              for key, line in self._CONTEXT_LINES if key in sensor_data)
+        ])
         
         # Add user question if provided
         if question:
@@ -134,32 +498,39 @@ class AKBSInterface:
             parameter: 'ph', 'temperature', 'do', or 'water_level'
             value: current reading
         """
-        queries = {
-            'ph': f"pH is {value}, is this optimal? What should I do?",
-            'temperature': f"Water temperature is {value}°C, is this optimal?",
-            'do': f"Dissolved oxygen is {value} mg/L, is this acceptable?",
-            'water_level': f"Water level is {value} cm, recommendations?"
-        }
-        
-        query = queries.get(parameter, f"{parameter} is {value}, more information?")
+        value = _quantize(parameter, value)
+        template = self._PARAM_QUERY_FMT.get(parameter)
+        if template:
+            query = template.format(v=value)
+        else:
+            query = f"{parameter} is {value}, more information?"
         return self.query(query, n_results=2)
     
     def get_intelligent_analysis(self, parameter: str, value: float, system_context: dict = None) -> dict:
         """
         Get intelligent analysis combining rule-based reasoning + knowledge base
         """
-        from hydroponics.analysis.parameter_analyzer import ParameterAnalyzer
+        if ParameterAnalyzer is None:
+            return {
+                'intelligent_analysis': {
+                    'status': 'unknown',
+                    'explanation': 'Analysis modules not available'
+                },
+                'textbook_knowledge': self.get_parameter_info(parameter, value),
+                'combined': False
+            }
         
-        analyzer = ParameterAnalyzer()
+        self._init_analyzers()
+        analyzer = self._param
         
         # Get rule-based analysis
         if parameter == 'ph':
-            rule_analysis = analyzer.analyze_ph(value)
+            rule_analysis = analyzer.analyze_ph(value).to_dict()
         elif parameter == 'temperature':
-            rule_analysis = analyzer.analyze_temperature(value)
+            rule_analysis = analyzer.analyze_temperature(value).to_dict()
         elif parameter == 'do':
             temp = system_context.get('temperature', 20) if system_context else 20
-            rule_analysis = analyzer.analyze_do(value, temp)
+            rule_analysis = analyzer.analyze_do(value, temp).to_dict()
         else:
             rule_analysis = {
                 'status': 'unknown',
@@ -180,20 +551,19 @@ class AKBSInterface:
         """
         LAYER 3 & 4: Predictive + Correlation Analysis
         """
-        from hydroponics.analysis.trend_analyzer import TrendAnalyzer
-        from hydroponics.analysis.parameter_analyzer import ParameterAnalyzer
-        from hydroponics.database.manager import DatabaseManager
+        if TrendAnalyzer is None:
+            return {
+                'available': False,
+                'error': 'Analysis modules not available'
+            }
         
-        # Initialize analyzers
-        db = DatabaseManager()
-        trend_analyzer = TrendAnalyzer(db)
-        param_analyzer = ParameterAnalyzer()
+        self._init_analyzers()
         
         # Get trend analysis
-        trend_analysis = trend_analyzer.analyze_all_trends()
+        trend_analysis = self._trend.analyze_all_trends()
         
         # Get correlation analysis with trends
-        correlation = param_analyzer.analyze_correlations_advanced(
+        correlation = self._param.analyze_correlations_advanced(
             sensor_data,
             trend_analysis['trends']
         )
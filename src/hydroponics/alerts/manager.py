@@ -4,8 +4,16 @@ Supports email, SMS (via Twilio), and push notifications
 """
 
 import logging
+import smtplib
+import sys
+import time
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 logger = logging.getLogger(__name__)
 
@@ -21,38 +29,250 @@ except ImportError:
     logger.warning("twilio not installed, SMS alerts unavailable")
     TwilioClient = None
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Threshold classification codes, in the order bounds are checked
+LEVEL_OK = 0
+LEVEL_WARNING_LOW = 1
+LEVEL_WARNING_HIGH = 2
+LEVEL_CRITICAL_LOW = 3
+LEVEL_CRITICAL_HIGH = 4
+
+# Code -> (alert level, threshold key, message template)
+_ALERT_KINDS = {
+    LEVEL_CRITICAL_LOW: ('critical', 'critical_low', "CRITICAL: {sensor} is dangerously low ({value:.2f})"),
+    LEVEL_CRITICAL_HIGH: ('critical', 'critical_high', "CRITICAL: {sensor} is dangerously high ({value:.2f})"),
+    LEVEL_WARNING_LOW: ('warning', 'warning_low', "WARNING: {sensor} is low ({value:.2f})"),
+    LEVEL_WARNING_HIGH: ('warning', 'warning_high', "WARNING: {sensor} is high ({value:.2f})"),
+}
+
+
+def _classify_loop(values, crit_low, warn_low, warn_high, crit_high):
+    """
+    Classify each value against its bounds (compiled with Numba if available)
+    NaN values or bounds never match, so missing data stays LEVEL_OK.
+    """
+    codes = np.zeros(values.shape[0], dtype=np.int8)
+    for i in range(values.shape[0]):
+        v = values[i]
+        if v < crit_low[i]:
+            codes[i] = LEVEL_CRITICAL_LOW
+        elif v > crit_high[i]:
+            codes[i] = LEVEL_CRITICAL_HIGH
+        elif v < warn_low[i]:
+            codes[i] = LEVEL_WARNING_LOW
+        elif v > warn_high[i]:
+            codes[i] = LEVEL_WARNING_HIGH
+    return codes
+
+
+def _classify_numpy(values, crit_low, warn_low, warn_high, crit_high):
+    """Vectorized NumPy equivalent of _classify_loop"""
+    codes = np.zeros(values.shape[0], dtype=np.int8)
+    # Assign lowest priority first so more severe levels overwrite
+    codes[values > warn_high] = LEVEL_WARNING_HIGH
+    codes[values < warn_low] = LEVEL_WARNING_LOW
+    codes[values > crit_high] = LEVEL_CRITICAL_HIGH
+    codes[values < crit_low] = LEVEL_CRITICAL_LOW
+    return codes
+
+
+# No fastmath: it assumes no NaNs, and NaN marks missing readings/bounds
+_classify_all = njit(cache=True)(_classify_loop) if njit else _classify_numpy
+
+
+def _rolling_zscore_loop(values, window, min_std):
+    """
+    Z-score of each reading against the `window` readings before it
+    One pass per column with a sliding Welford mean/variance (compiled
+    with Numba if available). The spread is floored at min_std per column
+    so flat or quantized signals don't turn a tiny step into a huge z.
+    NaN readings are skipped; z is NaN with fewer than 2 prior readings.
+    """
+    rows, cols = values.shape
+    z = np.full((rows, cols), np.nan)
+    for c in range(cols):
+        count = 0
+        mean = 0.0
+        m2 = 0.0
+        for i in range(rows):
+            v = values[i, c]
+            if v == v and count >= 2:
+                std = max(np.sqrt(max(m2, 0.0) / (count - 1)), min_std[c])
+                z[i, c] = (v - mean) / std
+            
+            # Slide the window: add this reading, drop the oldest
+            if v == v:
+                count += 1
+                delta = v - mean
+                mean += delta / count
+                m2 += delta * (v - mean)
+            if i >= window:
+                old = values[i - window, c]
+                if old == old:
+                    count -= 1
+                    if count == 0:
+                        mean = 0.0
+                        m2 = 0.0
+                    else:
+                        new_mean = mean - (old - mean) / count
+                        m2 -= (old - mean) * (old - new_mean)
+                        mean = new_mean
+    return z
+
+
+def _rolling_zscore_numpy(values, window, min_std):
+    """Vectorized NumPy equivalent of _rolling_zscore_loop"""
+    rows, cols = values.shape
+    if rows == 0:
+        return np.full((rows, cols), np.nan)
+    
+    # Row i's window is padded[i:i + window], the readings before it
+    padded = np.vstack([np.full((window, cols), np.nan), values[:-1]])
+    windows = sliding_window_view(padded, window, axis=0)
+    count = np.sum(~np.isnan(windows), axis=-1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN / short windows
+        mean = np.nanmean(windows, axis=-1)
+        std = np.maximum(np.nanstd(windows, axis=-1, ddof=1), min_std)
+        z = (values - mean) / std
+    z[count < 2] = np.nan
+    return z
+
+
+_rolling_zscore = njit(cache=True)(_rolling_zscore_loop) if njit else _rolling_zscore_numpy
+
+
+# Water level gets the same advice whichever side of optimal it is on
+_WATER_LEVEL_RECOMMENDATIONS = [
+    "Check for leaks",
+    "Refill reservoir",
+    "Verify auto top-off system working",
+    "Check pump for proper operation"
+]
+
+# Recommended actions per (sensor group, direction from optimal range).
+# Temperature sensors share the 'temp' group.
+_RECOMMENDATIONS = {
+    ('ph', 'low'): [
+        "Add pH Up solution slowly (0.2 units at a time)",
+        "Wait 30 minutes and retest",
+        "Check if nutrient solution is old (replace if needed)",
+        "Verify calibration of pH sensor"
+    ],
+    ('ph', 'high'): [
+        "Add pH Down solution slowly (0.2 units at a time)",
+        "Wait 30 minutes and retest",
+        "Check aeration (high pH can indicate CO2 depletion)",
+        "Verify calibration of pH sensor"
+    ],
+    ('do', 'low'): [
+        "IMMEDIATE: Increase aeration (add air stones)",
+        "Check water temperature (warmer = less DO)",
+        "Reduce feeding if fish present",
+        "Check for dead organisms in system",
+        "Verify air pump is working",
+        "If fish gasping at surface: 50% water change NOW"
+    ],
+    ('ec', 'low'): [
+        "Add nutrient solution",
+        "Check plants for deficiency symptoms",
+        "Verify EC sensor calibration"
+    ],
+    ('ec', 'high'): [
+        "Add fresh water to dilute",
+        "Check for salt buildup",
+        "Flush system if EC very high",
+        "Reduce nutrient dosing"
+    ],
+    ('temp', 'low'): [
+        "Turn on water heater",
+        "Check heater is functioning",
+        "Insulate reservoir/tanks",
+        "Check ambient temperature"
+    ],
+    ('temp', 'high'): [
+        "Turn off heater",
+        "Increase ventilation/cooling",
+        "Add ice packs if emergency",
+        "Consider chiller for long-term solution"
+    ],
+    ('water_level_percent', 'low'): _WATER_LEVEL_RECOMMENDATIONS,
+    ('water_level_percent', 'high'): _WATER_LEVEL_RECOMMENDATIONS,
+}
+
+# Recommendations are static, so render the HTML once at import
+_RECOMMENDATIONS_HTML = {
+    key: "".join(f"<li>{rec}</li>\n" for rec in recs)
+    for key, recs in _RECOMMENDATIONS.items()
+}
+_DEFAULT_RECOMMENDATION_HTML = "<li>Monitor situation closely</li>"
+
+# HTML email body, filled with str.format_map per alert
+_EMAIL_TEMPLATE = """
+        <html>
+        <body style="font-family: Arial, sans-serif;">
+            <h2 style="color: {color};">
+                {level} ALERT
+            </h2>
+            <p><strong>Sensor:</strong> {sensor}</p>
+            <p><strong>Current Value:</strong> {value:.2f}</p>
+            <p><strong>Threshold:</strong> {threshold:.2f}</p>
+            <p><strong>Time:</strong> {timestamp}</p>
+            <h3>Recommended Actions:</h3>
+            <ul>
+                {recommendations}
+            </ul>
+            <p><em>This is an automated alert from your STEM DREAM Aquaponics system.</em></p>
+        </body>
+        </html>
+        """
+
 
 class AlertManager:
     """Manage system alerts and notifications"""
     
     def __init__(self, config):
         self.config = config
-        self.alert_history = {}  # Track recent alerts to avoid spam
+        self.alert_history = {}  # (sensor, level) -> monotonic time last sent
         self.cooldown_minutes = 30  # Minimum time between same alerts
+        self._cooldown_seconds = self.cooldown_minutes * 60
+        
+        # Drift detection: flag a reading this many standard deviations
+        # from the previous trend_window readings, before hard limits trip
+        self.trend_window = 20
+        self.trend_zscore = 4.0
         
-        # Initialize notification services
+        # Notification clients are created on first use so startup never
+        # waits on an SMTP handshake for alerts that may never fire
         self.email_client = None
         self.sms_client = None
+        self._email_factory = None
+        self._sms_factory = None
+        
+        # Notifications are sent in the background so sensor checks never
+        # wait on SMTP/Twilio round trips
+        self._notify_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="alerts")
+        self._email_lock = threading.Lock()  # SMTP connection is not thread-safe
         
         if config.email_enabled and yagmail:
-            try:
-                self.email_client = yagmail.SMTP(
-                    config.email_from,
-                    config.email_password
-                )
-                logger.info("Email alerts enabled")
-            except Exception as e:
-                logger.error(f"Error initializing email: {e}")
+            self._email_factory = lambda: yagmail.SMTP(
+                config.email_from,
+                config.email_password
+            )
+            logger.info("Email alerts enabled")
         
         if config.sms_enabled and TwilioClient:
-            try:
-                self.sms_client = TwilioClient(
-                    config.twilio_account_sid,
-                    config.twilio_auth_token
-                )
-                logger.info("SMS alerts enabled")
-            except Exception as e:
-                logger.error(f"Error initializing SMS: {e}")
+            # Twilio's client keeps its own pooled HTTP session
+            self._sms_factory = lambda: TwilioClient(
+                config.twilio_account_sid,
+                config.twilio_auth_token
+            )
+            logger.info("SMS alerts enabled")
         
         # Define alert thresholds
         self.thresholds = {
@@ -103,6 +323,47 @@ class AlertManager:
                 'optimal_max': 90.0
             }
         }
+        
+        self._build_threshold_arrays()
+    
+    def _build_threshold_arrays(self):
+        """
+        Flatten thresholds into parallel arrays (one slot per sensor)
+        Missing bounds are NaN so they never trigger. Call again after
+        editing self.thresholds.
+        """
+        # Interned names make (sensor, level) cooldown keys cheap to hash/compare
+        self._sensor_index = {sys.intern(name): i for i, name in enumerate(self.thresholds)}
+        
+        def column(key):
+            return np.array(
+                [t.get(key, np.nan) for t in self.thresholds.values()],
+                dtype=np.float64
+            )
+        
+        self._crit_low = column('critical_low')
+        self._warn_low = column('warning_low')
+        self._warn_high = column('warning_high')
+        self._crit_high = column('critical_high')
+        
+        opt_min = column('optimal_min')
+        opt_max = column('optimal_max')
+        
+        # Smallest spread trusted for drift z-scores: 5% of the optimal band
+        self._trend_min_std = np.nan_to_num((opt_max - opt_min) * 0.05)
+        
+        # (sensor, optimal_min, optimal_max) for the all-healthy fast path in
+        # check_thresholds. Only sound if every sensor's optimal band lies
+        # inside its alert bounds; otherwise None and every tick classifies.
+        lower = np.fmax(self._warn_low, self._crit_low)
+        upper = np.fmin(self._warn_high, self._crit_high)
+        usable = (~np.isnan(opt_min) & ~np.isnan(opt_max)
+                  & (np.isnan(lower) | (opt_min >= lower))
+                  & (np.isnan(upper) | (opt_max <= upper)))
+        self._optimal_bounds = (
+            tuple(zip(self._sensor_index, opt_min.tolist(), opt_max.tolist()))
+            if usable.all() else None
+        )
     
     def check_thresholds(self, sensors: Dict) -> List[Dict]:
         """
@@ -111,230 +372,270 @@ class AlertManager:
         """
         alerts = []
         
-        for sensor_name, value in sensors.items():
-            if value is None:
-                continue
+        # Common case: every reading in its optimal band, so nothing can be
+        # out of range; skip building arrays and classifying (None = no data)
+        if self._optimal_bounds is not None and all(
+            lo <= value <= hi
+            for name, lo, hi in self._optimal_bounds
+            if (value := sensors.get(name)) is not None
+        ):
+            return alerts
+        
+        timestamp = datetime.now().isoformat()
+        
+        # Classify every monitored sensor at once; None/missing become NaN
+        names = list(self._sensor_index)
+        values = np.array(
+            [sensors.get(name) for name in names],
+            dtype=np.float64
+        )
+        codes = _classify_all(
+            values,
+            self._crit_low,
+            self._warn_low,
+            self._warn_high,
+            self._crit_high
+        )
+        
+        # Common case: everything in range
+        if not codes.any():
+            return alerts
+        
+        # Only build alert dicts for the (few) sensors out of range
+        now = time.monotonic()
+        for i in np.flatnonzero(codes):
+            sensor_name = names[i]
+            code = int(codes[i])
+            alert_key = (sensor_name, _ALERT_KINDS[code][0])
             
-            if sensor_name not in self.thresholds:
+            # Skip alerts we've already sent recently
+            if self._is_in_cooldown_key(alert_key, now):
                 continue
+            self.alert_history[alert_key] = now
             
-            thresholds = self.thresholds[sensor_name]
-            alert = self._check_sensor_threshold(sensor_name, value, thresholds)
+            alert = self._build_alert(sensor_name, sensors[sensor_name], code, timestamp)
+            alerts.append(alert)
             
-            if alert:
-                # Check if we've already sent this alert recently
-                if not self._is_in_cooldown(alert):
-                    alerts.append(alert)
-                    self._record_alert(alert)
-                    
-                    # Send notifications for critical alerts
-                    if alert['level'] == 'critical':
-                        self._send_notifications(alert)
+            # Send notifications for critical alerts
+            if alert['level'] == 'critical':
+                self._send_notifications(alert)
         
         return alerts
     
-    def _check_sensor_threshold(
-        self,
-        sensor_name: str,
-        value: float,
-        thresholds: Dict
-    ) -> Optional[Dict]:
-        """Check a single sensor against thresholds"""
+    def check_thresholds_batch(self, readings, timestamps: Optional[List[str]] = None) -> List[List[Dict]]:
+        """
+        Classify many timesteps at once (history backfill / replay)
         
-        # Critical low
-        if 'critical_low' in thresholds and value < thresholds['critical_low']:
-            return {
-                'timestamp': datetime.now().isoformat(),
-                'level': 'critical',
-                'sensor': sensor_name,
-                'value': value,
-                'threshold': thresholds['critical_low'],
-                'message': f"CRITICAL: {sensor_name} is dangerously low ({value:.2f})"
-            }
+        Args:
+            readings: 2D array of shape (T, S) with columns in sensor_order(),
+                or a DataFrame with sensor-named columns (missing ones = NaN)
+            timestamps: optional timestamp per row for the alert dicts
         
-        # Critical high
-        if 'critical_high' in thresholds and value > thresholds['critical_high']:
-            return {
-                'timestamp': datetime.now().isoformat(),
-                'level': 'critical',
-                'sensor': sensor_name,
-                'value': value,
-                'threshold': thresholds['critical_high'],
-                'message': f"CRITICAL: {sensor_name} is dangerously high ({value:.2f})"
-            }
+        Returns one list of alerts per row. Cooldown and notifications are
+        not applied, so results show every breach. Raises ValueError if the
+        array does not have one column per sensor.
+        """
+        names = self.sensor_order()
+        if hasattr(readings, 'columns'):
+            readings = np.column_stack([
+                np.asarray(readings[name], dtype=np.float64) if name in readings.columns
+                else np.full(len(readings), np.nan)
+                for name in names
+            ])
+        values = self._sensor_rows(readings)
+        rows = values.shape[0]
         
-        # Warning low
-        if 'warning_low' in thresholds and value < thresholds['warning_low']:
-            return {
-                'timestamp': datetime.now().isoformat(),
-                'level': 'warning',
-                'sensor': sensor_name,
-                'value': value,
-                'threshold': thresholds['warning_low'],
-                'message': f"WARNING: {sensor_name} is low ({value:.2f})"
-            }
+        codes = _classify_all(
+            values.ravel(),
+            np.tile(self._crit_low, rows),
+            np.tile(self._warn_low, rows),
+            np.tile(self._warn_high, rows),
+            np.tile(self._crit_high, rows)
+        ).reshape(values.shape)
+        
+        results = [[] for _ in range(rows)]
+        for row, col in np.argwhere(codes):
+            results[row].append(self._build_alert(
+                names[col],
+                float(values[row, col]),
+                int(codes[row, col]),
+                timestamps[row] if timestamps is not None else None
+            ))
+        return results
+    
+    def sensor_order(self) -> List[str]:
+        """Sensor column order used by the threshold arrays"""
+        return list(self._sensor_index)
+    
+    def _sensor_rows(self, readings) -> np.ndarray:
+        """
+        Readings as a (T, S) float array with columns in sensor_order()
+        A 1-D input is accepted only as a single row (or as empty input);
+        any other shape raises ValueError rather than being reshaped.
+        """
+        values = np.asarray(readings, dtype=np.float64)
+        width = len(self._sensor_index)
+        if values.ndim == 1 and values.shape[0] in (width, 0):
+            return values.reshape(-1, width)
+        if values.ndim != 2 or values.shape[1] != width:
+            raise ValueError(
+                f"Expected readings of shape (T, {width}) in sensor_order(), got {values.shape}"
+            )
+        return values
+    
+    def check_trends(self, history) -> List[Dict]:
+        """
+        Flag sensors whose latest reading jumps away from recent history
         
-        # Warning high
-        if 'warning_high' in thresholds and value > thresholds['warning_high']:
-            return {
-                'timestamp': datetime.now().isoformat(),
+        Args:
+            history: recent readings, oldest first, shape (T, S) with
+                columns in sensor_order() (None/NaN for missing values)
+        
+        Returns alerts for the last row; cooldown applies per sensor.
+        Raises ValueError if the rows do not have one value per sensor.
+        """
+        names = self.sensor_order()
+        values = self._sensor_rows(history)
+        if values.shape[0] < 3:
+            return []
+        
+        # Only the newest row matters, so score just the window ending there
+        values = values[-(self.trend_window + 1):]
+        latest = _rolling_zscore(values, self.trend_window, self._trend_min_std)[-1]
+        
+        alerts = []
+        timestamp = datetime.now().isoformat()
+        now = time.monotonic()
+        for i in np.flatnonzero(np.abs(latest) >= self.trend_zscore):
+            sensor_name = names[i]
+            alert_key = (sensor_name, 'trend')
+            if self._is_in_cooldown_key(alert_key, now):
+                continue
+            self.alert_history[alert_key] = now
+            
+            value = float(values[-1, i])
+            zscore = float(latest[i])
+            alerts.append({
+                'timestamp': timestamp,
                 'level': 'warning',
                 'sensor': sensor_name,
                 'value': value,
-                'threshold': thresholds['warning_high'],
-                'message': f"WARNING: {sensor_name} is high ({value:.2f})"
-            }
-        
-        return None
+                'threshold': self.trend_zscore,
+                'zscore': zscore,
+                'message': f"TREND: {sensor_name} shifted sharply ({value:.2f}, {zscore:+.1f} sigma)"
+            })
+        return alerts
     
-    def _is_in_cooldown(self, alert: Dict) -> bool:
-        """Check if similar alert was sent recently"""
-        alert_key = f"{alert['sensor']}_{alert['level']}"
-        
-        if alert_key in self.alert_history:
-            last_sent = self.alert_history[alert_key]
-            time_since = datetime.now() - last_sent
-            
-            if time_since < timedelta(minutes=self.cooldown_minutes):
-                return True
-        
-        return False
+    def warm_up(self):
+        """Compile the Numba kernels now so the first sensor check isn't stalled"""
+        values = np.zeros((3, len(self._sensor_index)))
+        _classify_all(values[0], self._crit_low, self._warn_low, self._warn_high, self._crit_high)
+        _rolling_zscore(values, self.trend_window, self._trend_min_std)
     
-    def _record_alert(self, alert: Dict):
-        """Record alert in history"""
-        alert_key = f"{alert['sensor']}_{alert['level']}"
-        self.alert_history[alert_key] = datetime.now()
+    def _build_alert(
+        self,
+        sensor_name: str,
+        value: float,
+        code: int,
+        timestamp: str
+    ) -> Dict:
+        """Build the alert dict for a classified reading"""
+        thresholds = self.thresholds[sensor_name]
+        level, threshold_key, message = _ALERT_KINDS[code]
+        return {
+            'timestamp': timestamp,
+            'level': level,
+            'sensor': sensor_name,
+            'value': value,
+            'threshold': thresholds[threshold_key],
+            'message': message.format(sensor=sensor_name, value=value)
+        }
+    
+    def _is_in_cooldown_key(self, alert_key: tuple, now: Optional[float] = None) -> bool:
+        """Check cooldown for a prebuilt (sensor, level) key"""
+        if now is None:
+            now = time.monotonic()
+        return (now - self.alert_history.get(alert_key, float('-inf'))) < self._cooldown_seconds
     
     def _send_notifications(self, alert: Dict):
-        """Send notifications via enabled channels"""
-        # Email notification
-        if self.email_client and self.config.email_to:
-            try:
-                subject = f"AQUAPONICS ALERT: {alert['message']}"
-                body = self._format_alert_email(alert)
-                self.email_client.send(
-                    to=self.config.email_to,
-                    subject=subject,
-                    contents=body
-                )
-                logger.info(f"Email alert sent: {alert['message']}")
-            except Exception as e:
-                logger.error(f"Error sending email alert: {e}")
+        """Queue notifications via enabled channels"""
+        if self._email_factory and self.config.email_to:
+            self._notify_pool.submit(self._send_email, alert)
         
-        # SMS notification
-        if self.sms_client and self.config.sms_to:
-            try:
-                message = f"AQUAPONICS ALERT: {alert['message']}"
-                self.sms_client.messages.create(
-                    body=message,
-                    from_=self.config.twilio_from,
-                    to=self.config.sms_to
-                )
-                logger.info(f"SMS alert sent: {alert['message']}")
-            except Exception as e:
-                logger.error(f"Error sending SMS alert: {e}")
+        if self._sms_factory and self.config.sms_to:
+            self._notify_pool.submit(self._send_sms, alert)
+    
+    def _get_email_client(self):
+        """Get the SMTP client, connecting on first use"""
+        if self.email_client is None:
+            self.email_client = self._email_factory()
+        return self.email_client
+    
+    def _get_sms_client(self):
+        """Get the Twilio client, creating it on first use"""
+        if self.sms_client is None:
+            self.sms_client = self._sms_factory()
+        return self.sms_client
+    
+    def _send_email(self, alert: Dict):
+        """Send email notification (runs on the notification pool)"""
+        try:
+            subject = f"AQUAPONICS ALERT: {alert['message']}"
+            body = self._format_alert_email(alert)
+            with self._email_lock:
+                try:
+                    self._get_email_client().send(
+                        to=self.config.email_to,
+                        subject=subject,
+                        contents=body
+                    )
+                except smtplib.SMTPServerDisconnected:
+                    # Server dropped the idle connection; reconnect once
+                    self.email_client = None
+                    self._get_email_client().send(
+                        to=self.config.email_to,
+                        subject=subject,
+                        contents=body
+                    )
+            logger.info(f"Email alert sent: {alert['message']}")
+        except Exception as e:
+            logger.error(f"Error sending email alert: {e}")
+    
+    def _send_sms(self, alert: Dict):
+        """Send SMS notification (runs on the notification pool)"""
+        try:
+            message = f"AQUAPONICS ALERT: {alert['message']}"
+            self._get_sms_client().messages.create(
+                body=message,
+                from_=self.config.twilio_from,
+                to=self.config.sms_to
+            )
+            logger.info(f"SMS alert sent: {alert['message']}")
+        except Exception as e:
+            logger.error(f"Error sending SMS alert: {e}")
     
     def _format_alert_email(self, alert: Dict) -> str:
         """Format alert as HTML email"""
-        html = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif;">
-            <h2 style="color: {'#d32f2f' if alert['level'] == 'critical' else '#ff9800'};">
-                {alert['level'].upper()} ALERT
-            </h2>
-            <p><strong>Sensor:</strong> {alert['sensor']}</p>
-            <p><strong>Current Value:</strong> {alert['value']:.2f}</p>
-            <p><strong>Threshold:</strong> {alert['threshold']:.2f}</p>
-            <p><strong>Time:</strong> {alert['timestamp']}</p>
-            <h3>Recommended Actions:</h3>
-            <ul>
-                {self._get_recommendations_html(alert)}
-            </ul>
-            <p><em>This is an automated alert from your STEM DREAM Aquaponics system.</em></p>
-        </body>
-        </html>
-        """
-        return html
+        return _EMAIL_TEMPLATE.format_map({
+            'color': '#d32f2f' if alert['level'] == 'critical' else '#ff9800',
+            'level': alert['level'].upper(),
+            'sensor': alert['sensor'],
+            'value': alert['value'],
+            'threshold': alert['threshold'],
+            'timestamp': alert['timestamp'],
+            'recommendations': self._get_recommendations_html(alert)
+        })
     
     def _get_recommendations_html(self, alert: Dict) -> str:
         """Get HTML formatted recommendations for alert"""
         sensor = alert['sensor']
-        level = alert['level']
-        value = alert['value']
-        
-        recommendations = []
+        thresholds = self.thresholds.get(sensor)
+        if thresholds is None:
+            return _DEFAULT_RECOMMENDATION_HTML
         
-        if sensor == 'ph':
-            if value < self.thresholds['ph']['optimal_min']:
-                recommendations = [
-                    "Add pH Up solution slowly (0.2 units at a time)",
-                    "Wait 30 minutes and retest",
-                    "Check if nutrient solution is old (replace if needed)",
-                    "Verify calibration of pH sensor"
-                ]
-            else:
-                recommendations = [
-                    "Add pH Down solution slowly (0.2 units at a time)",
-                    "Wait 30 minutes and retest",
-                    "Check aeration (high pH can indicate CO2 depletion)",
-                    "Verify calibration of pH sensor"
-                ]
-        
-        elif sensor == 'do':
-            if value < self.thresholds['do']['optimal_min']:
-                recommendations = [
-                    "IMMEDIATE: Increase aeration (add air stones)",
-                    "Check water temperature (warmer = less DO)",
-                    "Reduce feeding if fish present",
-                    "Check for dead organisms in system",
-                    "Verify air pump is working",
-                    "If fish gasping at surface: 50% water change NOW"
-                ]
-        
-        elif sensor == 'ec':
-            if value < self.thresholds['ec']['optimal_min']:
-                recommendations = [
-                    "Add nutrient solution",
-                    "Check plants for deficiency symptoms",
-                    "Verify EC sensor calibration"
-                ]
-            else:
-                recommendations = [
-                    "Add fresh water to dilute",
-                    "Check for salt buildup",
-                    "Flush system if EC very high",
-                    "Reduce nutrient dosing"
-                ]
-        
-        elif 'temp' in sensor:
-            if value < self.thresholds[sensor]['optimal_min']:
-                recommendations = [
-                    "Turn on water heater",
-                    "Check heater is functioning",
-                    "Insulate reservoir/tanks",
-                    "Check ambient temperature"
-                ]
-            else:
-                recommendations = [
-                    "Turn off heater",
-                    "Increase ventilation/cooling",
-                    "Add ice packs if emergency",
-                    "Consider chiller for long-term solution"
-                ]
-        
-        elif sensor == 'water_level_percent':
-            recommendations = [
-                "Check for leaks",
-                "Refill reservoir",
-                "Verify auto top-off system working",
-                "Check pump for proper operation"
-            ]
-        
-        html = ""
-        for rec in recommendations:
-            html += f"<li>{rec}</li>\n"
-        
-        return html if html else "<li>Monitor situation closely</li>"
+        direction = 'low' if alert['value'] < thresholds['optimal_min'] else 'high'
+        group = 'temp' if 'temp' in sensor else sensor
+        return _RECOMMENDATIONS_HTML.get((group, direction), _DEFAULT_RECOMMENDATION_HTML)
     
     def test_notifications(self):
         """Send test notifications to verify configuration"""
@@ -349,3 +650,7 @@ class AlertManager:
         
         logger.info("Sending test notifications...")
         self._send_notifications(test_alert)
+    
+    def close(self):
+        """Stop the notification pool, letting queued sends finish"""
+        self._notify_pool.shutdown(wait=False)
@@ -1,252 +1,495 @@
+# cython: annotation_typing=False
 """
 Intelligent Parameter Analysis
 Combines rule-based reasoning with knowledge base context
+
+Written in Cython pure-Python mode: it runs as-is, and can optionally be
+compiled in place with `cythonize -i parameter_analyzer.py` for typed
+classification kernels.
 """
 
-class ParameterAnalyzer:
-    """Analyzes sensor readings with aquaponics expertise"""
-    
-    def analyze_ph(self, ph_value: float, system_type: str = "NFT") -> dict:
-        """
-        Intelligent pH analysis with specific recommendations
-        """
-        analysis = {
-            'parameter': 'pH',
-            'value': ph_value,
-            'status': 'unknown',
-            'urgency': 'normal',
-            'problems': [],
-            'actions': [],
-            'explanation': ''
-        }
+import math
+import sys
+from bisect import bisect_right
+from enum import IntEnum
+from types import MappingProxyType
+from typing import NamedTuple, Union
+
+import numpy as np
+
+try:
+    import cython
+except ImportError:
+    # Stand-in for the few pure-Python-mode names used below
+    class cython:
+        compiled = False
+        double = float
+        Py_ssize_t = int
         
-        # Critical low
-        if ph_value < 6.0:
-            analysis['status'] = 'critical'
-            analysis['urgency'] = 'immediate'
-            analysis['problems'] = [
+        @staticmethod
+        def locals(**types):
+            return lambda func: func
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Closed set of status/urgency values shared by every result
+_CRITICAL = sys.intern('critical')
+_WARNING = sys.intern('warning')
+_GOOD = sys.intern('good')
+_IMMEDIATE = sys.intern('immediate')
+_SOON = sys.intern('soon')
+_NORMAL = sys.intern('normal')
+
+
+def _above(bound: float) -> float:
+    """Smallest float greater than bound (for ranges inclusive at the top)"""
+    return math.nextafter(bound, math.inf)
+
+
+class ParamDescriptor(NamedTuple):
+    """Per-band lookup table for one parameter (one entry per band)"""
+    thresholds: tuple   # lower edge of each band after the first
+    status: tuple
+    urgency: tuple
+    problems: tuple
+    actions: tuple
+    expl_fmts: tuple
+    digits: int         # display precision
+    good: int           # index of the optimal band, checked before bisecting
+
+
+class ParameterAnalysis(NamedTuple):
+    """Single-parameter analysis result (use to_dict() for JSON responses)"""
+    parameter: str
+    value: float
+    status: str
+    urgency: str
+    problems: tuple
+    actions: tuple
+    expl_fmt: str
+    
+    @property
+    def explanation(self) -> str:
+        """Human-readable explanation, only formatted when read"""
+        return self.expl_fmt % self.value
+    
+    def to_dict(self) -> dict:
+        """Plain dict with the formatted explanation in place of its template"""
+        result = self._asdict()
+        del result['expl_fmt']
+        result['explanation'] = self.explanation
+        return result
+
+
+class Readings(NamedTuple):
+    """Sensor snapshot for the multi-parameter analyses (defaults fill gaps)"""
+    ph: float = 7.0
+    temperature: float = 22.0
+    do: float = 7.5
+    ec: float = 1.5
+    
+    @classmethod
+    def from_dict(cls, readings: dict) -> 'Readings':
+        """Adapt a legacy readings dict, defaulting missing keys"""
+        get = readings.get
+        return cls(*[get(name, default) for name, default in cls._field_defaults.items()])
+
+
+# bisect_right(thresholds, value) selects the band, in the same order as the
+# original if/elif ladders (NaN falls in the last band).
+_PARAM_TABLES = {
+    'pH': ParamDescriptor(
+        thresholds=(6.0, 6.5, _above(7.5), 8.5),
+        status=(_CRITICAL, _WARNING, _GOOD, _WARNING, _CRITICAL),
+        urgency=(_IMMEDIATE, _SOON, _NORMAL, _SOON, _IMMEDIATE),
+        problems=(
+            (
                 'pH dangerously low',
                 'Biofilter efficiency severely reduced (<50%)',
                 'Fish stress increasing',
                 'Ammonia toxicity risk rising'
-            ]
-            analysis['actions'] = [
+            ),
+            (
+                'pH below optimal for biofilter (wants 7.0-8.5)',
+                'Nitrification running at 50-70% efficiency',
+                'pH likely to continue dropping'
+            ),
+            (),
+            (
+                'pH higher than optimal for lettuce',
+                'Some nutrients becoming unavailable',
+                'Ammonia toxicity increasing (NH3 form)'
+            ),
+            (
+                'pH dangerously high',
+                'Iron, manganese becoming unavailable',
+                'NH3 toxicity risk',
+                'Possible lime overdose'
+            ),
+        ),
+        actions=(
+            (
                 'IMMEDIATE: Add 3 tsp sodium bicarbonate per 5 gallons',
                 'Stop feeding for 24 hours (reduce CO2)',
                 'Test ammonia within 1 hour',
                 'Increase aeration by 50%',
                 'Monitor pH every 2 hours until above 6.5'
-            ]
-            analysis['explanation'] = f"Your pH of {ph_value:.2f} is in the critical zone. This is likely causing a cascade of problems. Priority is raising pH immediately to protect biofilter bacteria."
-        
-        # Warning low
-        elif ph_value < 6.5:
-            analysis['status'] = 'warning'
-            analysis['urgency'] = 'soon'
-            analysis['problems'] = [
-                'pH below optimal for biofilter (wants 7.0-8.5)',
-                'Nitrification running at 50-70% efficiency',
-                'pH likely to continue dropping'
-            ]
-            analysis['actions'] = [
+            ),
+            (
                 'Add 2 tsp potassium carbonate per 5 gallons',
                 'Reduce feeding by 25% temporarily',
                 'Test pH again in 6 hours',
                 'Target: 6.5-7.0 for lettuce systems'
-            ]
-            analysis['explanation'] = f"At {ph_value:.2f}, your biofilter is stressed but functional. Act within 24 hours to prevent further drop."
-        
-        # Good range
-        elif 6.5 <= ph_value <= 7.5:
-            analysis['status'] = 'good'
-            analysis['problems'] = []
-            analysis['actions'] = [
+            ),
+            (
                 'Continue normal operations',
                 'Monitor daily',
                 'No immediate action needed'
-            ]
-            analysis['explanation'] = f"pH of {ph_value:.2f} is in the sweet spot for NFT lettuce + biofilter. Great work!"
-        
-        # Warning high
-        elif ph_value < 8.5:
-            analysis['status'] = 'warning'
-            analysis['urgency'] = 'soon'
-            analysis['problems'] = [
-                'pH higher than optimal for lettuce',
-                'Some nutrients becoming unavailable',
-                'Ammonia toxicity increasing (NH3 form)'
-            ]
-            analysis['actions'] = [
+            ),
+            (
                 'Test ammonia immediately',
                 'Reduce/stop lime additions',
                 'Consider adding citric acid (pH down)',
                 'Target: lower to 7.0-7.5'
-            ]
-            analysis['explanation'] = f"At {ph_value:.2f}, nutrients are starting to precipitate out of solution."
-        
-        # Critical high
-        else:
-            analysis['status'] = 'critical'
-            analysis['urgency'] = 'immediate'
-            analysis['problems'] = [
-                'pH dangerously high',
-                'Iron, manganese becoming unavailable',
-                'NH3 toxicity risk',
-                'Possible lime overdose'
-            ]
-            analysis['actions'] = [
+            ),
+            (
                 'IMMEDIATE: Add pH down (citric acid)',
                 'Test ammonia - if high, partial water change',
                 'Stop all lime additions',
                 'Monitor every hour until below 8.0'
-            ]
-            analysis['explanation'] = f"pH of {ph_value:.2f} is critical. Plants cannot access nutrients."
-        
-        return analysis
-    
-    def analyze_temperature(self, temp_c: float, species: str = "lettuce") -> dict:
-        """Analyze temperature with species-specific recommendations"""
-        analysis = {
-            'parameter': 'temperature',
-            'value': temp_c,
-            'status': 'unknown',
-            'urgency': 'normal',
-            'problems': [],
-            'actions': [],
-            'explanation': ''
-        }
-        
-        # Lettuce optimal: 18-24°C
-        if temp_c < 15:
-            analysis['status'] = 'critical'
-            analysis['urgency'] = 'soon'
-            analysis['problems'] = [
+            ),
+        ),
+        expl_fmts=(
+            "Your pH of %.2f is in the critical zone. This is likely causing a cascade of problems. Priority is raising pH immediately to protect biofilter bacteria.",
+            "At %.2f, your biofilter is stressed but functional. Act within 24 hours to prevent further drop.",
+            "pH of %.2f is in the sweet spot for NFT lettuce + biofilter. Great work!",
+            "At %.2f, nutrients are starting to precipitate out of solution.",
+            "pH of %.2f is critical. Plants cannot access nutrients.",
+        ),
+        digits=2,
+        good=2
+    ),
+    # Lettuce optimal: 18-24°C
+    'temperature': ParamDescriptor(
+        thresholds=(15, 18, _above(24), 28),
+        status=(_CRITICAL, _WARNING, _GOOD, _WARNING, _CRITICAL),
+        urgency=(_SOON, _NORMAL, _NORMAL, _SOON, _IMMEDIATE),
+        problems=(
+            (
                 'Too cold - growth will stop',
                 'Risk of root disease'
-            ]
-            analysis['actions'] = [
+            ),
+            ('Below optimal - slow growth',),
+            (),
+            (
+                'Getting warm - check DO',
+                'Plants may bolt (flower prematurely)'
+            ),
+            (
+                'Too hot - lettuce will bolt',
+                'DO crash risk'
+            ),
+        ),
+        actions=(
+            (
                 'Add aquarium heater (50W per 10 gallons)',
                 'Insulate reservoir',
                 'Target: 18-22°C'
-            ]
-            analysis['explanation'] = f"At {temp_c:.1f}°C, lettuce growth is severely stunted."
-        
-        elif temp_c < 18:
-            analysis['status'] = 'warning'
-            analysis['urgency'] = 'normal'
-            analysis['problems'] = ['Below optimal - slow growth']
-            analysis['actions'] = [
+            ),
+            (
                 'Consider gentle heating',
                 'Monitor growth rate',
                 'Acceptable but not ideal'
-            ]
-            analysis['explanation'] = f"At {temp_c:.1f}°C, growth is slower than optimal but acceptable."
-        
-        elif 18 <= temp_c <= 24:
-            analysis['status'] = 'good'
-            analysis['actions'] = ['Continue monitoring', 'No action needed']
-            analysis['explanation'] = f"Perfect! {temp_c:.1f}°C is ideal for lettuce."
-        
-        elif temp_c < 28:
-            analysis['status'] = 'warning'
-            analysis['urgency'] = 'soon'
-            analysis['problems'] = [
-                'Getting warm - check DO',
-                'Plants may bolt (flower prematurely)'
-            ]
-            analysis['actions'] = [
+            ),
+            (
+                'Continue monitoring',
+                'No action needed'
+            ),
+            (
                 'Check dissolved oxygen (should be >6 mg/L)',
                 'Increase aeration if DO dropping',
                 'Consider shading reservoir',
                 'Monitor for bolting (flowering)'
-            ]
-            analysis['explanation'] = f"At {temp_c:.1f}°C, watch for stress. Lettuce prefers cooler."
-        
-        else:
-            analysis['status'] = 'critical'
-            analysis['urgency'] = 'immediate'
-            analysis['problems'] = [
-                'Too hot - lettuce will bolt',
-                'DO crash risk'
-            ]
-            analysis['actions'] = [
+            ),
+            (
                 'URGENT: Cool system (ice bottles, shade)',
                 'Check DO immediately',
                 'Consider switching to heat-tolerant species',
                 'Harvest lettuce before it bolts'
-            ]
-            analysis['explanation'] = f"At {temp_c:.1f}°C, lettuce is stressed and will likely bolt soon."
-        
-        return analysis
-    
-    def analyze_do(self, do_value: float, temp_c: float = 20) -> dict:
-        """Analyze DO with temperature consideration"""
-        analysis = {
-            'parameter': 'dissolved_oxygen',
-            'value': do_value,
-            'status': 'unknown',
-            'urgency': 'normal',
-            'problems': [],
-            'actions': [],
-            'explanation': ''
-        }
-        
-        if do_value < 4:
-            analysis['status'] = 'critical'
-            analysis['urgency'] = 'immediate'
-            analysis['problems'] = [
+            ),
+        ),
+        expl_fmts=(
+            "At %.1f°C, lettuce growth is severely stunted.",
+            "At %.1f°C, growth is slower than optimal but acceptable.",
+            "Perfect! %.1f°C is ideal for lettuce.",
+            "At %.1f°C, watch for stress. Lettuce prefers cooler.",
+            "At %.1f°C, lettuce is stressed and will likely bolt soon.",
+        ),
+        digits=1,
+        good=2
+    ),
+    'dissolved_oxygen': ParamDescriptor(
+        thresholds=(4, 6, _above(9)),
+        status=(_CRITICAL, _WARNING, _GOOD, _GOOD),
+        urgency=(_IMMEDIATE, _SOON, _NORMAL, _NORMAL),
+        problems=(
+            (
                 'Fish will die within hours',
                 'Biofilter bacteria dying',
                 'Root rot starting in plants'
-            ]
-            analysis['actions'] = [
+            ),
+            (
+                'Below safe threshold for most fish',
+                'Biofilter efficiency reduced',
+                'Fish showing stress behaviors'
+            ),
+            (),
+            (),
+        ),
+        actions=(
+            (
                 'EMERGENCY: Add air stone/aerator NOW',
                 'Reduce feeding to zero',
                 'Check for dead zones in system',
                 'Partial water change with aerated water',
                 'Check pump - may be failing'
-            ]
-            analysis['explanation'] = f"DO of {do_value:.1f} mg/L is life-threatening. This is an emergency."
-        
-        elif do_value < 6:
-            analysis['status'] = 'warning'
-            analysis['urgency'] = 'soon'
-            analysis['problems'] = [
-                'Below safe threshold for most fish',
-                'Biofilter efficiency reduced',
-                'Fish showing stress behaviors'
-            ]
-            analysis['actions'] = [
+            ),
+            (
                 'Increase aeration immediately',
                 'Check water temperature (high temp = low DO)',
                 'Reduce feeding by 50%',
                 'Target: >6 mg/L minimum'
-            ]
-            analysis['explanation'] = f"DO of {do_value:.1f} mg/L is marginal. Fish are stressed."
-        
-        elif 6 <= do_value <= 9:
-            analysis['status'] = 'good'
-            analysis['actions'] = ['Maintain current aeration', 'Monitor daily']
-            analysis['explanation'] = f"DO of {do_value:.1f} mg/L is excellent. System is well-aerated."
-        
-        else:
-            analysis['status'] = 'good'
-            analysis['problems'] = []
-            analysis['actions'] = ['Monitor for gas bubble disease (rare)']
-            analysis['explanation'] = f"DO of {do_value:.1f} mg/L is very high (supersaturated). Usually not a problem."
-        
-        return analysis
+            ),
+            (
+                'Maintain current aeration',
+                'Monitor daily'
+            ),
+            ('Monitor for gas bubble disease (rare)',),
+        ),
+        expl_fmts=(
+            "DO of %.1f mg/L is life-threatening. This is an emergency.",
+            "DO of %.1f mg/L is marginal. Fish are stressed.",
+            "DO of %.1f mg/L is excellent. System is well-aerated.",
+            "DO of %.1f mg/L is very high (supersaturated). Usually not a problem.",
+        ),
+        digits=1,
+        good=2
+    ),
+}
+
+
+@cython.locals(i=cython.Py_ssize_t)
+def _analyze(parameter: str, value: float) -> ParameterAnalysis:
+    """
+    Analyze a reading. The band always comes from the raw value, so
+    readings just below a limit are never rounded across it; the result
+    carries the raw value too.
+    """
+    d = _PARAM_TABLES[parameter]
+    # hot path: steady-state readings sit in the optimal band
+    i = d.good
+    if not d.thresholds[i - 1] <= value < d.thresholds[i]:
+        i = bisect_right(d.thresholds, value)
+    return ParameterAnalysis(parameter, value, d.status[i], d.urgency[i],
+                             d.problems[i], d.actions[i], d.expl_fmts[i])
+
+
+# Per-band status/urgency arrays for vectorized batch classification
+_BATCH_TABLES = {
+    parameter: (
+        np.asarray(d.thresholds, dtype=float),
+        np.array(d.status),
+        np.array(d.urgency),
+    )
+    for parameter, d in _PARAM_TABLES.items()
+}
+
+
+def _analyze_batch(parameter: str, values) -> dict:
+    """
+    Classify an array of readings in one pass. Returns parallel arrays
+    (same bands as the scalar analyzers, picked from the raw values).
+    """
+    values = np.asarray(values, dtype=float)
+    thresholds, status, urgency = _BATCH_TABLES[parameter]
+    idx = np.digitize(values, thresholds)
+    return {
+        'parameter': parameter,
+        'value': values,
+        'status': status[idx],
+        'urgency': urgency[idx]
+    }
+
+
+class Trend(IntEnum):
+    """Trend direction as an integer code for the pattern classifier"""
+    UNKNOWN = -1
+    STABLE = 0
+    RISING = 1
+    FALLING = 2
+    VOLATILE = 3
+
+
+# TrendAnalyzer reports directions as strings (kept for JSON/prompt output);
+# accept those or Trend members and encode once per analysis call
+_TREND_CODES = {t.name.lower(): t for t in Trend}
+_TREND_CODES.update({t: t for t in Trend})
+
+# Correlation patterns, in the order they are checked
+PATTERN_NONE = 0
+PATTERN_BIOFILTER_CRASH = 1
+PATTERN_TEMP_OXYGEN = 2
+PATTERN_PH_DECLINE = 3
+PATTERN_OPTIMAL = 4
+
+
+@cython.locals(ph=cython.double, temp=cython.double, do=cython.double,
+               ph_ttt=cython.double, temp_ttt=cython.double, do_ttt=cython.double,
+               ph_hours=cython.double, temp_hours=cython.double, do_hours=cython.double)
+def _classify_cascade(ph, temp, do, ph_trend, ph_ttt, temp_trend, temp_ttt,
+                      do_trend, do_ttt, ph_concern):
+    """
+    Pick the correlation pattern and its hours-to-threshold estimate
+    (compiled with Numba if available). Unknown times are NaN.
+    """
+    ph_hours = 999.0 if np.isnan(ph_ttt) else ph_ttt
+    temp_hours = 999.0 if np.isnan(temp_ttt) else temp_ttt
+    do_hours = 999.0 if np.isnan(do_ttt) else do_ttt
     
-    def analyze_system_holistic(self, readings: dict) -> dict:
+    if ph < 6.5 and ph_trend == Trend.FALLING and do < 7 and do_trend == Trend.FALLING:
+        return PATTERN_BIOFILTER_CRASH, min(ph_hours, do_hours)
+    if temp > 25 and temp_trend == Trend.RISING and do < 7 and do_trend == Trend.FALLING:
+        return PATTERN_TEMP_OXYGEN, min(temp_hours, do_hours)
+    if ph_trend == Trend.FALLING and ph_concern:
+        # Preventive window defaults to a day rather than "never"
+        return PATTERN_PH_DECLINE, 24.0 if np.isnan(ph_ttt) else ph_ttt
+    if (6.5 <= ph <= 7.5 and 18 <= temp <= 24 and do >= 6 and
+            ph_trend == Trend.STABLE and temp_trend == Trend.STABLE and
+            do_trend == Trend.STABLE):
+        return PATTERN_OPTIMAL, 0.0
+    return PATTERN_NONE, 0.0
+
+
+# Numba needs Python bytecode, so skip it when Cython compiled this module
+if njit and not cython.compiled:
+    _classify_cascade = njit(cache=True)(_classify_cascade)
+
+
+_EMPTY = MappingProxyType({})
+_CONCERNING = frozenset((_WARNING, _CRITICAL))
+
+
+def _trend_scalars(trend: dict) -> tuple:
+    """Unpack a TrendAnalyzer result into (direction code, hours or NaN)"""
+    hours = trend.get('time_to_threshold')
+    return (_TREND_CODES.get(trend.get('trend'), Trend.UNKNOWN),
+            math.nan if hours is None else float(hours))
+
+
+# Multi-line correlation reports, pre-split around their single
+# interpolated value: report = prefix + formatted value + suffix
+_CASCADE_EXPLANATION = ("""
+🚨 CRITICAL SYSTEM FAILURE IN PROGRESS
+
+Your system is in a biofilter collapse cascade. This is a self-reinforcing
+failure where low pH causes bacteria to fail, which lowers pH further.
+
+Time to system failure: ~""", """ hours
+
+Root cause: pH dropped below biofilter threshold
+Effect chain: pH ↓ → Bacteria fail → CO2 ↑ → pH ↓↓ → DO ↓ → Crisis
+
+The ONLY way to stop this is to break the cycle by raising pH immediately.
+Everything else is secondary.
+            """)
+
+_CASCADE_OUTCOME = ("""
+WITHOUT intervention: System failure in """, """h, fish death likely
+WITH intervention: 48-72h recovery if pH raised within next 6 hours
+            """)
+
+_TEMP_OXYGEN_EXPLANATION = ("""
+⚠️ TEMPERATURE-OXYGEN CRISIS DEVELOPING
+
+Temperature is rising, which DECREASES how much oxygen water can hold.
+At the same time, warm water makes fish need MORE oxygen.
+
+This is a dangerous mismatch that will cause stress or death.
+
+Root cause: Rising temperature
+Time to critical: ~""", """ hours
+
+Fix temperature FIRST, then DO will naturally improve.
+            """)
+
+# Two interpolations: rate of change, then hours remaining
+_PH_DECLINE_EXPLANATION = ("""
+📊 PREDICTIVE ALERT: pH Crash Approaching
+
+Your pH is falling at """, """ per hour.
+
+At this rate, you'll hit warning threshold in """, """ hours.
+
+GOOD NEWS: You caught it early! You have time to fix this before problems start.
+
+This is EXACTLY what predictive monitoring is for - catching problems
+before they become crises.
+            """)
+
+_OPTIMAL_EXPLANATION = """
+✅ SYSTEM OPERATING OPTIMALLY
+
+All parameters in range AND stable over time.
+No concerning trends detected.
+System is healthy and well-managed.
+
+Continue current practices - you're doing great!
+            """
+
+
+class ParameterAnalyzer:
+    """Analyzes sensor readings with aquaponics expertise"""
+    
+    def analyze_ph(self, ph_value: float, system_type: str = "NFT") -> ParameterAnalysis:
+        """
+        Intelligent pH analysis with specific recommendations
+        """
+        return _analyze('pH', ph_value)
+    
+    def analyze_ph_batch(self, ph_values) -> dict:
+        """Vectorized pH classification for an array of readings"""
+        return _analyze_batch('pH', ph_values)
+    
+    def analyze_temperature(self, temp_c: float, species: str = "lettuce") -> ParameterAnalysis:
+        """Analyze temperature with species-specific recommendations"""
+        return _analyze('temperature', temp_c)
+    
+    def analyze_temperature_batch(self, temps_c) -> dict:
+        """Vectorized temperature classification for an array of readings"""
+        return _analyze_batch('temperature', temps_c)
+    
+    def analyze_do(self, do_value: float, temp_c: float = 20) -> ParameterAnalysis:
+        """Analyze DO with temperature consideration"""
+        return _analyze('dissolved_oxygen', do_value)
+    
+    def analyze_do_batch(self, do_values) -> dict:
+        """Vectorized DO classification for an array of readings"""
+        return _analyze_batch('dissolved_oxygen', do_values)
+    
+    def analyze_system_holistic(self, readings: Union[Readings, dict]) -> dict:
         """
         Analyze multiple parameters together to find root causes
         """
-        ph = readings.get('ph', 7.0)
-        temp = readings.get('temperature', 22.0)
-        do = readings.get('do', 7.5)
+        if not isinstance(readings, Readings):
+            readings = Readings.from_dict(readings)
+        ph, temp, do = readings.ph, readings.temperature, readings.do
         
         holistic = {
-            'overall_status': 'good',
+            'overall_status': _GOOD,
             'root_cause': None,
             'cascading_effects': [],
             'priority_actions': [],
@@ -255,7 +498,7 @@ class ParameterAnalyzer:
         
         # Pattern 1: Low pH + Low DO = Biofilter crash
         if ph < 6.5 and do < 6:
-            holistic['overall_status'] = 'critical'
+            holistic['overall_status'] = _CRITICAL
             holistic['root_cause'] = 'Biofilter failure causing cascade'
             holistic['cascading_effects'] = [
                 'Low pH inhibits nitrification',
@@ -275,11 +518,11 @@ class ParameterAnalyzer:
         
         # Pattern 2: High temp + Low DO
         elif temp > 24 and do < 7:
-            holistic['overall_status'] = 'warning'
+            holistic['overall_status'] = _WARNING
             holistic['root_cause'] = 'Temperature too high for DO saturation'
             holistic['cascading_effects'] = [
                 'Warm water holds less oxygen',
-                f'At {temp:.1f}°C, saturation is only ~{9 - (temp-20)*0.2:.1f} mg/L',
+                'At %.1f°C, saturation is only ~%.1f mg/L' % (temp, 9 - (temp - 20) * 0.2),
                 'Current aeration insufficient for temperature'
             ]
             holistic['priority_actions'] = [
@@ -288,7 +531,7 @@ class ParameterAnalyzer:
                 '3. Reduce feeding (less oxygen demand)',
                 '4. This will fix both problems'
             ]
-            holistic['explanation'] = f"Temperature of {temp:.1f}°C is causing low DO. Cool first, then DO will rise naturally."
+            holistic['explanation'] = "Temperature of %.1f°C is causing low DO. Cool first, then DO will rise naturally." % temp
         
         # Pattern 3: All good
         elif 6.5 <= ph <= 7.5 and do >= 6 and 18 <= temp <= 24:
@@ -310,18 +553,29 @@ class ParameterAnalyzer:
             holistic['explanation'] = "Only pH is low. Good news: caught it before cascade! Fix it today."
         
         return holistic
-    def analyze_correlations_advanced(self, readings: dict, trends: dict) -> dict:
+    def analyze_correlations_advanced(self, readings: Union[Readings, dict], trends: dict) -> dict:
         """
         LAYER 4: Advanced Multi-Parameter Correlation
         Identifies root causes and cascading effects using trends
         """
-        ph = readings.get('ph', 7.0)
-        temp = readings.get('temperature', 22.0)
-        do = readings.get('do', 7.5)
+        if not isinstance(readings, Readings):
+            readings = Readings.from_dict(readings)
+        ph, temp, do = float(readings.ph), float(readings.temperature), float(readings.do)
+        
+        # Pull everything the patterns need out of the trend dicts once;
+        # below this point only these locals are read
+        ph_trend = trends.get('ph') or _EMPTY
+        ph_code, ph_ttt = _trend_scalars(ph_trend)
+        temp_code, temp_ttt = _trend_scalars(trends.get('temperature') or _EMPTY)
+        do_code, do_ttt = _trend_scalars(trends.get('do') or _EMPTY)
+        ph_concern = ph_trend.get('concern_level') in _CONCERNING
+        ph_rate = float(ph_trend.get('rate_of_change') or 0.0)
         
-        ph_trend = trends.get('ph', {})
-        temp_trend = trends.get('temperature', {})
-        do_trend = trends.get('do', {})
+        pattern, hours = _classify_cascade(
+            ph, temp, do,
+            ph_code, ph_ttt, temp_code, temp_ttt, do_code, do_ttt,
+            ph_concern
+        )
         
         analysis = {
             'root_cause': None,
@@ -333,8 +587,7 @@ class ParameterAnalyzer:
         }
         
         # PATTERN 1: Biofilter Crash in Progress
-        if (ph < 6.5 and ph_trend.get('trend') == 'falling' and
-            do < 7 and do_trend.get('trend') == 'falling'):
+        if pattern == PATTERN_BIOFILTER_CRASH:
             
             analysis['root_cause'] = 'Biofilter collapse cascade'
             analysis['system_state'] = 'critical_cascade'
@@ -349,10 +602,8 @@ class ParameterAnalyzer:
                 '⚠️ DOWNWARD SPIRAL ACTIVE'
             ]
             
-            # Calculate time to system failure
-            ph_hours = ph_trend.get('time_to_threshold', 999)
-            do_hours = do_trend.get('time_to_threshold', 999)
-            critical_hours = min(ph_hours, do_hours)
+            # Time to system failure, shown in both the explanation and outcome
+            critical_hours = format(hours, '.1f')
             
             analysis['intervention_priority'] = [
                 {
@@ -381,45 +632,28 @@ class ParameterAnalyzer:
                 }
             ]
             
-            analysis['explanation'] = f"""
-🚨 CRITICAL SYSTEM FAILURE IN PROGRESS
-
-Your system is in a biofilter collapse cascade. This is a self-reinforcing
-failure where low pH causes bacteria to fail, which lowers pH further.
-
-Time to system failure: ~{critical_hours:.1f} hours
-
-Root cause: pH dropped below biofilter threshold
-Effect chain: pH ↓ → Bacteria fail → CO2 ↑ → pH ↓↓ → DO ↓ → Crisis
-
-The ONLY way to stop this is to break the cycle by raising pH immediately.
-Everything else is secondary.
-            """
+            prefix, suffix = _CASCADE_EXPLANATION
+            analysis['explanation'] = ''.join((prefix, critical_hours, suffix))
             
-            analysis['predicted_outcome'] = f"""
-WITHOUT intervention: System failure in {critical_hours:.1f}h, fish death likely
-WITH intervention: 48-72h recovery if pH raised within next 6 hours
-            """
+            prefix, suffix = _CASCADE_OUTCOME
+            analysis['predicted_outcome'] = ''.join((prefix, critical_hours, suffix))
         
         # PATTERN 2: Temperature-Induced Oxygen Crisis
-        elif (temp > 25 and temp_trend.get('trend') == 'rising' and
-              do < 7 and do_trend.get('trend') == 'falling'):
+        elif pattern == PATTERN_TEMP_OXYGEN:
             
             analysis['root_cause'] = 'Temperature rising → Oxygen capacity falling'
+            temp_str = format(temp, '.1f')
             analysis['system_state'] = 'temperature_oxygen_cascade'
             analysis['cascading_effects'] = [
-                f'1. Water temp at {temp:.1f}°C (high)',
-                f'2. Oxygen saturation capacity decreasing',
-                f'3. At {temp:.1f}°C, max DO only ~{9-(temp-20)*0.2:.1f} mg/L',
-                f'4. Current DO: {do:.1f} mg/L',
+                '1. Water temp at %s°C (high)' % temp_str,
+                '2. Oxygen saturation capacity decreasing',
+                '3. At %s°C, max DO only ~%.1f mg/L' % (temp_str, 9 - (temp - 20) * 0.2),
+                '4. Current DO: %.1f mg/L' % do,
                 '5. Fish metabolism increases with temp (need MORE O2)',
                 '6. Available oxygen decreases (can provide LESS O2)',
                 '7. Mismatch growing → stress increasing'
             ]
             
-            temp_hours = temp_trend.get('time_to_threshold', 999)
-            do_hours = do_trend.get('time_to_threshold', 999)
-            
             analysis['intervention_priority'] = [
                 {
                     'order': 1,
@@ -441,33 +675,22 @@ WITH intervention: 48-72h recovery if pH raised within next 6 hours
                 }
             ]
             
-            analysis['explanation'] = f"""
-⚠️ TEMPERATURE-OXYGEN CRISIS DEVELOPING
-
-Temperature is rising, which DECREASES how much oxygen water can hold.
-At the same time, warm water makes fish need MORE oxygen.
-
-This is a dangerous mismatch that will cause stress or death.
-
-Root cause: Rising temperature
-Time to critical: ~{min(temp_hours, do_hours):.1f} hours
-
-Fix temperature FIRST, then DO will naturally improve.
-            """
+            prefix, suffix = _TEMP_OXYGEN_EXPLANATION
+            analysis['explanation'] = ''.join((prefix, format(hours, '.1f'), suffix))
         
         # PATTERN 3: pH Crash Approaching (Predictive)
-        elif (ph_trend.get('trend') == 'falling' and 
-              ph_trend.get('concern_level') in ['warning', 'critical']):
+        elif pattern == PATTERN_PH_DECLINE:
             
             analysis['root_cause'] = 'pH declining - catch it early!'
             analysis['system_state'] = 'preventive_action_needed'
             
-            hours_remaining = ph_trend.get('time_to_threshold', 24)
+            rate_str = format(abs(ph_rate), '.3f')
+            hours_str = format(hours, '.1f')
             
             analysis['intervention_priority'] = [
                 {
                     'order': 1,
-                    'action': f'Raise pH within next {hours_remaining:.0f} hours',
+                    'action': 'Raise pH within next %.0f hours' % hours,
                     'why': 'Prevent cascade before it starts',
                     'method': 'Add buffer now while you have time'
                 },
@@ -479,34 +702,15 @@ Fix temperature FIRST, then DO will naturally improve.
                 }
             ]
             
-            analysis['explanation'] = f"""
-📊 PREDICTIVE ALERT: pH Crash Approaching
-
-Your pH is falling at {abs(ph_trend.get('rate_of_change', 0)):.3f} per hour.
-
-At this rate, you'll hit warning threshold in {hours_remaining:.1f} hours.
-
-GOOD NEWS: You caught it early! You have time to fix this before problems start.
-
-This is EXACTLY what predictive monitoring is for - catching problems
-before they become crises.
-            """
+            head, middle, tail = _PH_DECLINE_EXPLANATION
+            analysis['explanation'] = ''.join((
+                head, rate_str, middle, hours_str, tail
+            ))
         
         # PATTERN 4: All Parameters Optimal and Stable
-        elif (6.5 <= ph <= 7.5 and 18 <= temp <= 24 and do >= 6 and
-              ph_trend.get('trend') == 'stable' and
-              temp_trend.get('trend') == 'stable' and
-              do_trend.get('trend') == 'stable'):
+        elif pattern == PATTERN_OPTIMAL:
             
             analysis['system_state'] = 'optimal_stable'
-            analysis['explanation'] = """
-✅ SYSTEM OPERATING OPTIMALLY
-
-All parameters in range AND stable over time.
-No concerning trends detected.
-System is healthy and well-managed.
-
-Continue current practices - you're doing great!
-            """
+            analysis['explanation'] = _OPTIMAL_EXPLANATION
         
         return analysis
\ No newline at end of file
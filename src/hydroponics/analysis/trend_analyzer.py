@@ -3,16 +3,211 @@ Trend Analysis - Layer 3 Intelligence
 Predicts problems before they happen by analyzing historical data
 """
 
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import statistics
+import logging
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from itertools import groupby
+from operator import itemgetter
+from datetime import datetime
+from types import MappingProxyType
+from typing import List, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Thresholds(NamedTuple):
+    """Concern thresholds for one parameter, low to high"""
+    crit_lo: float
+    warn_lo: float
+    opt_lo: float
+    opt_hi: float
+    warn_hi: float
+    crit_hi: float
+
+
+_THRESHOLDS = MappingProxyType({
+    'ph': _Thresholds(6.0, 6.5, 6.8, 7.5, 8.0, 8.5),
+    'temperature': _Thresholds(15, 18, 20, 24, 26, 28),
+    'do': _Thresholds(4, 6, 7, 10, 12, 15),
+})
+
+# Map parameter names to sensor_readings columns
+_PARAM_COLUMNS = MappingProxyType({
+    'ph': 'ph',
+    'temperature': 'temp_reservoir',
+    'do': 'do',
+    'ec': 'ec',
+})
+
+# Concern levels in increasing order of severity
+_CONCERN_RANK = {'none': 0, 'watch': 1, 'warning': 2, 'critical': 3}
+_URGENT_LEVELS = frozenset(('warning', 'critical'))
+
+
+class _Direction(NamedTuple):
+    """Thresholds a moving trend heads towards, and what to say"""
+    critical: float
+    warning: float
+    critical_msg: str   # %-formatted with hours to threshold
+    warning_msg: str
+    watch_msg: str      # %-formatted with rate per hour
+
+
+class _Messages(NamedTuple):
+    """Recommendation text for one parameter"""
+    falling: _Direction
+    rising: _Direction
+    stable_optimal: str
+    stable_outside: str
+
+
+def _build_messages(name: str, thresh: _Thresholds) -> _Messages:
+    """Bake the parameter name and bounds into its recommendation text"""
+    return _Messages(
+        falling=_Direction(
+            thresh.crit_lo, thresh.warn_lo,
+            f"⚠️ URGENT: {name} dropping fast! Will reach critical threshold ({thresh.crit_lo}) in %.1f hours. Take action NOW to reverse trend.",
+            f"⚠️ {name} declining. Will reach warning threshold ({thresh.warn_lo}) in %.1f hours. Prepare to intervene.",
+            f"📉 {name} trending down at %.3f/hour. Monitor closely."
+        ),
+        rising=_Direction(
+            thresh.crit_hi, thresh.warn_hi,
+            f"⚠️ URGENT: {name} rising fast! Will reach critical threshold ({thresh.crit_hi}) in %.1f hours. Take action NOW.",
+            f"⚠️ {name} increasing. Will reach warning threshold ({thresh.warn_hi}) in %.1f hours.",
+            f"📈 {name} trending up at %.3f/hour. Monitor closely."
+        ),
+        stable_optimal=f"✅ {name} stable in optimal range. Continue current management.",
+        stable_outside=f"👁️ {name} outside optimal but stable. Watch for changes."
+    )
+
+
+_MESSAGES = MappingProxyType({
+    param: _build_messages(param.upper(), thresh)
+    for param, thresh in _THRESHOLDS.items()
+})
+
+# Memoized trend results kept per analyzer
+_RESULT_CACHE_SIZE = 32
+
+
+# Julian day number of the Unix epoch
+_UNIX_EPOCH_JD = 2440587.5
+
+# Least-squares sums per column; x is hours since :origin (a Julian day)
+_COLUMN_SUMS = (
+    "COUNT({c}), TOTAL(CASE WHEN {c} IS NOT NULL THEN x END), TOTAL({c}), "
+    "TOTAL(x * {c}), TOTAL(CASE WHEN {c} IS NOT NULL THEN x * x END), TOTAL({c} * {c})"
+)
+
+_SUMS_SQL = """
+    SELECT {sums}, MAX(id)
+    FROM (
+        SELECT id, (julianday(timestamp) - :origin) * 24.0 AS x, {columns}
+        FROM sensor_readings
+        WHERE {where}
+    )
+"""
+
+# Rows added since the last update that fall inside the window
+_NEW_ROWS = "id > :last_id AND timestamp >= datetime(:since, 'unixepoch')"
+
+# Rows already counted that have aged out of the window
+_EXPIRED_ROWS = (
+    "id <= :last_id AND timestamp >= datetime(:prev_since, 'unixepoch') "
+    "AND timestamp < datetime(:since, 'unixepoch')"
+)
+
+_RECENT_SQL = """
+    SELECT * FROM (
+        SELECT '{param}', timestamp, {column}
+        FROM sensor_readings
+        WHERE {column} IS NOT NULL AND timestamp >= datetime(:since, 'unixepoch')
+        ORDER BY id DESC
+        LIMIT 10
+    )
+"""
+
+# One statement each covers every parameter (sqlite3 caches them once prepared)
+_NEW_SUMS_SQL, _EXPIRED_SUMS_SQL = (
+    _SUMS_SQL.format(
+        sums=", ".join(_COLUMN_SUMS.format(c=column) for column in _PARAM_COLUMNS.values()),
+        columns=", ".join(_PARAM_COLUMNS.values()),
+        where=where
+    )
+    for where in (_NEW_ROWS, _EXPIRED_ROWS)
+)
+_RECENT_ROWS_SQL = " UNION ALL ".join(
+    _RECENT_SQL.format(param=param, column=column)
+    for param, column in _PARAM_COLUMNS.items()
+)
+
+
+@dataclass
+class _RollingRegression:
+    """Running least-squares sums for one parameter"""
+    count: int = 0
+    sum_x: float = 0.0
+    sum_y: float = 0.0
+    sum_xy: float = 0.0
+    sum_x2: float = 0.0
+    sum_y2: float = 0.0
+    
+    def add(self, sums: tuple, sign: int = 1):
+        """Add (or with sign=-1 remove) a run of SQL aggregates"""
+        count, sum_x, sum_y, sum_xy, sum_x2, sum_y2 = sums
+        self.count += sign * count
+        
+        if not self.count:
+            # Start clean rather than carry rounding drift
+            self.sum_x = self.sum_y = self.sum_xy = self.sum_x2 = self.sum_y2 = 0.0
+            return
+        
+        self.sum_x += sign * sum_x
+        self.sum_y += sign * sum_y
+        self.sum_xy += sign * sum_xy
+        self.sum_x2 += sign * sum_x2
+        self.sum_y2 += sign * sum_y2
+    
+    def shift(self, d: float):
+        """Move the origin d hours later (x becomes x - d)"""
+        n = self.count
+        self.sum_x2 += n * d * d - 2 * d * self.sum_x
+        self.sum_xy -= d * self.sum_y
+        self.sum_x -= n * d
+
+
+@dataclass
+class _TrendWindow:
+    """Sliding window over every trend parameter, refreshed together"""
+    origin: float = 0.0   # Julian day of the window start; x is hours after it
+    since: float = 0.0    # Window start in Unix seconds
+    last_id: int = 0
+    bucket: int = -1      # Read interval the window was last refreshed in
+    sums: Dict[str, _RollingRegression] = field(
+        default_factory=lambda: {param: _RollingRegression() for param in _PARAM_COLUMNS}
+    )
+    # Bumped whenever a parameter's readings in the window change
+    versions: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(_PARAM_COLUMNS, 0))
+    recent: Dict[str, tuple] = field(default_factory=dict)  # (timestamps, values)
 
 
 class TrendAnalyzer:
     """Analyzes trends and predicts future problems"""
     
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, cache_minutes: int = 5):
         self.db = db_manager
+        self._windows: Dict[int, _TrendWindow] = {}
+        
+        # Data only changes once per sensor read interval (5 min by default)
+        self._cache_seconds = cache_minutes * 60
+        self._results: Dict[tuple, dict] = {}
+        
+        # Windows and memo are shared state; callers may run in worker threads
+        self._lock = threading.Lock()
     
     def analyze_parameter_trend(self, parameter: str, hours: int = 24) -> dict:
         """
@@ -27,28 +222,43 @@ class TrendAnalyzer:
             'time_to_threshold': hours (or None),
             'recommendation': str
         }
+        
+        Results are reused until the parameter's readings change; don't mutate them.
         """
-        # Get historical data
-        data = self._get_historical_data(parameter, hours)
+        with self._lock:
+            # Bring the shared window up to date (once per read interval)
+            trend_window = self._update_window(hours, int(time.time() // self._cache_seconds))
+            key = (parameter, hours, trend_window.versions.get(parameter))
+            
+            result = self._results.get(key)
+            if result is None:
+                result = self._analyze_parameter_trend(parameter, trend_window)
+                if len(self._results) >= _RESULT_CACHE_SIZE:
+                    del self._results[next(iter(self._results))]
+                self._results[key] = result
+            
+            return result
+    
+    def _analyze_parameter_trend(self, parameter: str, trend_window: _TrendWindow) -> dict:
+        """Compute a trend result from the up-to-date window"""
+        window = trend_window.sums.get(parameter)
+        recent = trend_window.recent.get(parameter)
         
-        if len(data) < 5:
+        if window is None or window.count < 5 or not recent:
             return {
                 'trend': 'insufficient_data',
                 'concern_level': 'none',
                 'recommendation': 'Need more data points (collecting...)'
             }
         
-        # Calculate trend
-        values = [d['value'] for d in data]
-        timestamps = [d['timestamp'] for d in data]
-        
         # Linear regression to find trend
-        trend_direction, rate_of_change = self._calculate_trend(values, timestamps)
+        trend_direction, rate_of_change = self._calculate_trend(window)
         
         # Detect volatility
-        volatility = self._calculate_volatility(values)
+        volatility = self._calculate_volatility(window)
         
         # Predict future
+        timestamps, values = recent
         current_value = values[-1]
         prediction = self._predict_future(
             parameter,
@@ -76,72 +286,107 @@ class TrendAnalyzer:
             'concern_level': concern['level'],
             'time_to_threshold': concern.get('time_to_threshold'),
             'recommendation': concern['recommendation'],
-            'historical_data': data[-10:]  # Last 10 points for visualization
+            'historical_data': [  # Last 10 points for visualization
+                {'timestamp': timestamp, 'value': value}
+                for timestamp, value in zip(timestamps, values)
+            ]
         }
     
-    def _get_historical_data(self, parameter: str, hours: int) -> List[dict]:
-        """Query database for historical readings"""
-        # This connects to your existing database
-        since = datetime.now() - timedelta(hours=hours)
+    def _update_window(self, hours: int, bucket: int) -> _TrendWindow:
+        """Apply new readings to the window and age out old ones"""
+        window = self._windows.get(hours)
+        if window is None:
+            window = self._windows[hours] = _TrendWindow()
+        
+        if window.bucket == bucket:
+            return window
+        
+        since = time.time() - hours * 3600
+        origin = since / 86400 + _UNIX_EPOCH_JD
+        params = {
+            'origin': window.origin,
+            'since': since,
+            'prev_since': window.since,
+            'last_id': window.last_id,
+        }
         
         try:
-            query = """
-                SELECT timestamp, value 
-                FROM sensor_readings 
-                WHERE parameter = ? AND timestamp >= ?
-                ORDER BY timestamp ASC
-            """
-            
-            # Map parameter names to your DB schema
-            param_map = {
-                'ph': 'ph',
-                'temperature': 'temp_reservoir',
-                'do': 'do',
-                'ec': 'ec'
-            }
+            conn = self.db.conn
             
-            db_param = param_map.get(parameter, parameter)
+            expired = None
+            if window.last_id:
+                expired = conn.execute(_EXPIRED_SUMS_SQL, params).fetchone()
             
-            # Execute query (assuming you have SQLite)
-            cursor = self.db.conn.execute(query, (db_param, since.isoformat()))
-            rows = cursor.fetchall()
+            params['origin'] = origin
+            new = conn.execute(_NEW_SUMS_SQL, params).fetchone()
             
-            return [
-                {'timestamp': row[0], 'value': row[1]}
-                for row in rows
+            # A parameter only changes when its rows arrive or age out
+            # (each parameter's count leads its 6 aggregate columns)
+            changed = [
+                bool(new[6 * i] or (expired is not None and expired[6 * i]))
+                for i in range(len(_PARAM_COLUMNS))
             ]
+            if any(changed) or not window.recent:
+                recent = self._get_historical_data(since)
+            else:
+                recent = window.recent
             
-        except Exception as e:
-            print(f"Error querying historical data: {e}")
-            return []
+        except Exception:
+            logger.exception("Error querying historical data")
+            return window
+        
+        # Expired sums are relative to the old origin, new ones to the new origin
+        shift = (origin - window.origin) * 24.0
+        for i, param in enumerate(_PARAM_COLUMNS):
+            sums = window.sums[param]
+            if expired is not None and expired[6 * i]:
+                sums.add(expired[6 * i:6 * i + 6], -1)
+            sums.shift(shift)
+            if new[6 * i]:
+                sums.add(new[6 * i:6 * i + 6])
+            if changed[i]:
+                window.versions[param] += 1
+        
+        if new[-1] is not None:
+            window.last_id = new[-1]
+        window.origin = origin
+        window.since = since
+        window.bucket = bucket
+        window.recent = recent
+        
+        return window
+    
+    def _get_historical_data(self, since: float) -> Dict[str, tuple]:
+        """
+        Query database for the last 10 readings of each parameter
+        Returns (timestamps, values) columns per parameter, oldest first
+        """
+        rows = self.db.conn.execute(_RECENT_ROWS_SQL, {'since': since}).fetchall()
+        
+        recent = {}
+        for param, group in groupby(rows, key=itemgetter(0)):
+            _, timestamps, values = zip(*group)
+            recent[param] = (timestamps[::-1], array('d', reversed(values)))
+        
+        return recent
     
-    def _calculate_trend(self, values: List[float], timestamps: List[str]) -> tuple:
+    def _calculate_trend(self, window: _RollingRegression) -> tuple:
         """
         Calculate trend direction and rate of change
-        Uses simple linear regression
+        Uses the window's running least-squares sums
         """
-        if len(values) < 2:
+        n = window.count
+        if n < 2:
             return 'stable', 0.0
         
-        # Convert timestamps to hours from first reading
-        first_time = datetime.fromisoformat(timestamps[0])
-        hours = [
-            (datetime.fromisoformat(t) - first_time).total_seconds() / 3600
-            for t in timestamps
-        ]
-        
-        # Simple linear regression
-        n = len(values)
-        sum_x = sum(hours)
-        sum_y = sum(values)
-        sum_xy = sum(h * v for h, v in zip(hours, values))
-        sum_x2 = sum(h * h for h in hours)
+        sum_x = window.sum_x
         
         # Slope (rate of change per hour)
-        if n * sum_x2 - sum_x * sum_x == 0:
-            slope = 0
+        denominator = n * window.sum_x2 - sum_x * sum_x
+        if denominator == 0:
+            slope = 0.0
         else:
-            slope = (n * sum_xy - sum_x * sum_y) / (n * sum_x2 - sum_x * sum_x)
+            slope = (n * window.sum_xy - sum_x * window.sum_y) / denominator
         
         # Determine direction
         if abs(slope) < 0.01:  # Very small change
@@ -155,13 +400,16 @@ class TrendAnalyzer:
         
         return direction, slope
     
-    def _calculate_volatility(self, values: List[float]) -> str:
+    def _calculate_volatility(self, window: _RollingRegression) -> str:
         """Calculate how volatile the readings are"""
-        if len(values) < 3:
+        n = window.count
+        if n < 3:
             return 'unknown'
         
-        std_dev = statistics.stdev(values)
-        mean = statistics.mean(values)
+        # Sample standard deviation from the running sums
+        mean = window.sum_y / n
+        variance = max(window.sum_y2 - window.sum_y * mean, 0.0) / (n - 1)
+        std_dev = math.sqrt(variance)
         
         # Coefficient of variation
         cv = (std_dev / mean) * 100 if mean != 0 else 0
@@ -187,139 +435,73 @@ class TrendAnalyzer:
         """
         Assess concern level and time to threshold
         """
-        # Define thresholds for each parameter
-        thresholds = {
-            'ph': {
-                'critical_low': 6.0,
-                'warning_low': 6.5,
-                'optimal_low': 6.8,
-                'optimal_high': 7.5,
-                'warning_high': 8.0,
-                'critical_high': 8.5
-            },
-            'temperature': {
-                'critical_low': 15,
-                'warning_low': 18,
-                'optimal_low': 20,
-                'optimal_high': 24,
-                'warning_high': 26,
-                'critical_high': 28
-            },
-            'do': {
-                'critical_low': 4,
-                'warning_low': 6,
-                'optimal_low': 7,
-                'optimal_high': 10,
-                'warning_high': 12,
-                'critical_high': 15
-            }
-        }
-        
-        thresh = thresholds.get(parameter, {})
-        if not thresh:
+        thresh = _THRESHOLDS.get(parameter)
+        if thresh is None:
             return {'level': 'none', 'recommendation': 'No thresholds defined'}
         
-        concern = {
-            'level': 'none',
-            'recommendation': 'Continue monitoring',
-            'time_to_threshold': None
-        }
+        messages = _MESSAGES[parameter]
         
-        # Check if falling and approaching critical low
+        # Zone lookups: thresholds strictly below / strictly above current
         if trend == 'falling' and rate < 0:
-            hours_to_warning = None
-            hours_to_critical = None
-            
-            if current > thresh['warning_low']:
-                hours_to_warning = (current - thresh['warning_low']) / abs(rate)
-            
-            if current > thresh['critical_low']:
-                hours_to_critical = (current - thresh['critical_low']) / abs(rate)
-            
-            # Critical: Will hit critical threshold in < 12 hours
-            if hours_to_critical and hours_to_critical < 12:
-                concern = {
-                    'level': 'critical',
-                    'time_to_threshold': round(hours_to_critical, 1),
-                    'recommendation': f"⚠️ URGENT: {parameter.upper()} dropping fast! Will reach critical threshold ({thresh['critical_low']}) in {hours_to_critical:.1f} hours. Take action NOW to reverse trend."
-                }
-            # Warning: Will hit warning threshold in < 24 hours
-            elif hours_to_warning and hours_to_warning < 24:
-                concern = {
-                    'level': 'warning',
-                    'time_to_threshold': round(hours_to_warning, 1),
-                    'recommendation': f"⚠️ {parameter.upper()} declining. Will reach warning threshold ({thresh['warning_low']}) in {hours_to_warning:.1f} hours. Prepare to intervene."
-                }
-            # Watch: Falling but not immediate concern
-            elif current > thresh['optimal_low']:
-                concern = {
-                    'level': 'watch',
-                    'recommendation': f"📉 {parameter.upper()} trending down at {abs(rate):.3f}/hour. Monitor closely."
-                }
-        
-        # Check if rising and approaching critical high
+            direction = messages.falling
+            ahead = bisect_left(thresh, current)
         elif trend == 'rising' and rate > 0:
-            hours_to_warning = None
-            hours_to_critical = None
-            
-            if current < thresh['warning_high']:
-                hours_to_warning = (thresh['warning_high'] - current) / rate
-            
-            if current < thresh['critical_high']:
-                hours_to_critical = (thresh['critical_high'] - current) / rate
-            
-            if hours_to_critical and hours_to_critical < 12:
-                concern = {
+            direction = messages.rising
+            ahead = len(thresh) - bisect_right(thresh, current)
+        else:
+            # Stable or in optimal range
+            if bisect_right(thresh, current) >= 3 and bisect_left(thresh, current) <= 3:
+                return {'level': 'none', 'recommendation': messages.stable_optimal}
+            return {'level': 'watch', 'recommendation': messages.stable_outside}
+        
+        speed = abs(rate)
+        
+        # Critical: Will hit critical threshold in < 12 hours
+        if ahead >= 1:
+            hours_to_critical = abs(current - direction.critical) / speed
+            if hours_to_critical < 12:
+                return {
                     'level': 'critical',
                     'time_to_threshold': round(hours_to_critical, 1),
-                    'recommendation': f"⚠️ URGENT: {parameter.upper()} rising fast! Will reach critical threshold ({thresh['critical_high']}) in {hours_to_critical:.1f} hours. Take action NOW."
+                    'recommendation': direction.critical_msg % hours_to_critical
                 }
-            elif hours_to_warning and hours_to_warning < 24:
-                concern = {
+        
+        # Warning: Will hit warning threshold in < 24 hours
+        if ahead >= 2:
+            hours_to_warning = abs(current - direction.warning) / speed
+            if hours_to_warning < 24:
+                return {
                     'level': 'warning',
                     'time_to_threshold': round(hours_to_warning, 1),
-                    'recommendation': f"⚠️ {parameter.upper()} increasing. Will reach warning threshold ({thresh['warning_high']}) in {hours_to_warning:.1f} hours."
-                }
-            elif current < thresh['optimal_high']:
-                concern = {
-                    'level': 'watch',
-                    'recommendation': f"📈 {parameter.upper()} trending up at {rate:.3f}/hour. Monitor closely."
+                    'recommendation': direction.warning_msg % hours_to_warning
                 }
         
-        # Stable or in optimal range
-        else:
-            if thresh['optimal_low'] <= current <= thresh['optimal_high']:
-                concern = {
-                    'level': 'none',
-                    'recommendation': f"✅ {parameter.upper()} stable in optimal range. Continue current management."
-                }
-            else:
-                concern = {
-                    'level': 'watch',
-                    'recommendation': f"👁️ {parameter.upper()} outside optimal but stable. Watch for changes."
-                }
+        # Watch: Moving but not immediate concern
+        if ahead >= 3:
+            return {
+                'level': 'watch',
+                'recommendation': direction.watch_msg % speed
+            }
         
-        return concern
+        return {
+            'level': 'none',
+            'recommendation': 'Continue monitoring',
+            'time_to_threshold': None
+        }
     
     def analyze_all_trends(self) -> dict:
         """Analyze trends for all parameters"""
         parameters = ['ph', 'temperature', 'do']
         
         trends = {}
-        highest_concern = 'none'
         urgent_actions = []
         
         for param in parameters:
             trend = self.analyze_parameter_trend(param, hours=24)
             trends[param] = trend
             
-            # Track highest concern
-            concern_levels = ['none', 'watch', 'warning', 'critical']
-            if concern_levels.index(trend['concern_level']) > concern_levels.index(highest_concern):
-                highest_concern = trend['concern_level']
-            
             # Collect urgent actions
-            if trend['concern_level'] in ['warning', 'critical']:
+            if trend['concern_level'] in _URGENT_LEVELS:
                 urgent_actions.append({
                     'parameter': param,
                     'level': trend['concern_level'],
@@ -327,6 +509,13 @@ class TrendAnalyzer:
                     'time_to_threshold': trend.get('time_to_threshold')
                 })
         
+        # Track highest concern
+        highest_concern = max(
+            (trend['concern_level'] for trend in trends.values()),
+            key=_CONCERN_RANK.__getitem__,
+            default='none'
+        )
+        
         # Sort actions by urgency (shortest time first)
         urgent_actions.sort(key=lambda x: x.get('time_to_threshold', 999))
         
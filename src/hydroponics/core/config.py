@@ -3,11 +3,24 @@ Configuration file for STEM DREAM Aquaponics Control System
 Edit this file to customize your system settings
 """
 
+import json
+import logging
 import os
-from dataclasses import dataclass
+import sys
+from dataclasses import asdict, dataclass, field
 
+logger = logging.getLogger(__name__)
 
-@dataclass
+# __slots__ dataclasses need Python 3.10+
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+def _env(name: str, default: str = ''):
+    """Field read from the environment each time a Config is created"""
+    return field(default_factory=lambda: os.getenv(name, default))
+
+
+@dataclass(frozen=True, **_SLOTS)
 class Config:
     """System configuration"""
     
@@ -78,32 +91,62 @@ class Config:
     
     # === LLM SETTINGS ===
     # LLM backend: 'openai', 'anthropic', 'ollama', or 'mock'
-    llm_backend: str = os.getenv('LLM_BACKEND', 'mock')
+    llm_backend: str = _env('LLM_BACKEND', 'mock')
     
     # API keys (use environment variables for security)
-    llm_api_key: str = os.getenv('LLM_API_KEY', '')
+    llm_api_key: str = _env('LLM_API_KEY', '')
     
     # Ollama settings (for local LLM)
-    ollama_url: str = os.getenv('OLLAMA_URL', 'http://localhost:11434')
+    # Concurrent chat requests overlap only if the Ollama server is started
+    # with OLLAMA_NUM_PARALLEL > 1 (each parallel slot costs context memory)
+    ollama_url: str = _env('OLLAMA_URL', 'http://localhost:11434')
     ollama_model: str = 'llama3'
     
+    # Reuse an answer to the same question while the system state is
+    # unchanged, for up to this many seconds (0 disables the cache)
+    llm_cache_seconds: int = 300
+    
+    # Per-attempt timeout and retries (exponential backoff) for LLM calls;
+    # an async chat gives up after llm_deadline seconds in total
+    llm_timeout: float = 30.0
+    llm_max_retries: int = 3
+    llm_deadline: float = 90.0
+    
+    # Chat turns kept in full; older ones are folded into a short summary
+    llm_history_turns: int = 20
+    
+    # Chat turns are appended here and reloaded on restart ('' disables)
+    llm_history_path: str = "data/logs/llm_history.jsonl"
+    
+    # Answer short reading/definition questions from canned replies
+    # before calling the configured backend
+    llm_local_first: bool = True
+    
+    # Ollama server tried before a cloud backend; escalates to the cloud
+    # only if it fails or hedges (empty disables this tier)
+    llm_local_url: str = _env('LLM_LOCAL_URL', '')
+    
     # === EMAIL ALERT SETTINGS ===
     email_enabled: bool = False
-    email_from: str = os.getenv('EMAIL_FROM', '')
-    email_password: str = os.getenv('EMAIL_PASSWORD', '')
-    email_to: str = os.getenv('EMAIL_TO', '')
+    email_from: str = _env('EMAIL_FROM', '')
+    email_password: str = _env('EMAIL_PASSWORD', '')
+    email_to: str = _env('EMAIL_TO', '')
     
     # === SMS ALERT SETTINGS (Twilio) ===
     sms_enabled: bool = False
-    twilio_account_sid: str = os.getenv('TWILIO_ACCOUNT_SID', '')
-    twilio_auth_token: str = os.getenv('TWILIO_AUTH_TOKEN', '')
-    twilio_from: str = os.getenv('TWILIO_FROM', '')
-    sms_to: str = os.getenv('SMS_TO', '')
+    twilio_account_sid: str = _env('TWILIO_ACCOUNT_SID', '')
+    twilio_auth_token: str = _env('TWILIO_AUTH_TOKEN', '')
+    twilio_from: str = _env('TWILIO_FROM', '')
+    sms_to: str = _env('SMS_TO', '')
     
     # === WEB INTERFACE SETTINGS ===
     web_host: str = "0.0.0.0"
     web_port: int = 8000
     
+    # Pub/sub URL (e.g. redis://localhost:6379) that relays WebSocket
+    # broadcasts between uvicorn workers; empty keeps them in-process
+    broadcast_url: str = _env('BROADCAST_URL', '')
+    
     # === SYSTEM SETTINGS ===
     system_name: str = "STEM DREAM Aquaponics"
     location: str = "Basement Lab"
@@ -155,82 +198,103 @@ class Config:
 # Create global config instance
 config = Config()
 
+# (instance, JSON text) for the last serialized config
+_json_cache = (None, "")
+
 
 # === HELPER FUNCTIONS ===
 
-def load_config_from_file(filepath: str = ".env"):
-    """Load configuration from .env file"""
+def load_config_from_file(filepath: str = ".env") -> Config:
+    """Load configuration from .env file and return the new instance"""
+    global config
+    
     try:
         from dotenv import load_dotenv
         load_dotenv(filepath)
         
-        # Reload config with environment variables
-        global config
+        # Env-backed fields are read when the instance is created
         config = Config()
         
-        print(f"Configuration loaded from {filepath}")
-    except Exception as e:
-        print(f"Could not load config file: {e}")
+        logger.info("Configuration loaded from %s", filepath)
+    except Exception:
+        logger.exception("Could not load config file %s", filepath)
+    
+    return config
+
+
+def config_json() -> str:
+    """Return the current configuration as JSON, serialized once per instance"""
+    global _json_cache
+    
+    # Config is frozen, so the text only goes stale when config is replaced
+    if _json_cache[0] is not config:
+        _json_cache = (config, json.dumps(asdict(config), indent=2))
+    return _json_cache[1]
 
 
 def save_config_to_file(filepath: str = "config_backup.txt"):
     """Save current configuration to file"""
     try:
-        import json
-        
-        config_dict = {
-            key: value for key, value in config.__dict__.items()
-            if not key.startswith('_')
-        }
-        
         with open(filepath, 'w') as f:
-            json.dump(config_dict, f, indent=2)
+            f.write(config_json())
         
-        print(f"Configuration saved to {filepath}")
-    except Exception as e:
-        print(f"Could not save config: {e}")
+        logger.info("Configuration saved to %s", filepath)
+    except Exception:
+        logger.exception("Could not save config to %s", filepath)
 
 
 def print_config():
-    """Print current configuration"""
-    print("\n=== STEM DREAM Aquaponics Configuration ===\n")
+    """Log current configuration"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
     
-    print(f"System Name: {config.system_name}")
-    print(f"System Type: {config.system_type}")
-    print(f"Location: {config.location}")
-    
-    print("\n--- Sensor Settings ---")
-    print(f"Read Interval: {config.sensor_read_interval} minutes")
-    
-    print("\n--- pH Thresholds ---")
-    print(f"Optimal: {config.ph_min} - {config.ph_max}")
-    print(f"Critical: < {config.ph_critical_low} or > {config.ph_critical_high}")
-    
-    print("\n--- EC Thresholds ---")
-    print(f"Optimal: {config.ec_min} - {config.ec_max} mS/cm")
-    
-    print("\n--- DO Thresholds ---")
-    print(f"Normal: {config.do_normal} mg/L")
-    print(f"Critical: < {config.do_critical} mg/L")
-    
-    print("\n--- Temperature Thresholds ---")
-    print(f"Optimal: {config.temp_min} - {config.temp_max}Â°C")
-    
-    print("\n--- LLM Settings ---")
-    print(f"Backend: {config.llm_backend}")
+    lines = [
+        "\n=== STEM DREAM Aquaponics Configuration ===\n",
+        
+        f"System Name: {config.system_name}",
+        f"System Type: {config.system_type}",
+        f"Location: {config.location}",
+        
+        "\n--- Sensor Settings ---",
+        f"Read Interval: {config.sensor_read_interval} minutes",
+        
+        "\n--- pH Thresholds ---",
+        f"Optimal: {config.ph_min} - {config.ph_max}",
+        f"Critical: < {config.ph_critical_low} or > {config.ph_critical_high}",
+        
+        "\n--- EC Thresholds ---",
+        f"Optimal: {config.ec_min} - {config.ec_max} mS/cm",
+        
+        "\n--- DO Thresholds ---",
+        f"Normal: {config.do_normal} mg/L",
+        f"Critical: < {config.do_critical} mg/L",
+        
+        "\n--- Temperature Thresholds ---",
+        f"Optimal: {config.temp_min} - {config.temp_max}Â°C",
+        
+        "\n--- LLM Settings ---",
+        f"Backend: {config.llm_backend}",
+    ]
     if config.llm_backend == 'ollama':
-        print(f"Ollama URL: {config.ollama_url}")
-    
-    print("\n--- Alert Settings ---")
-    print(f"Email Alerts: {'Enabled' if config.email_enabled else 'Disabled'}")
-    print(f"SMS Alerts: {'Enabled' if config.sms_enabled else 'Disabled'}")
-    
-    print("\n--- Automation ---")
-    print(f"Auto Control: {'Enabled' if config.auto_control_enabled else 'Disabled'}")
-    print(f"Lights Schedule: {config.lights_on_hour}:00 - {config.lights_off_hour}:00")
+        lines.append(f"Ollama URL: {config.ollama_url}")
+    elif config.llm_local_url:
+        lines.append(f"Local LLM URL: {config.llm_local_url}")
+    
+    lines += [
+        "\n--- Alert Settings ---",
+        f"Email Alerts: {'Enabled' if config.email_enabled else 'Disabled'}",
+        f"SMS Alerts: {'Enabled' if config.sms_enabled else 'Disabled'}",
+        
+        "\n--- Automation ---",
+        f"Auto Control: {'Enabled' if config.auto_control_enabled else 'Disabled'}",
+        f"Lights Schedule: {config.lights_on_hour}:00 - {config.lights_off_hour}:00",
+        
+        "\n==========================================\n",
+    ]
     
-    print("\n==========================================\n")
+    logger.info("\n".join(lines))
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     print_config()
@@ -4,31 +4,36 @@ Main application with ML plant health detection and LLM integration
 """
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from pathlib import Path
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import orjson
+
+try:
+    from broadcaster import Broadcast
+except ImportError:
+    Broadcast = None
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
 import asyncio
-import json
 import logging
 
 # Local imports
-from hydroponics.sensors.interfaces import atlas_sensors, temperature_sensors, water_level, relay_control
+from hydroponics.sensors.interfaces import SensorSnapshot, atlas_sensors, temperature_sensors, water_level, relay_control
 # Initialize temperature sensors immediately
 temperature_sensors.initialize()
 from hydroponics.ml.vision import PlantHealthAnalyzer
 from hydroponics.llm.interface import AquaponicsLLM
 from hydroponics.database.manager import DatabaseManager
 from hydroponics.alerts.manager import AlertManager
-from hydroponics.core.config import Config
+from hydroponics.core.config import config
 from hydroponics.akbs.interface import get_akbs
 
 # Configure logging
-from hydroponics.core.config import config
-
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -47,7 +52,6 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 # Initialize components
-config = Config()
 db_manager = DatabaseManager(config.database_path)
 alert_manager = AlertManager(config)
 plant_analyzer = PlantHealthAnalyzer()
@@ -78,92 +82,201 @@ system_state = {
     },
     'system_status': 'starting',
     'last_update': None,
-    'alerts': []
+    # Bounded: appends past 10 drop the oldest alert
+    'alerts': deque(maxlen=10)
 }
 
-# WebSocket connections
-active_connections: List[WebSocket] = []
+# Newest reading from the polling job. Request handlers use this rather than
+# reading the sensors themselves, which blocks for seconds per call.
+latest_snapshot: Optional[SensorSnapshot] = None
+
+# Recent readings (in alert_manager.sensor_order()) for drift detection
+recent_readings: deque = deque(maxlen=alert_manager.trend_window + 1)
+
+# Encoded /api/status payload, rebuilt only after the state changes
+status_cache = b""
+status_dirty = True
 
-# Scheduler for periodic tasks
-scheduler = BackgroundScheduler()
+# Scheduler for periodic tasks; jobs run on the app's event loop
+scheduler = AsyncIOScheduler()
+
+# Sensor and relay calls share the I2C/GPIO buses, so they run one at a time
+hardware_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hardware')
+
+
+@dataclass
+class Channel:
+    """A WebSocket client with its own bounded outbound queue"""
+    websocket: WebSocket
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=32))
+    relay_task: Optional[asyncio.Task] = None
+    
+    def send(self, message):
+        """Queue a message (dict as JSON, str as text), dropping the oldest if full"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
 
 
 class ConnectionManager:
     """Manage WebSocket connections"""
     
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, pubsub=None):
+        self.channels: Dict[WebSocket, Channel] = {}
+        # Shared pub/sub so every worker's clients see every broadcast
+        self.pubsub = pubsub
     
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket) -> Channel:
         await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"Client connected. Total connections: {len(self.active_connections)}")
+        channel = Channel(websocket)
+        channel.relay_task = asyncio.create_task(self._relay(channel))
+        self.channels[websocket] = channel
+        logger.info(f"Client connected. Total connections: {len(self.channels)}")
+        return channel
     
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        logger.info(f"Client disconnected. Total connections: {len(self.active_connections)}")
+        channel = self.channels.pop(websocket, None)
+        if channel is None:
+            return
+        if channel.relay_task is not asyncio.current_task():
+            channel.relay_task.cancel()
+        logger.info(f"Client disconnected. Total connections: {len(self.channels)}")
+    
+    async def _relay(self, channel: Channel):
+        """Send queued messages to one client; only this task writes to its socket"""
+        try:
+            while True:
+                message = await channel.queue.get()
+                if isinstance(message, str):
+                    await channel.websocket.send_text(message)
+                else:
+                    await channel.websocket.send_json(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending to client: {e}")
+            self.disconnect(channel.websocket)
     
     async def broadcast(self, message: dict):
-        """Broadcast message to all connected clients"""
-        disconnected = []
-        for connection in self.active_connections:
+        """Send a message to every client, through pub/sub when configured"""
+        # Encode once; every client's relay sends the same text frame
+        payload = orjson.dumps(message).decode()
+        if self.pubsub is not None:
             try:
-                await connection.send_json(message)
+                await self.pubsub.publish(channel=BROADCAST_CHANNEL, message=payload)
+                return
             except Exception as e:
-                logger.error(f"Error broadcasting to client: {e}")
-                disconnected.append(connection)
-        
-        # Clean up disconnected clients
-        for connection in disconnected:
-            self.disconnect(connection)
+                logger.error(f"Error publishing broadcast: {e}")
+        self.fanout(payload)
+    
+    def fanout(self, message):
+        """Queue a message for every client on this worker without waiting on sends"""
+        for channel in list(self.channels.values()):
+            channel.send(message)
+    
+    async def listen(self):
+        """Relay pub/sub broadcasts (already JSON text) to this worker's clients"""
+        async with self.pubsub.subscribe(channel=BROADCAST_CHANNEL) as subscriber:
+            async for event in subscriber:
+                self.fanout(event.message)
+
+
+BROADCAST_CHANNEL = "system"
+
+pubsub = None
+if config.broadcast_url:
+    if Broadcast is not None:
+        pubsub = Broadcast(config.broadcast_url)
+    else:
+        logger.warning("BROADCAST_URL is set but broadcaster is not installed; broadcasting in-process only")
 
-manager = ConnectionManager()
+manager = ConnectionManager(pubsub)
+listen_task: Optional[asyncio.Task] = None
 
+# In-flight plant analysis; one camera means concurrent requests share a run
+plant_analysis: Optional[asyncio.Task] = None
 
-def read_all_sensors():
+
+async def run_on_hardware(func, *args):
+    """Run a blocking sensor/relay call on the hardware thread"""
+    return await asyncio.get_running_loop().run_in_executor(hardware_executor, func, *args)
+
+
+def invalidate_status():
+    """Mark the cached /api/status payload stale after a state change"""
+    global status_dirty
+    status_dirty = True
+
+
+def dashboard_state() -> dict:
+    """Snapshot of the state the dashboard renders"""
+    return {
+        'sensors': dict(system_state['sensors']),
+        'relays': dict(system_state['relays']),
+        'alerts': list(system_state['alerts']),
+        'system_status': system_state['system_status'],
+        'last_update': system_state['last_update']
+    }
+
+
+def read_hardware() -> SensorSnapshot:
+    """Read every sensor (blocking; runs on the hardware thread)"""
+    # Read Atlas Scientific sensors (measured concurrently)
+    atlas = atlas_sensors.read_all()
+    
+    # Read temperature sensors
+    temps = temperature_sensors.read_all() or {}
+    
+    # Read water level
+    water_level_data = water_level.read_level()
+    
+    return SensorSnapshot(
+        ph=atlas['ph'],
+        ec=atlas['ec'],
+        do=atlas['do'],
+        temp_reservoir=temps.get('reservoir'),
+        temp_fish_tank=temps.get('fish_tank'),
+        water_level=water_level_data.distance_cm,
+        water_level_percent=water_level_data.water_level_percent
+    )
+
+
+async def read_all_sensors():
     """Read all sensor values"""
+    global latest_snapshot
     try:
         logger.info("Reading all sensors...")
         
-        # Read Atlas Scientific sensors
-        ph_value = atlas_sensors.read_ph()
-        ec_value = atlas_sensors.read_ec()
-        do_value = atlas_sensors.read_do()
-        
-        # Read temperature sensors
-        temps = temperature_sensors.read_all()
-        
-        # Read water level
-        water_level_data = water_level.read_level()
+        snapshot = await run_on_hardware(read_hardware)
+        latest_snapshot = snapshot
         
         # Update system state
-        system_state['sensors'].update({
-            'ph': ph_value,
-            'ec': ec_value,
-            'do': do_value,
-            "temp_reservoir": temps.get("reservoir") if temps else None,
-            "temp_fish_tank": temps.get("fish_tank") if temps else None,
-            'water_level': water_level_data.get('distance_cm'),
-            'water_level_percent': water_level_data.get('water_level_percent')
-        })
+        system_state['sensors'].update(snapshot.as_dict())
         
         system_state['last_update'] = datetime.now().isoformat()
         system_state['system_status'] = 'running'
         
-        # Log to database
-        db_manager.log_sensor_reading(system_state['sensors'])
+        # Hand to the database writer (batches its own commits, never blocks),
+        # stamped with the capture time (UTC, as SQLite stores it)
+        db_manager.log_sensor_reading({
+            **system_state['sensors'],
+            'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        })
         
-        # Check for alerts
+        # Check for alerts, including drift before hard limits are reached
         alerts = alert_manager.check_thresholds(system_state['sensors'])
+        recent_readings.append([system_state['sensors'].get(name) for name in alert_manager.sensor_order()])
+        alerts += alert_manager.check_trends(recent_readings)
         if alerts:
             system_state['alerts'].extend(alerts)
-            # Keep only last 10 alerts
-            system_state['alerts'] = system_state['alerts'][-10:]
         
-        # Note: WebSocket clients will poll system_state for updates
-        # No need to broadcast from scheduled function (no event loop here)
+        # Push the new readings to connected dashboards
+        invalidate_status()
+        await manager.broadcast({'type': 'sensor_update', 'data': dashboard_state()})
         
-        logger.info(f"Sensor reading complete: pH={ph_value}, EC={ec_value}, DO={do_value}, Temp={temps.get('reservoir')}")
+        logger.info(f"Sensor reading complete: pH={snapshot.ph}, EC={snapshot.ec}, DO={snapshot.do}, Temp={snapshot.temp_reservoir}")
         
     except Exception as e:
         logger.error(f"Error reading sensors: {e}")
@@ -173,18 +286,36 @@ def read_all_sensors():
             'level': 'error',
             'message': f"Sensor reading error: {str(e)}"
         })
+        invalidate_status()
+
+
+async def current_snapshot() -> SensorSnapshot:
+    """Latest polled readings, polling once if none have been taken yet"""
+    if latest_snapshot is None:
+        await read_all_sensors()
+    return latest_snapshot or SensorSnapshot()
+
+
+async def analyze_plant_health():
+    """Analyze plant health, joining the run already in progress if any"""
+    global plant_analysis
+    if plant_analysis is None or plant_analysis.done():
+        plant_analysis = asyncio.create_task(run_plant_analysis())
+    # Shielded so a caller that goes away doesn't cancel the shared run
+    await asyncio.shield(plant_analysis)
 
 
-def analyze_plant_health():
+async def run_plant_analysis():
     """Analyze plant health using computer vision"""
     try:
         logger.info("Analyzing plant health...")
         
         # Capture image and analyze
-        result = plant_analyzer.analyze()
+        result = await asyncio.to_thread(plant_analyzer.analyze)
+        now_iso = datetime.now().isoformat()
         
         system_state['plant_health'] = {
-            'last_analysis': datetime.now().isoformat(),
+            'last_analysis': now_iso,
             'status': result['status'],
             'issues': result['issues'],
             'confidence': result['confidence'],
@@ -192,17 +323,18 @@ def analyze_plant_health():
         }
         
         # Log to database
-        db_manager.log_plant_analysis(result)
+        await asyncio.to_thread(db_manager.log_plant_analysis, result)
         
         # Check if intervention needed
         if result['status'] != 'healthy':
             system_state['alerts'].append({
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': now_iso,
                 'level': 'warning',
                 'message': f"Plant health issue detected: {result['status']}"
             })
         
-        # Note: WebSocket clients will poll system_state for updates
+        invalidate_status()
+        await manager.broadcast({'type': 'plant_health_update', 'data': dict(system_state['plant_health'])})
         
         logger.info(f"Plant analysis complete: {result['status']}")
         
@@ -210,52 +342,59 @@ def analyze_plant_health():
         logger.error(f"Error analyzing plant health: {e}")
 
 
-def control_automation():
+async def control_automation():
     """Automated control logic"""
+    now_iso = None  # Formatted only if an alert is raised
     try:
         sensors = system_state['sensors']
         
         # Temperature-based heater control
         if sensors['temp_reservoir'] and sensors['temp_reservoir'] < config.temp_min:
-            relay_control.set_relay('heater', True)
+            await run_on_hardware(relay_control.set_relay, 'heater', True)
             system_state['relays']['heater'] = True
         elif sensors['temp_reservoir'] and sensors['temp_reservoir'] > config.temp_max:
-            relay_control.set_relay('heater', False)
+            await run_on_hardware(relay_control.set_relay, 'heater', False)
             system_state['relays']['heater'] = False
         
         # DO-based backup aerator control
         if sensors['do'] and sensors['do'] < config.do_critical:
-            relay_control.set_relay('backup_aerator', True)
+            await run_on_hardware(relay_control.set_relay, 'backup_aerator', True)
             system_state['relays']['backup_aerator'] = True
+            now_iso = now_iso or datetime.now().isoformat()
             system_state['alerts'].append({
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': now_iso,
                 'level': 'critical',
                 'message': f"CRITICAL: Low dissolved oxygen ({sensors['do']} mg/L) - backup aerator activated"
             })
         elif sensors['do'] and sensors['do'] > config.do_normal:
-            relay_control.set_relay('backup_aerator', False)
+            await run_on_hardware(relay_control.set_relay, 'backup_aerator', False)
             system_state['relays']['backup_aerator'] = False
         
         # Water level control
         if sensors['water_level_percent'] and sensors['water_level_percent'] < 20:
+            now_iso = now_iso or datetime.now().isoformat()
             system_state['alerts'].append({
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': now_iso,
                 'level': 'critical',
                 'message': f"CRITICAL: Low water level ({sensors['water_level_percent']:.1f}%)"
             })
         
     except Exception as e:
         logger.error(f"Error in automation control: {e}")
+    finally:
+        invalidate_status()
+
+
+def rollup_daily_summary():
+    """Store yesterday's (UTC) sensor summary once the day is complete"""
+    db_manager.rebuild_rollup(datetime.now(timezone.utc) - timedelta(days=1))
 
 
 # Schedule periodic tasks
 scheduler.add_job(read_all_sensors, 'interval', seconds=30, id='read_sensors')
 scheduler.add_job(analyze_plant_health, 'interval', hours=1, id='analyze_plants')
 scheduler.add_job(control_automation, 'interval', minutes=1, id='automation')
-scheduler.start()
-
-# Initial sensor reading on startup
-scheduler.add_job(read_all_sensors, id='startup_read')
+scheduler.add_job(rollup_daily_summary, 'cron', hour=0, minute=5, id='daily_rollup')
 
 
 # API Routes
@@ -272,69 +411,15 @@ async def read_root(request: Request):
 @app.get("/api/status")
 async def get_status():
     """Get current system status for dashboard refresh"""
-    try:
-        # Read all sensors
-        sensors = {
-            "ph": atlas_sensors.read_ph(),
-            "ec": atlas_sensors.read_ec(),
-            "do": atlas_sensors.read_do(),
-            "temp_reservoir": None,
-            "temp_fish_tank": None,
-            "water_level_percent": water_level.read_level().get("percent", 0.0) if water_level else 0.0
-        }
-        
-        # Read temperature sensors
-        temps = temperature_sensors.read_all()
-        if temps:
-            sensors["temp_reservoir"] = temps.get("reservoir")
-            sensors["temp_fish_tank"] = temps.get("fish_tank")
-        
-        # Get relay states
-        relays = {}
-        if relay_control and hasattr(relay_control, 'relays') and relay_control.relays:
-            for relay_name in ["pump", "lights", "heater", "backup_aerator"]:
-                if relay_name in relay_control.relays:
-                    relays[relay_name] = relay_control.relays[relay_name].state
-                else:
-                    relays[relay_name] = False
-        else:
-            # Relays not initialized, return defaults
-            relays = {
-                "pump": False,
-                "lights": False,
-                "heater": False,
-                "backup_aerator": False
-            }
-        
-        # Get recent alerts (limit to last 10)
-        alerts = []
-        
-        # Determine overall system status
-        system_status = "running"
-        if any(alert.get("level") == "critical" for alert in alerts):
-            system_status = "error"
-        elif any(alert.get("level") == "warning" for alert in alerts):
-            system_status = "warning"
-        
-        return {
-            "sensors": sensors,
-            "relays": relays,
-            "alerts": alerts,
-            "system_status": system_status,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-    except Exception as e:
-        logger.error(f"Error getting status: {e}")
-        return {
-            "sensors": {},
-            "relays": {},
-            "alerts": [],
-            "system_status": "error",
-            "error": str(e)
-        }
-
-
+    global status_cache, status_dirty
+    if status_dirty:
+        # Clear first so an update landing mid-encode marks the cache stale again
+        status_dirty = False
+        status_cache = orjson.dumps({
+            **dashboard_state(),
+            'timestamp': system_state['last_update']
+        })
+    return Response(content=status_cache, media_type="application/json")
 
 
 @app.get("/api/sensors")
@@ -349,12 +434,26 @@ async def get_sensor_history(sensor: str, hours: int = 24):
     try:
         end_time = datetime.now()
         start_time = end_time - timedelta(hours=hours)
-        data = db_manager.get_sensor_history(sensor, start_time, end_time)
+        data = await asyncio.to_thread(db_manager.get_sensor_history, sensor, start_time, end_time)
         return JSONResponse(content=data)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/export/{hours}")
+async def export_sensor_data(hours: int = 24):
+    """Download sensor readings as CSV, streamed from the database"""
+    end_time = datetime.now()
+    start_time = end_time - timedelta(hours=hours)
+    return StreamingResponse(
+        db_manager.iter_csv(start_time, end_time),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=sensor_readings_{hours}h.csv"}
+    )
+
+
 @app.post("/api/relay/{relay_name}/{action}")
 async def control_relay(relay_name: str, action: str):
     """Control relay (on/off)"""
@@ -363,12 +462,13 @@ async def control_relay(relay_name: str, action: str):
             raise HTTPException(status_code=400, detail="Invalid relay name")
         
         state = action.lower() == 'on'
-        relay_control.set_relay(relay_name, state)
+        await run_on_hardware(relay_control.set_relay, relay_name, state)
         system_state['relays'][relay_name] = state
+        invalidate_status()
         
         # Log action
         logger.info(f"Relay {relay_name} set to {action}")
-        db_manager.log_action(f"relay_{relay_name}", action)
+        await asyncio.to_thread(db_manager.log_action, f"relay_{relay_name}", action)
         
         # Broadcast update
         await manager.broadcast({
@@ -389,7 +489,7 @@ async def control_relay(relay_name: str, action: str):
 async def trigger_plant_analysis():
     """Trigger immediate plant health analysis"""
     try:
-        analyze_plant_health()
+        await analyze_plant_health()
         return JSONResponse(content={
             'success': True,
             'message': 'Analysis started'
@@ -409,10 +509,10 @@ async def chat_with_llm(request: Request):
             raise HTTPException(status_code=400, detail="Message required")
         
         # Get LLM response with current system context
-        response = aquaponics_llm.get_response(user_message, system_state)
+        response = await aquaponics_llm.aget_response(user_message, system_state)
         
         # Log conversation
-        db_manager.log_conversation(user_message, response)
+        await asyncio.to_thread(db_manager.log_conversation, user_message, response)
         
         return JSONResponse(content={
             'response': response,
@@ -422,15 +522,35 @@ async def chat_with_llm(request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/chat/stream")
+async def chat_with_llm_stream(request: Request):
+    """Chat with LLM, streaming the reply as plain text while it is generated"""
+    data = await request.json()
+    user_message = data.get('message', '')
+    
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Message required")
+    
+    def reply():
+        parts = []
+        for chunk in aquaponics_llm.get_response_stream(user_message, system_state):
+            parts.append(chunk)
+            yield chunk
+        db_manager.log_conversation(user_message, "".join(parts))
+    
+    # Sync generator: Starlette iterates it in a worker thread
+    return StreamingResponse(reply(), media_type="text/plain")
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time updates"""
-    await manager.connect(websocket)
+    channel = await manager.connect(websocket)
     try:
         # Send initial state
-        await websocket.send_json({
+        channel.send({
             'type': 'initial_state',
-            'data': system_state
+            'data': {**system_state, 'alerts': list(system_state['alerts'])}
         })
         
         # Keep connection alive
@@ -438,7 +558,7 @@ async def websocket_endpoint(websocket: WebSocket):
             # Wait for ping from client
             data = await websocket.receive_text()
             if data == 'ping':
-                await websocket.send_text('pong')
+                channel.send('pong')
     except WebSocketDisconnect:
         manager.disconnect(websocket)
     except Exception as e:
@@ -449,8 +569,19 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.on_event("startup")
 async def startup_event():
     """Initialize system on startup"""
+    global listen_task
     logger.info("Starting STEM DREAM Aquaponics Control System...")
     
+    # Join the shared broadcast channel
+    if pubsub is not None:
+        try:
+            await pubsub.connect()
+            listen_task = asyncio.create_task(manager.listen())
+            logger.info("Broadcast pub/sub connected")
+        except Exception as e:
+            logger.error(f"Broadcast pub/sub error: {e}")
+            manager.pubsub = None
+    
     # Initialize hardware
     try:
         atlas_sensors.initialize()
@@ -461,6 +592,9 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Hardware initialization error: {e}")
     
+    # Compile alert kernels before the first scheduled check
+    await asyncio.to_thread(alert_manager.warm_up)
+    
     # Load ML models
     try:
         plant_analyzer.load_model()
@@ -468,6 +602,10 @@ async def startup_event():
     except Exception as e:
         logger.error(f"ML model loading error: {e}")
     
+    # Start periodic tasks, with an initial sensor reading right away
+    scheduler.start()
+    scheduler.add_job(read_all_sensors, id='startup_read')
+    
     logger.info("System startup complete")
 
 
@@ -476,7 +614,17 @@ async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("Shutting down system...")
     scheduler.shutdown()
+    hardware_executor.shutdown()
+    if listen_task is not None:
+        listen_task.cancel()
+        await pubsub.disconnect()
     relay_control.cleanup()
+    atlas_sensors.close()
+    temperature_sensors.close()
+    water_level.close()
+    plant_analyzer.close()
+    alert_manager.close()
+    aquaponics_llm.close()
     db_manager.close()
     logger.info("System shutdown complete")
 
@@ -490,7 +638,8 @@ async def knowledge_status():
     akbs = get_akbs()
     return {
         "available": akbs.available,
-        "chunks": akbs.collection.count() if akbs.collection else 0
+        "chunks": akbs.collection.count() if akbs.collection else 0,
+        "cache": akbs.get_cache_stats()
     }
 
 @app.get("/api/knowledge/query")
@@ -516,11 +665,12 @@ async def knowledge_parameter_info(param: str):
     akbs = get_akbs()
     
     # Get current sensor reading
+    snapshot = await current_snapshot()
     sensor_data = {
-        'ph': atlas_sensors.read_ph() if atlas_sensors else 7.0,
-        'temperature': temperature_sensors.read_all().get('reservoir', 22.0) if temperature_sensors else 22.0,
-        'do': atlas_sensors.read_do() if atlas_sensors else 7.5,
-        'water_level': water_level.read_level().get('distance_cm', 15.0) if water_level else 15.0
+        'ph': snapshot.ph,
+        'temperature': snapshot.temp_reservoir,
+        'do': snapshot.do,
+        'water_level': snapshot.water_level
     }
     
     value = sensor_data.get(param, 0)
@@ -534,11 +684,12 @@ async def knowledge_system_analysis():
     akbs = get_akbs()
     
     # Get all current readings
+    snapshot = await current_snapshot()
     sensor_data = {
-        'ph': atlas_sensors.read_ph() if atlas_sensors else 6.8,
-        'temperature': temperature_sensors.read_all().get('reservoir', 22.3) if temperature_sensors else 22.3,
-        'do': atlas_sensors.read_do() if atlas_sensors else 7.5,
-        'water_level': water_level.read_level().get('distance_cm', 15.2) if water_level else 15.2
+        'ph': snapshot.ph,
+        'temperature': snapshot.temp_reservoir,
+        'do': snapshot.do,
+        'water_level': snapshot.water_level
     }
     return akbs.query_with_sensor_context(sensor_data)
 
@@ -550,10 +701,11 @@ async def intelligent_parameter_analysis(param: str):
     akbs = get_akbs()
     
     # Get current sensor readings
+    snapshot = await current_snapshot()
     sensor_data = {
-        'ph': atlas_sensors.read_ph() if atlas_sensors else 6.9,
-        'temperature': temperature_sensors.read_all().get('reservoir', 22.0) if temperature_sensors else 22.0,
-        'do': atlas_sensors.read_do() if atlas_sensors else 7.5,
+        'ph': snapshot.ph,
+        'temperature': snapshot.temp_reservoir,
+        'do': snapshot.do,
     }
     
     value = sensor_data.get(param, 0)
@@ -568,10 +720,11 @@ async def predictive_analysis():
     akbs = get_akbs()
     
     # Get current readings
+    snapshot = await current_snapshot()
     sensor_data = {
-        'ph': atlas_sensors.read_ph() if atlas_sensors else 6.9,
-        'temperature': temperature_sensors.read_all().get('reservoir', 22.0) if temperature_sensors else 22.0,
-        'do': atlas_sensors.read_do() if atlas_sensors else 7.5,
+        'ph': snapshot.ph,
+        'temperature': snapshot.temp_reservoir,
+        'do': snapshot.do,
     }
     
     return akbs.get_predictive_analysis(sensor_data)
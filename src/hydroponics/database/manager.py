@@ -3,10 +3,16 @@ Database manager for logging sensor data, events, and system history
 Supports both SQLite (simple) and InfluxDB (time-series)
 """
 
+import csv
+import io
 import logging
+import queue
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 from pathlib import Path
 import json
 
@@ -14,12 +20,110 @@ logger = logging.getLogger(__name__)
 
 try:
     from influxdb_client import InfluxDBClient, Point
-    from influxdb_client.client.write_api import SYNCHRONOUS
+    from influxdb_client.client.write_api import WriteOptions
 except ImportError:
     logger.warning("influxdb_client not installed, using SQLite only")
     InfluxDBClient = None
 
 
+# INSERT statements for the logging paths; sqlite3 keeps them prepared in
+# its per-connection statement cache. Readings may carry their own UTC
+# capture time ('YYYY-MM-DD HH:MM:SS') so buffered rows keep their spacing.
+_INSERT_SQL = {
+    'sensor': """
+        INSERT INTO sensor_readings
+        (timestamp, ph, ec, do, temp_reservoir, temp_fish_tank, water_level_percent)
+        VALUES (COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, ?)
+    """,
+    'plant': """
+        INSERT INTO plant_analysis
+        (status, confidence, issues, recommendations)
+        VALUES (?, ?, ?, ?)
+    """,
+    'action': "INSERT INTO system_actions (action_type, action_value, user) VALUES (?, ?, ?)",
+    'alert': "INSERT INTO alerts (level, message) VALUES (?, ?)",
+    'conversation': "INSERT INTO conversations (user_message, assistant_response) VALUES (?, ?)",
+}
+
+
+# Logged writes are applied by one writer thread, a batch per transaction
+_WRITE_BATCH_SIZE = 100
+_WRITE_BATCH_SECONDS = 0.5
+
+
+# Sensor columns that can be queried by name
+_SENSOR_COLUMNS = ("ph", "ec", "do", "temp_reservoir", "temp_fish_tank", "water_level_percent")
+
+_HISTORY_SQL = {
+    name: f"""
+        SELECT timestamp, {name}
+        FROM sensor_readings
+        WHERE timestamp BETWEEN ? AND ?
+        AND {name} IS NOT NULL
+        ORDER BY timestamp
+    """
+    for name in _SENSOR_COLUMNS
+}
+
+
+# Statistics for one UTC day, named like the sensor_rollups_daily columns
+_DAILY_STATS_SQL = """
+    SELECT
+        :day AS day,
+        AVG(ph) AS avg_ph, MIN(ph) AS min_ph, MAX(ph) AS max_ph,
+        AVG(ec) AS avg_ec, MIN(ec) AS min_ec, MAX(ec) AS max_ec,
+        AVG(do) AS avg_do, MIN(do) AS min_do, MAX(do) AS max_do,
+        AVG(temp_reservoir) AS avg_temp,
+        COUNT(*) AS reading_count,
+        (SELECT COUNT(*) FROM alerts WHERE timestamp >= :day AND timestamp < :end) AS alert_count
+    FROM sensor_readings
+    WHERE timestamp >= :day AND timestamp < :end
+"""
+
+# Completed days are kept in sensor_rollups_daily, so their summaries are a
+# primary-key lookup and outlive the raw readings cleanup_old_data prunes
+_ROLLUP_SQL = "INSERT OR REPLACE INTO sensor_rollups_daily" + _DAILY_STATS_SQL
+
+
+def _day_bounds(day: datetime) -> Dict[str, str]:
+    """:day/:end parameters for the daily statistics queries"""
+    return {
+        'day': day.strftime('%Y-%m-%d'),
+        'end': (day + timedelta(days=1)).strftime('%Y-%m-%d')
+    }
+
+
+@contextmanager
+def _immediate_transaction(conn: sqlite3.Connection):
+    """
+    BEGIN IMMEDIATE ... COMMIT on an autocommit connection
+    Takes the write lock up front, so a busy database is waited on
+    (busy_timeout) at BEGIN rather than failing partway through.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        # Inside the try: a failed COMMIT must not leave the transaction open
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def _sensor_row(sensors: Dict) -> tuple:
+    """Parameters for the sensor INSERT"""
+    return (
+        sensors.get('timestamp'),
+        sensors.get('ph'),
+        sensors.get('ec'),
+        sensors.get('do'),
+        sensors.get('temp_reservoir'),
+        sensors.get('temp_fish_tank'),
+        sensors.get('water_level_percent')
+    )
+
+
 class DatabaseManager:
     """
     Manage data logging and retrieval
@@ -36,16 +140,38 @@ class DatabaseManager:
         # Initialize database
         self._init_sqlite()
         
+        # log_* calls only queue their INSERTs; the writer thread owns
+        # the write connection, so callers never wait on the write lock
+        self._write_q = queue.Queue()
+        self.writer_error = None  # set if the writer thread fails
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+        
         if self.use_influxdb:
             self._init_influxdb()
     
     def _init_sqlite(self):
         """Initialize SQLite database"""
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # Autocommit: reads never hold a transaction open, and writes
+            # say where their transactions begin
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
             self.conn.row_factory = sqlite3.Row
             cursor = self.conn.cursor()
             
+            # WAL lets readers (history, summaries) run while a reading is
+            # written, and NORMAL sync fsyncs at checkpoints, not per commit.
+            # WAL keeps -wal/-shm files next to the database, so back it up
+            # with sqlite3's .backup command rather than copying the file.
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
+            cursor.execute("PRAGMA busy_timeout = 5000")
+            
+            # 64 MB page cache, in-memory temp tables, memory-mapped reads
+            cursor.execute("PRAGMA cache_size = -65536")
+            cursor.execute("PRAGMA temp_store = MEMORY")
+            cursor.execute("PRAGMA mmap_size = 268435456")
+            
             # Create sensor readings table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS sensor_readings (
@@ -104,6 +230,19 @@ class DatabaseManager:
                 )
             """)
             
+            # Create daily rollups table (see _ROLLUP_SQL)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sensor_rollups_daily (
+                    day TEXT PRIMARY KEY,
+                    avg_ph REAL, min_ph REAL, max_ph REAL,
+                    avg_ec REAL, min_ec REAL, max_ec REAL,
+                    avg_do REAL, min_do REAL, max_do REAL,
+                    avg_temp REAL,
+                    reading_count INTEGER,
+                    alert_count INTEGER
+                )
+            """)
+            
             # Create indices for common queries
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_sensor_timestamp 
@@ -115,7 +254,24 @@ class DatabaseManager:
                 ON alerts(timestamp)
             """)
             
-            self.conn.commit()
+            # Partial indices let history queries seek straight to rows
+            # where that sensor actually has a value
+            for column in _SENSOR_COLUMNS:
+                cursor.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_sr_{column}_ts
+                    ON sensor_readings(timestamp) WHERE {column} IS NOT NULL
+                """)
+            
+            # For cleanup of acknowledged alerts
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_alerts_ack_ts
+                ON alerts(acknowledged, timestamp)
+            """)
+            
+            # Refresh planner statistics (sampled, so startup stays quick)
+            cursor.execute("PRAGMA analysis_limit = 1000")
+            cursor.execute("ANALYZE")
+            
             logger.info(f"SQLite database initialized: {self.db_path}")
             
         except Exception as e:
@@ -130,57 +286,140 @@ class DatabaseManager:
                 token="your-token",
                 org="your-org"
             )
-            self.influx_write_api = self.influx_client.write_api(write_options=SYNCHRONOUS)
+            # Points are queued and sent in batches by a background writer,
+            # so write() returns immediately; close() drains the queue
+            self.influx_write_api = self.influx_client.write_api(write_options=WriteOptions(
+                batch_size=500,
+                flush_interval=10_000,
+                jitter_interval=2_000,
+                retry_interval=5_000
+            ))
             logger.info("InfluxDB client initialized")
         except Exception as e:
             logger.error(f"Error initializing InfluxDB: {e}")
             self.use_influxdb = False
     
+    def _writer_loop(self):
+        """Apply queued writes on a private connection until close()"""
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA busy_timeout = 5000")
+            self._write_batches(conn)
+        except Exception as e:
+            # Keep consuming the queue so flush() and close() never hang
+            logger.error(f"Database writer failed, dropping queued writes: {e}")
+            self.writer_error = e
+            self._discard_writes()
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    def _write_batches(self, conn: sqlite3.Connection):
+        """Commit queued writes in batches until the close() sentinel"""
+        stop = False
+        while not stop:
+            write = self._write_q.get()
+            if write is None:
+                self._write_q.task_done()
+                break
+            
+            # Gather whatever else arrives shortly into the same transaction
+            batch = [write]
+            deadline = time.monotonic() + _WRITE_BATCH_SECONDS
+            while len(batch) < _WRITE_BATCH_SIZE:
+                try:
+                    write = self._write_q.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if write is None:
+                    self._write_q.task_done()
+                    stop = True
+                    break
+                batch.append(write)
+            
+            try:
+                self._apply_writes(conn, batch)
+            finally:
+                for _ in batch:
+                    self._write_q.task_done()
+    
+    def _discard_writes(self):
+        """Mark queued writes done without applying them, until close()"""
+        while True:
+            write = self._write_q.get()
+            self._write_q.task_done()
+            if write is None:
+                return
+    
+    def flush(self):
+        """
+        Wait until every queued write has been handled
+        Returns False if the writer has failed and the writes were dropped.
+        """
+        self._write_q.join()
+        return self.writer_error is None
+    
+    def _apply_writes(self, conn: sqlite3.Connection, batch: List[Tuple]):
+        """Run (sql, params, many) writes in one transaction"""
+        try:
+            with _immediate_transaction(conn):
+                for sql, params, many in batch:
+                    if many:
+                        conn.executemany(sql, params)
+                    else:
+                        conn.execute(sql, params)
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Error writing to database: {e}")
+                return
+            # Retry one at a time so a single bad write doesn't drop the rest
+            for write in batch:
+                self._apply_writes(conn, [write])
+    
     def log_sensor_reading(self, sensors: Dict):
         """Log sensor readings"""
+        self.log_sensor_readings_batch([sensors])
+    
+    def log_sensor_readings_batch(self, readings: List[Dict]):
+        """Log several sensor readings in a single transaction"""
         try:
             # SQLite logging
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                INSERT INTO sensor_readings 
-                (ph, ec, do, temp_reservoir, temp_fish_tank, water_level_percent)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                sensors.get('ph'),
-                sensors.get('ec'),
-                sensors.get('do'),
-                sensors.get('temp_reservoir'),
-                sensors.get('temp_fish_tank'),
-                sensors.get('water_level_percent')
-            ))
-            self.conn.commit()
+            self._write_q.put((_INSERT_SQL['sensor'], [_sensor_row(r) for r in readings], True))
             
             # InfluxDB logging (if enabled)
             if self.use_influxdb:
-                point = Point("sensors")
-                for key, value in sensors.items():
-                    if value is not None:
-                        point = point.field(key, value)
-                self.influx_write_api.write(bucket="aquaponics", record=point)
+                self.influx_write_api.write(
+                    bucket="aquaponics",
+                    record=[self._sensor_point(sensors) for sensors in readings]
+                )
             
         except Exception as e:
             logger.error(f"Error logging sensor reading: {e}")
     
+    def _sensor_point(self, sensors: Dict):
+        """Build an InfluxDB point for one reading"""
+        point = Point("sensors")
+        for key, value in sensors.items():
+            if key == 'timestamp':
+                if value is not None:
+                    point = point.time(
+                        datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+                    )
+            elif value is not None:
+                point = point.field(key, value)
+        return point
+    
     def log_plant_analysis(self, result: Dict):
         """Log plant health analysis"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                INSERT INTO plant_analysis 
-                (status, confidence, issues, recommendations)
-                VALUES (?, ?, ?, ?)
-            """, (
+            self._write_q.put((_INSERT_SQL['plant'], (
                 result.get('status'),
                 result.get('confidence'),
                 json.dumps(result.get('issues', [])),
                 json.dumps(result.get('recommendations', []))
-            ))
-            self.conn.commit()
+            ), False))
             
         except Exception as e:
             logger.error(f"Error logging plant analysis: {e}")
@@ -188,12 +427,7 @@ class DatabaseManager:
     def log_action(self, action_type: str, action_value: str, user: str = 'system'):
         """Log system action"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                INSERT INTO system_actions (action_type, action_value, user)
-                VALUES (?, ?, ?)
-            """, (action_type, action_value, user))
-            self.conn.commit()
+            self._write_q.put((_INSERT_SQL['action'], (action_type, action_value, user), False))
             
         except Exception as e:
             logger.error(f"Error logging action: {e}")
@@ -201,12 +435,7 @@ class DatabaseManager:
     def log_alert(self, level: str, message: str):
         """Log alert"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                INSERT INTO alerts (level, message)
-                VALUES (?, ?)
-            """, (level, message))
-            self.conn.commit()
+            self._write_q.put((_INSERT_SQL['alert'], (level, message), False))
             
         except Exception as e:
             logger.error(f"Error logging alert: {e}")
@@ -214,12 +443,7 @@ class DatabaseManager:
     def log_conversation(self, user_message: str, assistant_response: str):
         """Log LLM conversation"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                INSERT INTO conversations (user_message, assistant_response)
-                VALUES (?, ?)
-            """, (user_message, assistant_response))
-            self.conn.commit()
+            self._write_q.put((_INSERT_SQL['conversation'], (user_message, assistant_response), False))
             
         except Exception as e:
             logger.error(f"Error logging conversation: {e}")
@@ -231,23 +455,15 @@ class DatabaseManager:
         end_time: datetime
     ) -> List[Dict]:
         """Get historical sensor data"""
+        sql = _HISTORY_SQL.get(sensor)
+        if sql is None:
+            raise ValueError(f"Unknown sensor: {sensor}")
+        
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(f"""
-                SELECT timestamp, {sensor}
-                FROM sensor_readings
-                WHERE timestamp BETWEEN ? AND ?
-                AND {sensor} IS NOT NULL
-                ORDER BY timestamp
-            """, (start_time, end_time))
-            
-            rows = cursor.fetchall()
+            cursor = self.conn.execute(sql, (start_time, end_time))
             return [
-                {
-                    'timestamp': row['timestamp'],
-                    'value': row[sensor]
-                }
-                for row in rows
+                {'timestamp': row[0], 'value': row[1]}
+                for row in cursor.fetchall()
             ]
             
         except Exception as e:
@@ -280,42 +496,40 @@ class DatabaseManager:
             logger.error(f"Error getting alerts: {e}")
             return []
     
+    def rebuild_rollup(self, day=None):
+        """
+        Queue a recompute of the stored summary for one day (UTC, as
+        timestamps are stored). It goes through the writer after any
+        readings already queued; flush() to wait for it.
+        """
+        if day is None:
+            day = datetime.now(timezone.utc)
+        self._write_q.put((_ROLLUP_SQL, _day_bounds(day), False))
+    
     def get_daily_summary(self, date: datetime = None) -> Dict:
         """Get daily summary statistics"""
         if date is None:
-            date = datetime.now()
-        
-        start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + timedelta(days=1)
+            date = datetime.now(timezone.utc)
+        bounds = _day_bounds(date)
+        day = bounds['day']
+        completed = day < datetime.now(timezone.utc).strftime('%Y-%m-%d')
         
         try:
-            cursor = self.conn.cursor()
-            
-            # Get sensor statistics
-            cursor.execute("""
-                SELECT 
-                    AVG(ph) as avg_ph, MIN(ph) as min_ph, MAX(ph) as max_ph,
-                    AVG(ec) as avg_ec, MIN(ec) as min_ec, MAX(ec) as max_ec,
-                    AVG(do) as avg_do, MIN(do) as min_do, MAX(do) as max_do,
-                    AVG(temp_reservoir) as avg_temp,
-                    COUNT(*) as reading_count
-                FROM sensor_readings
-                WHERE timestamp BETWEEN ? AND ?
-            """, (start_of_day, end_of_day))
-            
-            row = cursor.fetchone()
-            
-            # Get alert count
-            cursor.execute("""
-                SELECT COUNT(*) as alert_count
-                FROM alerts
-                WHERE timestamp BETWEEN ? AND ?
-            """, (start_of_day, end_of_day))
-            
-            alert_count = cursor.fetchone()['alert_count']
+            row = None
+            if completed:
+                row = self.conn.execute(
+                    "SELECT * FROM sensor_rollups_daily WHERE day = ?", (day,)
+                ).fetchone()
+            
+            # Today is still filling up, so it is aggregated on read and never
+            # stored; a completed day missing its rollup is stored for next time
+            if row is None:
+                row = self.conn.execute(_DAILY_STATS_SQL, bounds).fetchone()
+                if completed:
+                    self.rebuild_rollup(date)
             
             return {
-                'date': date.strftime('%Y-%m-%d'),
+                'date': day,
                 'sensors': {
                     'ph': {
                         'avg': row['avg_ph'],
@@ -335,7 +549,7 @@ class DatabaseManager:
                     'temp': row['avg_temp']
                 },
                 'reading_count': row['reading_count'],
-                'alert_count': alert_count
+                'alert_count': row['alert_count']
             }
             
         except Exception as e:
@@ -348,49 +562,79 @@ class DatabaseManager:
             cutoff_date = datetime.now() - timedelta(days=days_to_keep)
             cursor = self.conn.cursor()
             
-            # Delete old sensor readings
+            # Summarize days about to be pruned so their summaries survive
             cursor.execute("""
-                DELETE FROM sensor_readings
+                SELECT DISTINCT date(timestamp) AS day
+                FROM sensor_readings
                 WHERE timestamp < ?
+                AND date(timestamp) NOT IN (SELECT day FROM sensor_rollups_daily)
             """, (cutoff_date,))
-            
-            # Delete old acknowledged alerts
-            cursor.execute("""
-                DELETE FROM alerts
-                WHERE timestamp < ? AND acknowledged = 1
-            """, (cutoff_date,))
-            
-            self.conn.commit()
+            for row in cursor.fetchall():
+                self.rebuild_rollup(datetime.strptime(row['day'], '%Y-%m-%d'))
+            # The rollups must be stored before their readings are deleted
+            if not self.flush():
+                logger.error("Skipping cleanup: database writer is not running")
+                return
+            
+            with _immediate_transaction(self.conn):
+                # Delete old sensor readings
+                cursor.execute("""
+                    DELETE FROM sensor_readings
+                    WHERE timestamp < ?
+                """, (cutoff_date,))
+                
+                # Delete old acknowledged alerts
+                cursor.execute("""
+                    DELETE FROM alerts
+                    WHERE timestamp < ? AND acknowledged = 1
+                """, (cutoff_date,))
             logger.info(f"Cleaned up data older than {days_to_keep} days")
             
         except Exception as e:
             logger.error(f"Error cleaning up old data: {e}")
     
-    def export_data(
+    def iter_csv(
         self,
         start_time: datetime,
         end_time: datetime,
-        output_file: str
-    ):
-        """Export data to CSV"""
+        chunk_rows: int = 500
+    ) -> Iterator[str]:
+        """Yield sensor readings as CSV text, a chunk of rows at a time"""
+        # Own connection: the cursor stays open while a response streams,
+        # and WAL lets it read alongside the logging connection
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
         try:
-            import csv
-            
-            cursor = self.conn.cursor()
-            cursor.execute("""
+            cursor = conn.execute("""
                 SELECT * FROM sensor_readings
                 WHERE timestamp BETWEEN ? AND ?
                 ORDER BY timestamp
             """, (start_time, end_time))
             
-            rows = cursor.fetchall()
-            
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(column[0] for column in cursor.description)
+            while True:
+                writer.writerows(cursor.fetchmany(chunk_rows))
+                chunk = buffer.getvalue()
+                if not chunk:
+                    break
+                yield chunk
+                buffer.seek(0)
+                buffer.truncate()
+        finally:
+            conn.close()
+    
+    def export_data(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        output_file: str
+    ):
+        """Export data to CSV"""
+        try:
             with open(output_file, 'w', newline='') as f:
-                if rows:
-                    writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-                    writer.writeheader()
-                    for row in rows:
-                        writer.writerow(dict(row))
+                for chunk in self.iter_csv(start_time, end_time):
+                    f.write(chunk)
             
             logger.info(f"Exported data to {output_file}")
             
@@ -399,8 +643,14 @@ class DatabaseManager:
     
     def close(self):
         """Close database connections"""
+        # Let the writer finish everything queued before it
+        self._write_q.put(None)
+        self._writer.join()
         if self.conn:
             self.conn.close()
+        if self.influx_write_api:
+            # Flush points still waiting in the batch queue
+            self.influx_write_api.close()
         if self.influx_client:
             self.influx_client.close()
         logger.info("Database connections closed")
@@ -5,11 +5,15 @@ Detects nutrient deficiencies, diseases, and pest issues
 
 import logging
 import time
-from typing import Dict, List, Optional
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple, Union
 from pathlib import Path
 import numpy as np
 from PIL import Image
 
+from hydroponics.sensors.interfaces import SensorSnapshot
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -20,123 +24,216 @@ except ImportError:
 
 try:
     from picamera2 import Picamera2
-    import cv2
 except ImportError:
-    logger.warning("picamera2/opencv not found, using mock camera")
+    logger.warning("picamera2 not found, using mock camera")
     Picamera2 = None
+
+try:
+    import cv2
+except ImportError:
+    logger.warning("opencv not found, resizing images with PIL")
     cv2 = None
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+# Standalone XNNPACK delegate; recent tflite-runtime builds apply XNNPACK to
+# float ops by default, so a missing library only logs and falls back
+_XNNPACK_DELEGATE = 'libtensorflowlite_xnnpack_delegate.so'
+
+def _resize_normalize_loop(src, dst):
+    """
+    Bilinear resize of a uint8 HxWxC image into float32 dst, scaled to 0-1
+    Reads each source pixel and writes each output value once (compiled
+    with Numba, rows in parallel); extra source channels are ignored.
+    """
+    in_h, in_w = src.shape[0], src.shape[1]
+    out_h, out_w, channels = dst.shape
+    scale_y = in_h / out_h
+    scale_x = in_w / out_w
+    inv_255 = np.float32(1.0 / 255.0)
+    
+    for y in prange(out_h):
+        fy = max((y + 0.5) * scale_y - 0.5, 0.0)
+        y0 = int(fy)
+        y1 = min(y0 + 1, in_h - 1)
+        wy = np.float32(fy - y0)
+        for x in range(out_w):
+            fx = max((x + 0.5) * scale_x - 0.5, 0.0)
+            x0 = int(fx)
+            x1 = min(x0 + 1, in_w - 1)
+            wx = np.float32(fx - x0)
+            for c in range(channels):
+                top = src[y0, x0, c] + (np.float32(src[y0, x1, c]) - src[y0, x0, c]) * wx
+                bottom = src[y1, x0, c] + (np.float32(src[y1, x1, c]) - src[y1, x0, c]) * wx
+                dst[y, x, c] = (top + (bottom - top) * wy) * inv_255
+
+
+_resize_normalize = (
+    njit(parallel=True, fastmath=True, cache=True)(_resize_normalize_loop) if njit else None
+)
+
+
+# Prebuilt mock predictions cycled through in mock mode
+_MOCK_RING_SIZE = 64
+
+# Sensor context notes added by analyze_with_context
+_CONTEXT_MESSAGES = {
+    'ph_low': "pH is low ({:.1f}) - this may cause nutrient lockout",
+    'ph_high': "pH is high ({:.1f}) - iron and other micronutrients may be unavailable",
+    'ec_low': "EC is low ({:.2f} mS/cm) - plants may be underfed",
+    'ec_high': "EC is high ({:.2f} mS/cm) - risk of nutrient burn",
+    'temp_low': "Water temperature low ({:.1f}Â°C) - slows nutrient uptake",
+    'temp_high': "Water temperature high ({:.1f}Â°C) - increases disease risk",
+    'do_low': "Low dissolved oxygen ({:.1f} mg/L) - root health may be compromised",
+}
+
+
+@lru_cache(maxsize=512)
+def _context_message(kind: str, value: float) -> str:
+    """Context note for a reading, rounded to its display precision"""
+    return _CONTEXT_MESSAGES[kind].format(value)
+
+
+# Plant disease/deficiency classes, in model output order
+CLASS_LABELS = (
+    'healthy',
+    'nitrogen_deficiency',
+    'iron_deficiency',
+    'phosphorus_deficiency',
+    'potassium_deficiency',
+    'magnesium_deficiency',
+    'calcium_deficiency',
+    'fungal_disease',
+    'bacterial_disease',
+    'pest_damage',
+    'water_stress',
+    'light_stress',
+    'temperature_stress'
+)
+_CLASS_LABELS_ARR = np.asarray(CLASS_LABELS)
+
+# Recommendations for each issue; read-only so results can share them
+RECOMMENDATIONS: Mapping[str, Tuple[str, ...]] = MappingProxyType({
+    'healthy': ('Continue current nutrient regimen', 'Monitor regularly'),
+    'nitrogen_deficiency': (
+        'Increase nutrient solution concentration',
+        'Check EC levels (target 1.2-1.8 mS/cm)',
+        'Increase feeding frequency if needed',
+        'Verify pH is in optimal range (5.8-6.2)'
+    ),
+    'iron_deficiency': (
+        'Check pH - iron uptake blocked above pH 7.0',
+        'Add chelated iron supplement',
+        'Verify EC not too high (>2.5 causes lockout)',
+        'Ensure adequate oxygenation'
+    ),
+    'phosphorus_deficiency': (
+        'Increase bloom/fruiting nutrients if flowering',
+        'Check pH (optimal P uptake at 6.0-6.5)',
+        'Verify water temperature (cold <15Â°C reduces uptake)',
+        'Add phosphorus supplement'
+    ),
+    'potassium_deficiency': (
+        'Add potassium supplement',
+        'Check EC levels - may need increase',
+        'Verify pH in optimal range',
+        'Check for salt buildup (flush if needed)'
+    ),
+    'magnesium_deficiency': (
+        'Add Epsom salt (magnesium sulfate)',
+        'Check pH - Mg uptake best at 6.0-6.5',
+        'Reduce calcium if very high (Ca competes with Mg)',
+        'Apply foliar spray for quick fix'
+    ),
+    'calcium_deficiency': (
+        'Increase calcium in nutrient solution',
+        'Check pH - Ca uptake best at 6.2-6.5',
+        'Improve air circulation (Ca moves with transpiration)',
+        'Verify adequate water uptake'
+    ),
+    'fungal_disease': (
+        'Remove infected leaves immediately',
+        'Reduce humidity below 60%',
+        'Improve air circulation',
+        'Apply organic fungicide if needed',
+        'Check reservoir for algae/contamination'
+    ),
+    'bacterial_disease': (
+        'Remove infected plants/leaves',
+        'Disinfect system components',
+        'Check water temperature (keep below 22Â°C)',
+        'Verify DO levels adequate (>5 mg/L)',
+        'Consider UV sterilization'
+    ),
+    'pest_damage': (
+        'Inspect plants for insects',
+        'Apply organic pest control if needed',
+        'Introduce beneficial insects',
+        'Improve airflow',
+        'Check for entry points'
+    ),
+    'water_stress': (
+        'Check water level in reservoir',
+        'Verify pump operation',
+        'Inspect for clogs in system',
+        'Check root health',
+        'Verify adequate DO levels'
+    ),
+    'light_stress': (
+        'Check light intensity and distance',
+        'Verify timer settings',
+        'Ensure 14-16 hours light for leafy greens',
+        'Check for light burn (too close)',
+        'Verify spectrum appropriate for growth stage'
+    ),
+    'temperature_stress': (
+        'Check reservoir temperature (target 18-22Â°C)',
+        'Check air temperature (target 20-24Â°C)',
+        'Add heater if too cold',
+        'Add chiller or cooling if too hot',
+        'Improve ventilation'
+    )
+})
+
+_DEFAULT_RECOMMENDATIONS = ('Monitor plant health', 'Check all parameters')
+
 
 class PlantHealthAnalyzer:
     """Analyze plant health using computer vision and ML"""
     
+    # libcamera allows one owner per sensor and opening it builds the whole
+    # pipeline, so the Picamera2 object and its config are shared and reused
+    _camera_singleton = None
+    _still_config = None
+    
     def __init__(self, model_path: str = "models/plant_disease.tflite"):
         self.model_path = model_path
         self.interpreter = None
         self.input_details = None
         self.output_details = None
+        self._batch_size = 1  # batch dimension the tensors are allocated for
+        self._preproc_buf = None  # float input reused by the fused preprocess
+        # Accessor for a view of the model's input tensor; call it afresh for
+        # each use and never hold the view across invoke() or a reallocation
+        self._input_tensor = None
         self.camera = None
+        self._warmed_up = False  # auto-exposure settled since camera start
         self.mock_mode = tflite is None or Picamera2 is None
         
-        # Plant disease/deficiency classes
-        self.class_labels = [
-            'healthy',
-            'nitrogen_deficiency',
-            'iron_deficiency',
-            'phosphorus_deficiency',
-            'potassium_deficiency',
-            'magnesium_deficiency',
-            'calcium_deficiency',
-            'fungal_disease',
-            'bacterial_disease',
-            'pest_damage',
-            'water_stress',
-            'light_stress',
-            'temperature_stress'
-        ]
+        self.class_labels = CLASS_LABELS
+        self.recommendations = RECOMMENDATIONS
         
-        # Recommendations for each issue
-        self.recommendations = {
-            'healthy': ['Continue current nutrient regimen', 'Monitor regularly'],
-            'nitrogen_deficiency': [
-                'Increase nutrient solution concentration',
-                'Check EC levels (target 1.2-1.8 mS/cm)',
-                'Increase feeding frequency if needed',
-                'Verify pH is in optimal range (5.8-6.2)'
-            ],
-            'iron_deficiency': [
-                'Check pH - iron uptake blocked above pH 7.0',
-                'Add chelated iron supplement',
-                'Verify EC not too high (>2.5 causes lockout)',
-                'Ensure adequate oxygenation'
-            ],
-            'phosphorus_deficiency': [
-                'Increase bloom/fruiting nutrients if flowering',
-                'Check pH (optimal P uptake at 6.0-6.5)',
-                'Verify water temperature (cold <15Â°C reduces uptake)',
-                'Add phosphorus supplement'
-            ],
-            'potassium_deficiency': [
-                'Add potassium supplement',
-                'Check EC levels - may need increase',
-                'Verify pH in optimal range',
-                'Check for salt buildup (flush if needed)'
-            ],
-            'magnesium_deficiency': [
-                'Add Epsom salt (magnesium sulfate)',
-                'Check pH - Mg uptake best at 6.0-6.5',
-                'Reduce calcium if very high (Ca competes with Mg)',
-                'Apply foliar spray for quick fix'
-            ],
-            'calcium_deficiency': [
-                'Increase calcium in nutrient solution',
-                'Check pH - Ca uptake best at 6.2-6.5',
-                'Improve air circulation (Ca moves with transpiration)',
-                'Verify adequate water uptake'
-            ],
-            'fungal_disease': [
-                'Remove infected leaves immediately',
-                'Reduce humidity below 60%',
-                'Improve air circulation',
-                'Apply organic fungicide if needed',
-                'Check reservoir for algae/contamination'
-            ],
-            'bacterial_disease': [
-                'Remove infected plants/leaves',
-                'Disinfect system components',
-                'Check water temperature (keep below 22Â°C)',
-                'Verify DO levels adequate (>5 mg/L)',
-                'Consider UV sterilization'
-            ],
-            'pest_damage': [
-                'Inspect plants for insects',
-                'Apply organic pest control if needed',
-                'Introduce beneficial insects',
-                'Improve airflow',
-                'Check for entry points'
-            ],
-            'water_stress': [
-                'Check water level in reservoir',
-                'Verify pump operation',
-                'Inspect for clogs in system',
-                'Check root health',
-                'Verify adequate DO levels'
-            ],
-            'light_stress': [
-                'Check light intensity and distance',
-                'Verify timer settings',
-                'Ensure 14-16 hours light for leafy greens',
-                'Check for light burn (too close)',
-                'Verify spectrum appropriate for growth stage'
-            ],
-            'temperature_stress': [
-                'Check reservoir temperature (target 18-22Â°C)',
-                'Check air temperature (target 20-24Â°C)',
-                'Add heater if too cold',
-                'Add chiller or cooling if too hot',
-                'Improve ventilation'
-            ]
-        }
+        # Mock predictions, sampled once; "healthy" is made most likely
+        self._mock_ring = np.random.dirichlet(
+            np.ones(len(self.class_labels)), size=_MOCK_RING_SIZE
+        ).astype(np.float32)
+        self._mock_ring[:, 0] = 0.85
+        self._mock_ring /= self._mock_ring.sum(axis=1, keepdims=True)
+        self._mock_idx = 0
     
     def load_model(self):
         """Load TFLite model"""
@@ -152,14 +249,25 @@ class PlantHealthAnalyzer:
                 logger.info("Downloading default PlantVillage model...")
                 self._download_default_model()
             
-            self.interpreter = tflite.Interpreter(model_path=str(model_file))
+            try:
+                delegates = [tflite.load_delegate(_XNNPACK_DELEGATE)]
+            except (ValueError, OSError):
+                logger.info("XNNPACK delegate library not found, using built-in kernels")
+                delegates = []
+            
+            self.interpreter = tflite.Interpreter(
+                model_path=str(model_file),
+                experimental_delegates=delegates
+            )
             self.interpreter.allocate_tensors()
             
             self.input_details = self.interpreter.get_input_details()
             self.output_details = self.interpreter.get_output_details()
+            self._input_tensor = self.interpreter.tensor(self.input_details[0]['index'])
             
             logger.info(f"ML model loaded: {self.model_path}")
-            logger.info(f"Input shape: {self.input_details[0]['shape']}")
+            logger.info(f"Input shape: {self.input_details[0]['shape']}, "
+                        f"dtype: {np.dtype(self.input_details[0]['dtype']).name}")
             
         except Exception as e:
             logger.error(f"Error loading ML model: {e}")
@@ -185,12 +293,20 @@ class PlantHealthAnalyzer:
             return
         
         try:
-            self.camera = Picamera2()
-            config = self.camera.create_still_configuration(
-                main={"size": (640, 640)},
-                controls={"ExposureTime": 20000, "AnalogueGain": 2.0}
-            )
-            self.camera.configure(config)
+            cls = PlantHealthAnalyzer
+            if cls._camera_singleton is None:
+                cls._camera_singleton = Picamera2()
+                cls._still_config = cls._camera_singleton.create_still_configuration(
+                    main={"size": (640, 640)},
+                    controls={"ExposureTime": 20000, "AnalogueGain": 2.0}
+                )
+            self.camera = cls._camera_singleton
+            # Re-init after a failure only reconfigures the open camera
+            self.camera.stop()
+            self.camera.configure(cls._still_config)
+            # Kept running between captures so exposure settles only once
+            self.camera.start()
+            self._warmed_up = False
             logger.info("Camera initialized")
         except Exception as e:
             logger.error(f"Error initializing camera: {e}")
@@ -206,17 +322,27 @@ class PlantHealthAnalyzer:
             if self.camera is None:
                 self.initialize_camera()
             
-            self.camera.start()
-            time.sleep(2)  # Allow camera to adjust
-            
-            image = self.camera.capture_array()
-            self.camera.stop()
+            if not self._warmed_up:
+                time.sleep(2)  # Allow camera to adjust
+                self._warmed_up = True
             
-            return image
+            return self.camera.capture_array()
         except Exception as e:
             logger.error(f"Error capturing image: {e}")
             return None
     
+    def close(self):
+        """Stop and release the camera"""
+        if self.camera is not None:
+            try:
+                self.camera.stop()
+                self.camera.close()
+            except Exception as e:
+                logger.error(f"Error closing camera: {e}")
+            self.camera = None
+            PlantHealthAnalyzer._camera_singleton = None
+            PlantHealthAnalyzer._still_config = None
+    
     def preprocess_image(self, image: np.ndarray) -> np.ndarray:
         """Preprocess image for model input"""
         try:
@@ -225,71 +351,160 @@ class PlantHealthAnalyzer:
                 return np.random.rand(1, 224, 224, 3).astype(np.float32)
             
             input_shape = self.input_details[0]['shape']
+            input_dtype = self.input_details[0]['dtype']
             height, width = input_shape[1], input_shape[2]
             
-            # Convert to PIL Image
-            img = Image.fromarray(image)
+            # Float models with Numba: resize, cast and normalize in one pass
+            # into a reused buffer (set_tensor copies it into the model)
+            if _resize_normalize is not None and input_dtype == np.float32:
+                shape = (1, height, width, input_shape[3])
+                if self._preproc_buf is None or self._preproc_buf.shape != shape:
+                    self._preproc_buf = np.empty(shape, dtype=np.float32)
+                _resize_normalize(np.ascontiguousarray(image), self._preproc_buf[0])
+                return self._preproc_buf
             
-            # Resize to model input size
-            img = img.resize((width, height), Image.Resampling.LANCZOS)
+            # Resize to model input size (OpenCV works on the array in place
+            # of a PIL round trip; INTER_AREA suits downscaling)
+            if cv2 is not None:
+                resized = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+            else:
+                resized = np.asarray(Image.fromarray(image).resize((width, height), Image.Resampling.LANCZOS))
             
-            # Convert to numpy array and normalize
-            img_array = np.array(img, dtype=np.float32)
-            img_array = img_array / 255.0
+            # Full-integer models take the pixels as they are (uint8) or
+            # quantized with the input tensor's scale and zero point (int8)
+            if input_dtype == np.uint8:
+                return resized[None, ...]
+            if input_dtype == np.int8:
+                scale, zero_point = self.input_details[0]['quantization']
+                quantized = np.rint(resized / (255.0 * scale)) + zero_point
+                return np.clip(quantized, -128, 127).astype(np.int8)[None, ...]
             
-            # Add batch dimension
-            img_array = np.expand_dims(img_array, axis=0)
+            # Cast and normalize in one pass
+            img_array = np.empty(resized.shape, dtype=np.float32)
+            np.multiply(resized, np.float32(1 / 255.0), out=img_array)
             
-            return img_array
+            # Add batch dimension (a view, no copy)
+            return img_array[None, ...]
         except Exception as e:
             logger.error(f"Error preprocessing image: {e}")
             return None
     
     def run_inference(self, input_data: np.ndarray) -> np.ndarray:
         """Run ML inference on preprocessed image"""
+        predictions = self.run_inference_batch(input_data)
+        return None if predictions is None else predictions[0]
+    
+    def run_inference_batch(self, input_data: np.ndarray) -> np.ndarray:
+        """
+        Run ML inference on a batch of preprocessed images in one invoke
+        
+        Args:
+            input_data: Images stacked on the first axis, shape (N, H, W, 3)
+        
+        Returns:
+            Class probabilities, shape (N, classes)
+        """
         try:
             if self.mock_mode:
-                # Mock inference - simulate realistic distribution
-                predictions = np.random.dirichlet(np.ones(len(self.class_labels)), size=1)[0]
-                predictions[0] = 0.85  # Make "healthy" most likely in mock
-                return predictions / predictions.sum()  # Normalize
+                # Mock inference - next rows of the prebuilt distribution ring
+                rows = (self._mock_idx + np.arange(len(input_data))) % _MOCK_RING_SIZE
+                self._mock_idx += len(input_data)
+                return self._mock_ring[rows]
             
+            self._ensure_batch_size(len(input_data))
             self.interpreter.set_tensor(self.input_details[0]['index'], input_data)
+        except Exception as e:
+            logger.error(f"Error running inference: {e}")
+            return None
+        return self._invoke()
+    
+    def _invoke(self) -> Optional[np.ndarray]:
+        """Run the model on its loaded input tensor; probabilities (N, classes)"""
+        try:
             self.interpreter.invoke()
             output_data = self.interpreter.get_tensor(self.output_details[0]['index'])
             
-            return output_data[0]
+            # Dequantize full-integer model outputs back to probabilities
+            if output_data.dtype in (np.uint8, np.int8):
+                scale, zero_point = self.output_details[0]['quantization']
+                output_data = (output_data.astype(np.float32) - zero_point) * scale
+            
+            return output_data
         except Exception as e:
             logger.error(f"Error running inference: {e}")
             return None
     
-    def analyze(self) -> Dict:
+    def _ensure_batch_size(self, batch_size: int):
+        """Reallocate the model tensors for a new batch dimension"""
+        if batch_size == self._batch_size:
+            return
+        
+        shape = list(self.input_details[0]['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self.input_details[0]['index'], shape, strict=False)
+        self.interpreter.allocate_tensors()
+        
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        self._input_tensor = self.interpreter.tensor(self.input_details[0]['index'])
+        self._batch_size = batch_size
+        logger.info(f"ML model tensors resized for batch of {batch_size}")
+    
+    def analyze(self, frames: int = 1) -> Dict:
         """
         Perform complete plant health analysis
         Returns dict with status, issues, confidence, and recommendations
+        
+        With frames > 1, that many images are captured and classified in a
+        single batched inference, and their predictions averaged.
         """
         try:
             logger.info("Starting plant health analysis...")
             
-            # Capture image
-            image = self.capture_image()
-            if image is None:
-                return self._error_result("Failed to capture image")
+            # Float models with the fused kernel are preprocessed straight
+            # into the interpreter's input tensor, skipping set_tensor's copy
+            direct = (
+                not self.mock_mode and _resize_normalize is not None
+                and self.input_details[0]['dtype'] == np.float32
+            )
+            if direct:
+                self._ensure_batch_size(frames)
             
-            # Preprocess
-            input_data = self.preprocess_image(image)
-            if input_data is None:
-                return self._error_result("Failed to preprocess image")
+            input_data = None
+            for i in range(frames):
+                # Capture image
+                image = self.capture_image()
+                if image is None:
+                    return self._error_result("Failed to capture image")
+                
+                if direct:
+                    _resize_normalize(np.ascontiguousarray(image), self._input_tensor()[i])
+                    continue
+                
+                # Preprocess
+                frame = self.preprocess_image(image)
+                if frame is None:
+                    return self._error_result("Failed to preprocess image")
+                
+                if frames == 1:
+                    input_data = frame
+                else:
+                    if input_data is None:
+                        input_data = np.empty((frames,) + frame.shape[1:], dtype=frame.dtype)
+                    input_data[i] = frame[0]
             
             # Run inference
-            predictions = self.run_inference(input_data)
+            predictions = self._invoke() if direct else self.run_inference_batch(input_data)
             if predictions is None:
                 return self._error_result("Failed to run inference")
+            predictions = predictions.mean(axis=0)
             
-            # Get top predictions
-            top_indices = np.argsort(predictions)[-3:][::-1]
-            top_classes = [self.class_labels[i] for i in top_indices]
-            top_confidences = [float(predictions[i]) for i in top_indices]
+            # Get top predictions (partial selection, then order just those)
+            k = min(3, len(predictions))
+            top_k = np.argpartition(predictions, -k)[-k:]
+            top_indices = top_k[np.argsort(-predictions[top_k])]
+            top_classes = _CLASS_LABELS_ARR[top_indices].tolist()
+            top_confidences = predictions[top_indices].tolist()
             
             # Determine overall status
             primary_class = top_classes[0]
@@ -315,8 +530,7 @@ class PlantHealthAnalyzer:
             # Get recommendations
             if primary_class != 'healthy':
                 result['recommendations'] = self.recommendations.get(
-                    primary_class,
-                    ['Monitor plant health', 'Check all parameters']
+                    primary_class, _DEFAULT_RECOMMENDATIONS
                 )
             else:
                 result['recommendations'] = self.recommendations['healthy']
@@ -339,7 +553,7 @@ class PlantHealthAnalyzer:
             'error': error_msg
         }
     
-    def analyze_with_context(self, sensor_data: Dict) -> Dict:
+    def analyze_with_context(self, sensor_data: Union[SensorSnapshot, Dict]) -> Dict:
         """
         Enhanced analysis incorporating sensor data
         Helps disambiguate visual symptoms
@@ -349,55 +563,46 @@ class PlantHealthAnalyzer:
         if result['status'] == 'error':
             return result
         
+        # Plain dicts (system_state['sensors']) are still accepted
+        if isinstance(sensor_data, dict):
+            sensor_data = SensorSnapshot.from_dict(sensor_data)
+        
         # Add context-aware recommendations based on sensor data
-        ph = sensor_data.get('ph')
-        ec = sensor_data.get('ec')
-        temp = sensor_data.get('temp_reservoir')
-        do_level = sensor_data.get('do')
+        ph = sensor_data.ph
+        ec = sensor_data.ec
+        temp = sensor_data.temp_reservoir
+        do_level = sensor_data.do
         
         context_recommendations = []
         
         # pH context
         if ph is not None:
             if ph < 5.5:
-                context_recommendations.append(
-                    f"pH is low ({ph:.1f}) - this may cause nutrient lockout"
-                )
+                context_recommendations.append(_context_message('ph_low', round(ph, 1)))
             elif ph > 7.0:
-                context_recommendations.append(
-                    f"pH is high ({ph:.1f}) - iron and other micronutrients may be unavailable"
-                )
+                context_recommendations.append(_context_message('ph_high', round(ph, 1)))
         
         # EC context
         if ec is not None:
             if ec < 0.8:
-                context_recommendations.append(
-                    f"EC is low ({ec:.2f} mS/cm) - plants may be underfed"
-                )
+                context_recommendations.append(_context_message('ec_low', round(ec, 2)))
             elif ec > 2.5:
-                context_recommendations.append(
-                    f"EC is high ({ec:.2f} mS/cm) - risk of nutrient burn"
-                )
+                context_recommendations.append(_context_message('ec_high', round(ec, 2)))
         
         # Temperature context
         if temp is not None:
             if temp < 16:
-                context_recommendations.append(
-                    f"Water temperature low ({temp:.1f}Â°C) - slows nutrient uptake"
-                )
+                context_recommendations.append(_context_message('temp_low', round(temp, 1)))
             elif temp > 24:
-                context_recommendations.append(
-                    f"Water temperature high ({temp:.1f}Â°C) - increases disease risk"
-                )
+                context_recommendations.append(_context_message('temp_high', round(temp, 1)))
         
         # DO context
         if do_level is not None:
             if do_level < 5:
-                context_recommendations.append(
-                    f"Low dissolved oxygen ({do_level:.1f} mg/L) - root health may be compromised"
-                )
+                context_recommendations.append(_context_message('do_low', round(do_level, 1)))
         
         if context_recommendations:
-            result['recommendations'].extend(context_recommendations)
+            # analyze() hands back a shared RECOMMENDATIONS tuple
+            result['recommendations'] = [*result['recommendations'], *context_recommendations]
         
         return result
@@ -2,18 +2,24 @@
 Sensor interface modules for Atlas Scientific and other sensors
 """
 
+import os
+import sys
+import threading
 import time
 import logging
-from typing import Optional, Dict
-import glob
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Dict, Tuple
 
 logger = logging.getLogger(__name__)
 
 try:
-    from atlas_i2c import AtlasI2C
+    from smbus2 import SMBus, i2c_msg
 except ImportError:
-    logger.warning("atlas_i2c not installed, using mock sensors")
-    AtlasI2C = None
+    logger.warning("smbus2 not installed, using mock sensors")
+    SMBus = None
+    i2c_msg = None
 
 try:
     from gpiozero import DigitalOutputDevice, DistanceSensor
@@ -22,6 +28,44 @@ except ImportError:
     DigitalOutputDevice = None
     DistanceSensor = None
 
+try:
+    import pigpio
+except ImportError:
+    pigpio = None
+
+# Seconds an EZO circuit needs to answer "R" (datasheet processing delays)
+_ATLAS_READ_DELAYS = {'ph': 0.9, 'ec': 0.6, 'do': 0.6}
+
+# Polling for a reading that is not ready yet
+_ATLAS_RETRY_SECONDS = 0.1
+_ATLAS_RETRIES = 5
+
+# EZO I2C protocol: a read returns a status byte, then NUL-terminated ASCII
+_ATLAS_I2C_BUS = 1
+_EZO_READ_BYTES = 31
+_EZO_SUCCESS = 1
+
+
+class _EZOCircuit:
+    """One Atlas Scientific EZO circuit on a shared SMBus"""
+    
+    def __init__(self, bus: 'SMBus', address: int):
+        self.bus = bus
+        self.address = address
+    
+    def write(self, command: str):
+        """Send a command as a single I2C write"""
+        self.bus.i2c_rdwr(i2c_msg.write(self.address, command.encode('ascii')))
+    
+    def read(self) -> Tuple[int, str]:
+        """Status code and payload of the last command, in one I2C read"""
+        msg = i2c_msg.read(self.address, _EZO_READ_BYTES)
+        self.bus.i2c_rdwr(msg)
+        raw = bytes(msg)
+        # The Pi's I2C controller can set the high bit on clock-stretched bytes
+        payload = bytes(b & 0x7F for b in raw[1:].split(b'\x00', 1)[0])
+        return raw[0], payload.decode('ascii')
+
 
 class AtlasSensors:
     """Interface for Atlas Scientific sensors (pH, EC, DO)"""
@@ -30,8 +74,10 @@ class AtlasSensors:
         self.ph_sensor = None
         self.ec_sensor = None
         self.do_sensor = None
+        self._bus = None
         self.initialized = False
-        self.mock_mode = AtlasI2C is None
+        self.mock_mode = SMBus is None
+        self._mock_tick = 0  # drives mock readings, no clock read needed
     
     def initialize(self):
         """Initialize all Atlas sensors"""
@@ -41,18 +87,20 @@ class AtlasSensors:
             return
         
         try:
+            self._bus = SMBus(_ATLAS_I2C_BUS)
+            
             # Initialize pH sensor (address 0x63)
-            self.ph_sensor = AtlasI2C(address=0x63)
+            self.ph_sensor = _EZOCircuit(self._bus, 0x63)
             self.ph_sensor.write("C,0")  # Disable continuous mode
             logger.info("pH sensor initialized at 0x63")
             
             # Initialize EC sensor (address 0x64)
-            self.ec_sensor = AtlasI2C(address=0x64)
+            self.ec_sensor = _EZOCircuit(self._bus, 0x64)
             self.ec_sensor.write("C,0")
             logger.info("EC sensor initialized at 0x64")
             
             # Initialize DO sensor (address 0x61)
-            self.do_sensor = AtlasI2C(address=0x61)
+            self.do_sensor = _EZOCircuit(self._bus, 0x61)
             self.do_sensor.write("C,0")
             logger.info("DO sensor initialized at 0x61")
             
@@ -62,50 +110,79 @@ class AtlasSensors:
             logger.error(f"Error initializing Atlas sensors: {e}")
             self.mock_mode = True
     
-    def read_ph(self) -> Optional[float]:
-        """Read pH value"""
+    def read_all(self) -> Dict[str, Optional[float]]:
+        """
+        Read pH, EC and DO together
+        
+        All three circuits are triggered back-to-back and measure at the same
+        time, so one reading costs the slowest sensor's delay, not the sum.
+        """
         if self.mock_mode:
-            return 6.8 + (time.time() % 10) * 0.05  # Mock data
+            return {name: self._mock_reading(name) for name in _ATLAS_READ_DELAYS}
         
-        try:
-            self.ph_sensor.write("R")
-            time.sleep(1)
-            response = self.ph_sensor.read()
-            if response.status_code == 1:
-                return float(response.data)
-        except Exception as e:
-            logger.error(f"Error reading pH: {e}")
-        return None
+        triggered = [name for name in _ATLAS_READ_DELAYS if self._trigger(name)]
+        if triggered:
+            time.sleep(max(_ATLAS_READ_DELAYS[name] for name in triggered))
+        
+        readings = dict.fromkeys(_ATLAS_READ_DELAYS)
+        for name in triggered:
+            readings[name] = self._collect(name)
+        return readings
+    
+    def read_ph(self) -> Optional[float]:
+        """Read pH value"""
+        return self._read_one('ph')
     
     def read_ec(self) -> Optional[float]:
         """Read EC/TDS value (in mS/cm)"""
-        if self.mock_mode:
-            return 1.2 + (time.time() % 8) * 0.05  # Mock data
-        
-        try:
-            self.ec_sensor.write("R")
-            time.sleep(1)
-            response = self.ec_sensor.read()
-            if response.status_code == 1:
-                # Response is in ÂµS/cm, convert to mS/cm
-                return float(response.data.split(',')[0]) / 1000
-        except Exception as e:
-            logger.error(f"Error reading EC: {e}")
-        return None
+        return self._read_one('ec')
     
     def read_do(self) -> Optional[float]:
         """Read dissolved oxygen (in mg/L)"""
+        return self._read_one('do')
+    
+    def _read_one(self, name: str) -> Optional[float]:
+        """Trigger and read a single sensor"""
         if self.mock_mode:
-            return 7.5 + (time.time() % 6) * 0.2  # Mock data
+            return self._mock_reading(name)
         
+        if not self._trigger(name):
+            return None
+        time.sleep(_ATLAS_READ_DELAYS[name])
+        return self._collect(name)
+    
+    def _mock_reading(self, name: str) -> float:
+        """Slowly varying, deterministic mock value for a sensor"""
+        self._mock_tick += 1
+        if name == 'ph':
+            return 6.8 + (self._mock_tick % 200) * 0.0025
+        elif name == 'ec':
+            return 1.2 + (self._mock_tick % 160) * 0.0025
+        return 7.5 + (self._mock_tick % 120) * 0.01
+    
+    def _trigger(self, name: str) -> bool:
+        """Ask a sensor to take a reading"""
+        try:
+            getattr(self, f"{name}_sensor").write("R")
+            return True
+        except Exception as e:
+            logger.error(f"Error reading {name.upper()}: {e}")
+            return False
+    
+    def _collect(self, name: str) -> Optional[float]:
+        """Fetch a triggered reading, polling briefly if it is not ready"""
+        sensor = getattr(self, f"{name}_sensor")
         try:
-            self.do_sensor.write("R")
-            time.sleep(1)
-            response = self.do_sensor.read()
-            if response.status_code == 1:
-                return float(response.data)
+            for attempt in range(_ATLAS_RETRIES):
+                status, data = sensor.read()
+                if status == _EZO_SUCCESS:
+                    if name == 'ec':
+                        # Response is in ÂµS/cm (first field), convert to mS/cm
+                        return float(data.partition(',')[0]) / 1000
+                    return float(data)
+                time.sleep(_ATLAS_RETRY_SECONDS)
         except Exception as e:
-            logger.error(f"Error reading DO: {e}")
+            logger.error(f"Error reading {name.upper()}: {e}")
         return None
     
     def set_temperature_compensation(self, temp_c: float):
@@ -174,6 +251,12 @@ class AtlasSensors:
             logger.info(f"DO calibration {point} complete")
         except Exception as e:
             logger.error(f"Error calibrating DO: {e}")
+    
+    def close(self):
+        """Release the I2C bus"""
+        if self._bus is not None:
+            self._bus.close()
+            self._bus = None
 
 
 class TemperatureSensors:
@@ -181,13 +264,20 @@ class TemperatureSensors:
     
     def __init__(self):
         self.sensors = {}
+        self._fds = {}  # sensor name -> open fd, read with pread each poll
+        self._pool = None  # one thread per sensor when there are several
         self.mock_mode = False
+        self._mock_tick = 0
         self.base_dir = '/sys/bus/w1/devices/'
     
     def initialize(self):
         """Find and initialize all DS18B20 sensors"""
         try:
-            device_folders = glob.glob(self.base_dir + '28-*')
+            try:
+                with os.scandir(self.base_dir) as entries:
+                    device_folders = [e.path for e in entries if e.name.startswith('28-')]
+            except FileNotFoundError:  # w1-gpio overlay not loaded
+                device_folders = []
             
             if not device_folders:
                 logger.warning("No DS18B20 sensors found, using mock mode")
@@ -198,9 +288,22 @@ class TemperatureSensors:
             sensor_names = ['reservoir', 'fish_tank']
             for i, folder in enumerate(device_folders):
                 sensor_name = sensor_names[i] if i < len(sensor_names) else f"sensor_{i}"
-                self.sensors[sensor_name] = folder + '/w1_slave'
+                # Newer kernels expose the bare millidegree value; older
+                # ones only the w1_slave CRC dump
+                device_file = folder + '/temperature'
+                if not os.path.exists(device_file):
+                    device_file = folder + '/w1_slave'
+                self.sensors[sensor_name] = device_file
+                self._fds[sensor_name] = os.open(device_file, os.O_RDONLY)
                 logger.info(f"Found temperature sensor: {sensor_name}")
             
+            # Each read blocks ~750 ms on the sensor's conversion, and w1_therm
+            # releases the bus while waiting, so conversions can overlap
+            if len(self.sensors) > 1:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=len(self.sensors), thread_name_prefix='w1-read'
+                )
+            
         except Exception as e:
             logger.error(f"Error initializing temperature sensors: {e}")
             self.mock_mode = True
@@ -208,33 +311,107 @@ class TemperatureSensors:
     def read_sensor(self, device_file: str) -> Optional[float]:
         """Read a single DS18B20 sensor"""
         try:
-            with open(device_file, 'r') as f:
-                lines = f.readlines()
-            
-            if lines[0].strip()[-3:] != 'YES':
-                return None
-            
-            equals_pos = lines[1].find('t=')
-            if equals_pos != -1:
-                temp_string = lines[1][equals_pos+2:]
-                temp_c = float(temp_string) / 1000.0
-                return temp_c
+            fd = os.open(device_file, os.O_RDONLY)
+            try:
+                return self._read_fd(fd, device_file)
+            finally:
+                os.close(fd)
         except Exception as e:
             logger.error(f"Error reading temperature sensor: {e}")
         return None
     
+    @staticmethod
+    def _read_fd(fd: int, device_file: str) -> Optional[float]:
+        """Read and parse a sensor file from the start (each read converts)"""
+        # Parsed as bytes: int() takes them directly and skips whitespace
+        raw = os.pread(fd, 128, 0)
+        
+        if device_file.endswith('/temperature'):
+            return int(raw) / 1000
+        
+        # w1_slave: "... crc=xx YES\n... t=21375\n"
+        crc_end = raw.find(b'\n')
+        if crc_end == -1 or raw[crc_end - 3:crc_end] != b'YES':
+            return None
+        equals_pos = raw.find(b't=', crc_end)
+        if equals_pos != -1:
+            return int(raw[equals_pos + 2:]) / 1000
+        return None
+    
     def read_all(self) -> Dict[str, Optional[float]]:
         """Read all temperature sensors"""
         if self.mock_mode:
+            self._mock_tick += 1
             return {
-                'reservoir': 20.0 + (time.time() % 5) * 0.5,
-                'fish_tank': 14.0 + (time.time() % 4) * 0.3
+                'reservoir': 20.0 + (self._mock_tick % 100) * 0.025,
+                'fish_tank': 14.0 + (self._mock_tick % 80) * 0.015
             }
         
-        readings = {}
-        for name, device_file in self.sensors.items():
-            readings[name] = self.read_sensor(device_file)
-        return readings
+        if self._pool is None:
+            return {name: self._read_named(name) for name in self.sensors}
+        return dict(zip(self.sensors, self._pool.map(self._read_named, self.sensors)))
+    
+    def _read_named(self, name: str) -> Optional[float]:
+        """Read one sensor through its cached descriptor"""
+        try:
+            return self._read_fd(self._fds[name], self.sensors[name])
+        except Exception as e:
+            logger.error(f"Error reading temperature sensor {name}: {e}")
+            return None
+    
+    def close(self):
+        """Stop the read threads and close the sensor files"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+
+# Water level reading; fields are None when the sensor could not be read
+WaterLevel = namedtuple("WaterLevel", "distance_cm water_level_cm water_level_percent")
+_NO_WATER_LEVEL = WaterLevel(None, None, None)
+
+# __slots__ dataclasses need Python 3.10+
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(frozen=True, **_SLOTS)
+class SensorSnapshot:
+    """One polling pass over every sensor"""
+    ph: Optional[float] = None
+    ec: Optional[float] = None
+    do: Optional[float] = None
+    temp_reservoir: Optional[float] = None
+    temp_fish_tank: Optional[float] = None
+    water_level: Optional[float] = None  # distance to the surface (cm)
+    water_level_percent: Optional[float] = None
+    
+    @classmethod
+    def from_dict(cls, readings: Dict) -> 'SensorSnapshot':
+        """Build from a system_state['sensors']-style dict"""
+        get = readings.get
+        return cls(get('ph'), get('ec'), get('do'), get('temp_reservoir'),
+                   get('temp_fish_tank'), get('water_level'), get('water_level_percent'))
+    
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        """Readings keyed as in system_state['sensors']"""
+        return {
+            'ph': self.ph,
+            'ec': self.ec,
+            'do': self.do,
+            'temp_reservoir': self.temp_reservoir,
+            'temp_fish_tank': self.temp_fish_tank,
+            'water_level': self.water_level,
+            'water_level_percent': self.water_level_percent
+        }
+
+# Speed of sound, halved for the round trip (cm per microsecond of echo)
+_ECHO_CM_PER_US = 0.0343 / 2
+
+# Longest wait for an echo; ~4 m and back takes about 23 ms
+_ECHO_TIMEOUT_SECONDS = 0.05
 
 
 class WaterLevelSensor:
@@ -242,10 +419,18 @@ class WaterLevelSensor:
     
     def __init__(self, echo_pin: int = 27, trigger_pin: int = 17):
         self.sensor = None
-        self.mock_mode = DistanceSensor is None
+        self.mock_mode = DistanceSensor is None and pigpio is None
         self.echo_pin = echo_pin
         self.trigger_pin = trigger_pin
         self.tank_height_cm = 60  # Adjust for your tank
+        self._mock_tick = 0
+        
+        # pigpio driver: echo edges timestamped by the daemon
+        self._pi = None
+        self._edge_callback = None
+        self._echo_done = threading.Event()
+        self._rise_tick = None
+        self._echo_us = None
     
     def initialize(self):
         """Initialize ultrasonic sensor"""
@@ -253,6 +438,16 @@ class WaterLevelSensor:
             logger.warning("Running water level in MOCK MODE")
             return
         
+        # pigpio times the echo in microseconds without a polling thread, but
+        # its daemon only runs on Pi 4 and earlier; otherwise use gpiozero
+        if pigpio is not None and self._initialize_pigpio():
+            return
+        
+        if DistanceSensor is None:
+            logger.warning("pigpio daemon not reachable, running water level in MOCK MODE")
+            self.mock_mode = True
+            return
+        
         try:
             self.sensor = DistanceSensor(
                 echo=self.echo_pin,
@@ -264,31 +459,77 @@ class WaterLevelSensor:
             logger.error(f"Error initializing water level sensor: {e}")
             self.mock_mode = True
     
-    def read_level(self) -> Dict[str, float]:
-        """Read water level"""
+    def _initialize_pigpio(self) -> bool:
+        """Set up the pigpio driver; False if the daemon is not running"""
+        try:
+            pi = pigpio.pi()
+            if not pi.connected:
+                pi.stop()
+                return False
+            pi.set_mode(self.trigger_pin, pigpio.OUTPUT)
+            pi.write(self.trigger_pin, 0)
+            pi.set_mode(self.echo_pin, pigpio.INPUT)
+            self._edge_callback = pi.callback(self.echo_pin, pigpio.EITHER_EDGE, self._on_echo_edge)
+            self._pi = pi
+            logger.info("Water level sensor initialized (pigpio)")
+            return True
+        except Exception as e:
+            logger.error(f"Error initializing pigpio water level sensor: {e}")
+            return False
+    
+    def _on_echo_edge(self, gpio: int, level: int, tick: int):
+        """pigpio callback: echo pulse width is the round-trip time"""
+        if level == 1:
+            self._rise_tick = tick
+        elif level == 0 and self._rise_tick is not None:
+            self._echo_us = pigpio.tickDiff(self._rise_tick, tick)
+            self._echo_done.set()
+    
+    def _measure_pigpio(self) -> Optional[float]:
+        """Send a trigger pulse and wait for the echo (pigpio driver)"""
+        self._echo_done.clear()
+        self._rise_tick = None
+        self._pi.gpio_trigger(self.trigger_pin, 10, 1)
+        if not self._echo_done.wait(_ECHO_TIMEOUT_SECONDS):
+            logger.error("Water level sensor: no echo")
+            return None
+        return self._echo_us * _ECHO_CM_PER_US
+    
+    def read_distance_cm(self) -> Optional[float]:
+        """Read the raw distance from sensor to water surface"""
         if self.mock_mode:
-            # Mock data
-            distance = 15.0 + (time.time() % 10)
-            water_level = self.tank_height_cm - distance
-            return {
-                'distance_cm': distance,
-                'water_level_cm': water_level,
-                'water_level_percent': (water_level / self.tank_height_cm) * 100
-            }
+            self._mock_tick += 1
+            return 15.0 + (self._mock_tick % 100) * 0.1  # Mock data
         
         try:
-            distance_cm = self.sensor.distance * 100
-            water_level_cm = self.tank_height_cm - distance_cm
-            water_level_percent = (water_level_cm / self.tank_height_cm) * 100
-            
-            return {
-                'distance_cm': distance_cm,
-                'water_level_cm': water_level_cm,
-                'water_level_percent': max(0, min(100, water_level_percent))
-            }
+            if self._pi is not None:
+                return self._measure_pigpio()
+            return self.sensor.distance * 100
         except Exception as e:
             logger.error(f"Error reading water level: {e}")
-            return {'distance_cm': None, 'water_level_cm': None, 'water_level_percent': None}
+            return None
+    
+    def read_level(self) -> WaterLevel:
+        """Read water level"""
+        distance_cm = self.read_distance_cm()
+        if distance_cm is None:
+            return _NO_WATER_LEVEL
+        
+        water_level_cm = self.tank_height_cm - distance_cm
+        water_level_percent = water_level_cm * (100.0 / self.tank_height_cm)
+        if not self.mock_mode:
+            water_level_percent = max(0, min(100, water_level_percent))
+        return WaterLevel(distance_cm, water_level_cm, water_level_percent)
+    
+    def close(self):
+        """Release the pigpio connection or gpiozero pins"""
+        if self._pi is not None:
+            self._edge_callback.cancel()
+            self._pi.stop()
+            self._pi = None
+        elif self.sensor is not None:
+            self.sensor.close()
+            self.sensor = None
 
 
 class RelayControl:
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import os
-import glob
 import time
 
 # Enable 1-Wire
@@ -10,10 +9,11 @@ os.system('modprobe w1-therm')
 # Find sensor
 base_dir = '/sys/bus/w1/devices/'
 try:
-    device_folder = glob.glob(base_dir + '28*')[0]
+    with os.scandir(base_dir) as entries:
+        device_folder = [e.path for e in entries if e.name.startswith('28')][0]
     device_file = device_folder + '/w1_slave'
     print(f"✓ Found temperature sensor: {device_folder.split('/')[-1]}")
-except IndexError:
+except (IndexError, FileNotFoundError):
     print("✗ No temperature sensor found!")
     print("  Check wiring and run: ls /sys/bus/w1/devices/")
     exit(1)
@@ -26,7 +26,7 @@ def read_temp():
     if lines[0].strip()[-3:] == 'YES':
         temp_pos = lines[1].find('t=')
         if temp_pos != -1:
-            temp_c = float(lines[1][temp_pos+2:]) / 1000.0
+            temp_c = int(lines[1][temp_pos+2:]) / 1000
             temp_f = temp_c * 9.0 / 5.0 + 32.0
             return temp_c, temp_f
     return None, None